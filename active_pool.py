@@ -0,0 +1,146 @@
+from typing import Dict, Iterable, List, Optional
+import random
+from .pick_policy import FenwickTree, PickPolicy
+
+# 加权抽样连续抽到不可捡的瓶子时，退回均匀抽样
+_MAX_WEIGHTED_TRIES = 32
+
+
+class _Bucket:
+    """数组 + 位置索引，支持 O(1) 的添加、随机访问与交换删除"""
+
+    __slots__ = ("items", "pos")
+
+    def __init__(self, items: Optional[List[Dict]] = None):
+        self.items: List[Dict] = items if items is not None else []
+        self.pos: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def add(self, bottle: Dict):
+        self.pos[bottle["bottle_id"]] = len(self.items)
+        self.items.append(bottle)
+
+    def remove(self, bottle_id: str) -> Optional[Dict]:
+        index = self.pos.pop(bottle_id, None)
+        if index is None:
+            return None
+        bottle = self.items[index]
+        last = self.items.pop()
+        if last is not bottle:
+            # 用末尾元素填补空位
+            self.items[index] = last
+            self.pos[last["bottle_id"]] = index
+        return bottle
+
+
+class ActivePool:
+    """
+    海面上的瓶中信池，按发送者分桶，随机捡起与删除均为 O(1)。
+    使用加权捡瓶策略时另用树状数组维护与 items 位置对应的权重，捡起与删除为 O(log n)
+    """
+
+    def __init__(self, items: List[Dict], policy: Optional[PickPolicy] = None):
+        # items 即持久化数据中的 active 列表，池内的增删直接作用于它
+        self._all = _Bucket(items)
+        self._by_sender: Dict[str, _Bucket] = {}
+        self.policy = policy if policy is not None and not policy.uniform else None
+        self._weights: Optional[FenwickTree] = None
+        bottles = list(items)
+        items.clear()
+        self.extend(bottles)
+        if self.policy is not None and self.policy.weighted:
+            # 启动时一次性建树，按原有顺序重现每个瓶中信放入时的投放者数量
+            counts: Dict[str, int] = {}
+            weights = []
+            for bottle in self._all.items:
+                sender_id = bottle.get("sender_id")
+                counts[sender_id] = counts.get(sender_id, 0) + 1
+                weights.append(self.policy.weight(bottle, counts[sender_id]))
+            self._weights = FenwickTree(weights)
+
+    def __len__(self) -> int:
+        return len(self._all)
+
+    def __contains__(self, bottle_id: str) -> bool:
+        return bottle_id in self._all.pos
+
+    def add(self, bottle: Dict):
+        self._all.add(bottle)
+        sender_id = bottle.get("sender_id")
+        bucket = self._by_sender.get(sender_id)
+        if bucket is None:
+            bucket = self._by_sender[sender_id] = _Bucket()
+        bucket.add(bottle)
+        if self._weights is not None:
+            self._weights.append(self.policy.weight(bottle, len(bucket)))
+
+    def extend(self, bottles: Iterable[Dict]):
+        for bottle in bottles:
+            self.add(bottle)
+
+    def remove(self, bottle_id: str) -> Optional[Dict]:
+        index = self._all.pos.get(bottle_id)
+        bottle = self._all.remove(bottle_id)
+        if bottle is None:
+            return None
+        if self._weights is not None:
+            # 与 _Bucket 一致，末尾的权重移到空位上
+            last = len(self._weights) - 1
+            if index != last:
+                self._weights.set(index, self._weights.values[last])
+            self._weights.pop()
+        sender_id = bottle.get("sender_id")
+        bucket = self._by_sender[sender_id]
+        bucket.remove(bottle_id)
+        if not bucket:
+            del self._by_sender[sender_id]
+        return bottle
+
+    def choice_excluding(
+        self, sender_id: str, group_id: Optional[str] = None
+    ) -> Optional[Dict]:
+        """按捡瓶策略随机选择一个不属于 sender_id 的瓶中信（不移除）"""
+        if self.policy is None:
+            return self._uniform_excluding(sender_id)
+        total = len(self._all)
+        own_bucket = self._by_sender.get(sender_id)
+        if total - (len(own_bucket) if own_bucket else 0) <= 0:
+            return None
+        for _ in range(_MAX_WEIGHTED_TRIES):
+            if self._weights is not None:
+                index = self._weights.sample()
+                if index is None:
+                    break
+            else:
+                index = random.randrange(total)
+            bottle = self._all.items[index]
+            if bottle.get("sender_id") == sender_id:
+                continue
+            if self.policy.accept(bottle, group_id):
+                return bottle
+        return self._uniform_excluding(sender_id)
+
+    def _uniform_excluding(self, sender_id: str) -> Optional[Dict]:
+        total = len(self._all)
+        own_bucket = self._by_sender.get(sender_id)
+        own = len(own_bucket) if own_bucket else 0
+        others = total - own
+        if others <= 0:
+            return None
+        if own * 2 <= total:
+            # 别人的瓶子至少占一半，拒绝采样的期望次数不超过 2
+            while True:
+                bottle = self._all.items[random.randrange(total)]
+                if bottle.get("sender_id") != sender_id:
+                    return bottle
+        # 自己的瓶子占多数时，按其他发送者的桶大小定位
+        r = random.randrange(others)
+        for bucket_sender, bucket in self._by_sender.items():
+            if bucket_sender == sender_id:
+                continue
+            if r < len(bucket):
+                return bucket.items[r]
+            r -= len(bucket)
+        return None
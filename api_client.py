@@ -0,0 +1,146 @@
+"""
+云瓶中信 API 客户端：连接池、超时、幂等请求重试与熔断
+"""
+
+from typing import Any, Dict, Optional
+from astrbot.api import logger
+import aiohttp
+import asyncio
+import random
+import time
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开期间直接拒绝请求"""
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后打开，冷却期过后放行一次试探请求"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_request(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probing):
+            raise CircuitOpenError("云瓶中信服务暂时不可用")
+        if state == "half_open":
+            self._probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def abort_request(self):
+        """请求被取消，不计入结果"""
+        self._probing = False
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning("云瓶中信服务连续请求失败，熔断器已打开")
+            self.opened_at = time.monotonic()
+
+
+def _is_server_failure(e: BaseException) -> bool:
+    """连接错误、超时和 5xx 视为服务端故障，计入熔断"""
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+    return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+class CloudApiClient:
+    def __init__(
+        self,
+        base_url: str,
+        connect_timeout: float = 5,
+        read_timeout: float = 10,
+        pool_size: int = 20,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+        max_retries: int = 2,
+        retry_backoff: float = 0.3,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30,
+    ):
+        self.base_url = base_url
+        self.timeout = aiohttp.ClientTimeout(
+            total=connect_timeout + read_timeout,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout,
+        )
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # 在事件循环中按需创建，连接池在请求之间复用
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout
+            )
+        return self._session
+
+    async def _send(self, method: str, url: str, json_data: Optional[Dict]) -> Any:
+        async with self._get_session().request(method, url, json=json_data) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def request(
+        self, method: str, path: str, json_data: Optional[Dict] = None
+    ) -> Any:
+        """发送请求；只有幂等的 GET 请求会在失败后退避重试"""
+        url = f"{self.base_url}{path}"
+        attempts = 1 + (self.max_retries if method == "GET" else 0)
+        for attempt in range(attempts):
+            self.breaker.before_request()
+            try:
+                result = await self._send(method, url, json_data)
+            except asyncio.CancelledError:
+                self.breaker.abort_request()
+                raise
+            except Exception as e:
+                if not _is_server_failure(e):
+                    # 4xx 等业务错误说明服务可用
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    raise
+                # 指数退避并加入随机抖动
+                logger.warning(f"API请求失败，第 {attempt + 1} 次重试 ({method} {url}): {e!r}")
+                delay = self.retry_backoff * (2**attempt)
+                await asyncio.sleep(random.uniform(0, delay))
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,65 @@
+"""
+回复之后的后台任务：戳一戳、写入云瓶中信历史等不影响回复内容的操作放入有界队列，
+由固定数量的后台任务执行，指令不必等待它们完成
+"""
+
+from typing import Awaitable, Callable, List, Tuple
+from astrbot.api import logger
+import asyncio
+from .metrics import metrics
+
+# 队列已满时丢弃新任务，避免协议端卡住时任务无限堆积
+MAX_PENDING = 1000
+# 插件终止时等待队列中剩余任务完成的最长时间(秒)
+DRAIN_TIMEOUT = 10
+
+
+class BackgroundTasks:
+    def __init__(self, workers: int = 4, max_pending: int = MAX_PENDING):
+        self.workers = max(1, workers)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_pending))
+        self._tasks: List[asyncio.Task] = []
+        metrics.gauge("background_tasks_pending", self._queue.qsize)
+
+    def submit(self, name: str, func: Callable[..., Awaitable], *args) -> bool:
+        """放入队列并立即返回，队列已满时丢弃并返回 False"""
+        try:
+            self._queue.put_nowait((name, func, args))
+        except asyncio.QueueFull:
+            logger.warning(f"后台任务队列已满，丢弃任务: {name}")
+            metrics.inc("background_tasks_total", task=name, result="dropped")
+            return False
+        self._ensure_workers()
+        return True
+
+    def _ensure_workers(self):
+        if self._tasks:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            job: Tuple[str, Callable[..., Awaitable], tuple] = await self._queue.get()
+            name, func, args = job
+            try:
+                await func(*args)
+            except Exception as e:
+                logger.error(f"后台任务 {name} 失败: {str(e)}")
+                metrics.inc("background_tasks_total", task=name, result="error")
+            else:
+                metrics.inc("background_tasks_total", task=name, result="ok")
+            finally:
+                self._queue.task_done()
+
+    async def close(self, timeout: float = DRAIN_TIMEOUT):
+        """等待队列中的任务完成后停止，超时的任务直接取消"""
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"后台任务未在 {timeout} 秒内完成，剩余任务将被取消")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
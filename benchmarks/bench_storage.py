@@ -0,0 +1,367 @@
+"""
+瓶中信热点路径基准测试
+
+在预先生成的海域上驱动 BottleStorage 的扔瓶、捡瓶、查看历史以及 MessageFormatter，
+云瓶中信请求发往进程内模拟的 /bottles/ 接口。每种组合在独立子进程中运行，
+报告每秒操作数、p50/p99 延迟和进程峰值内存。
+
+需要在装有 AstrBot 的环境中运行（插件目录名须是合法的 Python 标识符）：
+
+    python benchmarks/bench_storage.py
+    python benchmarks/bench_storage.py --sizes 1000,100000 --modes json,sqlite --images none
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import base64
+import hashlib
+import importlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+PLUGIN_DIR = Path(__file__).resolve().parent.parent
+DATA_FILE = "astrbot_plugin_message_bottle.json"
+BLOB_DIR = "astrbot_plugin_message_bottle_blobs"
+BENCH_USER = "bench-user"
+
+
+def _plugin_module(name: str):
+    if str(PLUGIN_DIR.parent) not in sys.path:
+        sys.path.insert(0, str(PLUGIN_DIR.parent))
+    return importlib.import_module(f"{PLUGIN_DIR.name}.{name}")
+
+
+class FakeMessage:
+    def __init__(self, components: Optional[List] = None):
+        self.message = components or []
+
+
+class FakeEvent:
+    """只实现存储与格式化路径用到的 AstrMessageEvent 接口"""
+
+    def __init__(self, sender_id: str, components: Optional[List] = None):
+        self.sender_id = sender_id
+        self.message_obj = FakeMessage(components)
+
+    def get_sender_id(self) -> str:
+        return self.sender_id
+
+    def get_sender_name(self) -> str:
+        return f"name-{self.sender_id}"
+
+    def get_self_id(self) -> str:
+        return "bench-bot"
+
+    def get_group_id(self) -> str:
+        return "bench-group"
+
+    def get_platform_name(self) -> str:
+        return "bench"
+
+    def chain_result(self, chain: List):
+        return chain
+
+    def plain_result(self, text: str):
+        return text
+
+
+def _make_images(count: int, image_kb: int) -> List[bytes]:
+    rng = random.Random(42)
+    return [rng.randbytes(image_kb * 1024) for _ in range(count)]
+
+
+def seed_sea(
+    data_dir: str, size: int, history: int, images: List[bytes]
+) -> List[str]:
+    """直接写出 JSON 数据文件，图片写入 blob 目录，返回历史中的瓶中信编号"""
+    digests = []
+    for data in images:
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(data_dir, BLOB_DIR, digest[:2], digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        digests.append(digest)
+
+    def bottle(i: int) -> Dict:
+        return {
+            "content": f"seeded bottle {i} " + "x" * (i % 64),
+            "images": [{"type": "blob", "data": digests[i % len(digests)]}]
+            if digests
+            else [],
+            "sender": f"seed-{i % 1000}",
+            "sender_id": f"seed-{i % 1000}",
+            "poke": False,
+            "picked": False,
+            "timestamp": time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(1700000000 + i)
+            ),
+            "bottle_id": f"l{i + 1}",
+        }
+
+    active = [bottle(i) for i in range(size)]
+    picked = []
+    for i in range(size, size + history):
+        b = bottle(i)
+        b["picked"] = True
+        picked.append(b)
+    with open(os.path.join(data_dir, DATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "active": active,
+                "user_list": {BENCH_USER: picked},
+                "next_local_id": size + history + 1,
+            },
+            f,
+            ensure_ascii=False,
+        )
+    return [b["bottle_id"] for b in picked]
+
+
+async def start_cloud_stub(images: List[bytes]):
+    """进程内模拟的云瓶中信接口"""
+    from aiohttp import web
+
+    payload = [{"type": "base64", "data": base64.b64encode(d).decode()} for d in images]
+    state = {"next_id": 1, "active": 10**9}
+
+    async def add(request: web.Request):
+        await request.json()
+        bottle_id = state["next_id"]
+        state["next_id"] += 1
+        state["active"] += 1
+        return web.json_response({"bottle_id": bottle_id})
+
+    async def pick(request: web.Request):
+        state["active"] -= 1
+        bottle_id = state["next_id"]
+        state["next_id"] += 1
+        return web.json_response(
+            {
+                "bottle_id": bottle_id,
+                "content": "cloud bottle",
+                "images": payload[:1],
+                "sender": "cloud",
+                "sender_id": "cloud",
+                "poke": False,
+                "timestamp": "2024-01-01 00:00:00",
+            }
+        )
+
+    async def counts(request: web.Request):
+        return web.json_response({"total_active_bottles": state["active"]})
+
+    app = web.Application(client_max_size=64 * 1024**2)
+    app.router.add_post("/bottles/", add)
+    app.router.add_post("/bottles/pick/{sender_id}", pick)
+    app.router.add_get("/bottles/counts/active", counts)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def _summary(op: str, latencies: List[float]) -> Dict:
+    latencies.sort()
+    n = len(latencies)
+    total = sum(latencies)
+    return {
+        "op": op,
+        "n": n,
+        "ops_per_sec": n / total if total else 0.0,
+        "p50_ms": latencies[n // 2] * 1000 if n else 0.0,
+        "p99_ms": latencies[min(n - 1, int(n * 0.99))] * 1000 if n else 0.0,
+    }
+
+
+async def _measure(op: str, n: int, fn) -> Dict:
+    latencies = []
+    for i in range(n):
+        start = time.perf_counter()
+        await fn(i)
+        latencies.append(time.perf_counter() - start)
+    return _summary(op, latencies)
+
+
+async def run_scenario(
+    mode: str,
+    size: int,
+    with_images: bool,
+    ops: int,
+    image_kb: int,
+    pick_policy: str = "uniform",
+) -> Dict:
+    bottle_storage = _plugin_module("bottle_storage")
+    api_client = _plugin_module("api_client")
+    message_formatter = _plugin_module("message_formatter")
+    background = _plugin_module("background").BackgroundTasks()
+
+    images = _make_images(16, image_kb) if with_images else []
+    history = min(max(size // 10, 1), 10000)
+    data_dir = tempfile.mkdtemp(prefix="bottle_bench_")
+    picked_ids = seed_sea(data_dir, size, history, images)
+    runner, base_url = await start_cloud_stub(images or _make_images(1, image_kb))
+
+    load_start = time.perf_counter()
+    client = api_client.CloudApiClient(base_url)
+    storage = bottle_storage.BottleStorage(
+        data_dir=data_dir,
+        api_base_url=base_url,
+        api_client=client,
+        enable_content_safety=False,
+        content_safety_config={},
+        storage_mode=mode,
+        pick_policy=pick_policy,
+        background=background,
+    )
+    load_seconds = time.perf_counter() - load_start
+    formatter = message_formatter.MessageFormatter(storage.blob_store)
+    event = FakeEvent(BENCH_USER)
+    inline = [{"type": "base64", "data": base64.b64encode(d).decode()} for d in images[:1]]
+    rng = random.Random(7)
+
+    async def throw(i: int):
+        await storage.add_bottle(
+            f"bench throw {i}", inline, "bench", f"thrower-{i % 50}", False, False
+        )
+
+    async def throw_cloud(i: int):
+        await storage.add_bottle(
+            f"bench cloud throw {i}", inline, "bench", BENCH_USER, True, False
+        )
+
+    async def pick(i: int):
+        await storage.pick_random_bottle(FakeEvent(f"picker-{i % 50}"))
+
+    async def pick_cloud(i: int):
+        await storage.pick_random_cloud_bottle(event)
+
+    async def view(i: int):
+        bottle_id = rng.choice(picked_ids) if i % 2 else None
+        bottle = await storage.get_picked_bottle(event, bottle_id)
+        formatter.create_bottle_message(event, bottle, "这是一个被捡起的瓶中信！")
+
+    async def list_page(i: int):
+        bottles, page, total_pages = storage.get_picked_bottles(
+            BENCH_USER, page=1 + i % 10, page_size=10
+        )
+        formatter.format_picked_bottles_list(bottles, page, total_pages)
+
+    async def count(i: int):
+        storage.get_local_bottle_counts(BENCH_USER)
+        await storage.get_cloud_bottle_counts()
+
+    results = []
+    try:
+        results.append(await _measure("throw", ops, throw))
+        results.append(await _measure("pick", min(ops, size // 2), pick))
+        results.append(await _measure("view", ops, view))
+        results.append(await _measure("list", ops, list_page))
+        results.append(await _measure("count", ops, count))
+        results.append(await _measure("throw_cloud", ops, throw_cloud))
+        results.append(await _measure("pick_cloud", ops, pick_cloud))
+    finally:
+        await background.close()
+        await storage.close()
+        await client.close()
+        await runner.cleanup()
+
+    # Linux 上 ru_maxrss 的单位是 KB
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "mode": mode,
+        "size": size,
+        "images": with_images,
+        "pick_policy": pick_policy,
+        "load_seconds": load_seconds,
+        "peak_rss_mb": peak_rss_mb,
+        "results": results,
+    }
+
+
+def _print_report(report: Dict):
+    images = "base64" if report["images"] else "none"
+    print(
+        f"\n== mode={report['mode']} size={report['size']} images={images}"
+        f" pick_policy={report['pick_policy']}"
+        f" load={report['load_seconds']:.2f}s peak_rss={report['peak_rss_mb']:.1f}MB"
+    )
+    print(f"{'op':<12}{'n':>8}{'ops/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for r in report["results"]:
+        print(
+            f"{r['op']:<12}{r['n']:>8}{r['ops_per_sec']:>12.1f}"
+            f"{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--modes", default="json,journal,sqlite,snapshot")
+    parser.add_argument("--images", default="none,base64", help="none,base64")
+    parser.add_argument("--ops", type=int, default=200, help="每种操作的执行次数")
+    parser.add_argument("--image-kb", type=int, default=32)
+    parser.add_argument("--pick-policy", default="uniform", help="本地海域的捡瓶策略")
+    parser.add_argument("--json", dest="json_out", help="将全部结果写入该 JSON 文件")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        report = asyncio.run(
+            run_scenario(
+                args.modes,
+                int(args.sizes),
+                args.images == "base64",
+                args.ops,
+                args.image_kb,
+                args.pick_policy,
+            )
+        )
+        print(json.dumps(report))
+        return
+
+    reports = []
+    for mode in args.modes.split(","):
+        for size in args.sizes.split(","):
+            for images in args.images.split(","):
+                # 每种组合使用独立进程，峰值内存互不影响
+                proc = subprocess.run(
+                    [
+                        sys.executable,
+                        __file__,
+                        "--single",
+                        "--modes", mode,
+                        "--sizes", size,
+                        "--images", images,
+                        "--ops", str(args.ops),
+                        "--image-kb", str(args.image_kb),
+                        "--pick-policy", args.pick_policy,
+                    ],
+                    capture_output=True,
+                    text=True,
+                )
+                if proc.returncode != 0:
+                    print(f"\n== mode={mode} size={size} images={images} 失败:")
+                    print(proc.stderr.strip())
+                    continue
+                report = json.loads(proc.stdout.strip().splitlines()[-1])
+                _print_report(report)
+                reports.append(report)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+瓶中信回归检查
+
+逐个复现曾经出现过的问题，确认它们不再发生。任一检查失败时以非零状态退出。
+需要在装有 AstrBot 的环境中运行（插件目录名须是合法的 Python 标识符）：
+
+    python benchmarks/check_regressions.py
+    python benchmarks/check_regressions.py --only sqlite_tokenless_history
+"""
+
+from typing import Callable, Dict, List
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_storage import FakeEvent, _plugin_module  # noqa: E402
+
+CHECKS: Dict[str, Callable[[], List[str]]] = {}
+
+
+def check(func: Callable[[], List[str]]) -> Callable[[], List[str]]:
+    CHECKS[func.__name__] = func
+    return func
+
+
+def _run_with_timeout(func: Callable, timeout: float):
+    """在线程中运行，超时返回 TimeoutError 而不是让检查一直挂起"""
+    result: Dict = {}
+
+    def target():
+        try:
+            result["value"] = func()
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        return TimeoutError(f"{timeout} 秒内没有返回")
+    return result.get("error", result.get("value"))
+
+
+@check
+def sqlite_tokenless_history() -> List[str]:
+    """没有可索引词语的已捡起瓶中信超过一批时，补建索引不能反复扫描同一批"""
+    sqlite_backend = _plugin_module("sqlite_backend")
+    db_file = os.path.join(tempfile.mkdtemp(prefix="bottle_check_"), "sea.db")
+    backend = sqlite_backend.SqliteBackend(db_file)
+    count = sqlite_backend.MIGRATION_CHUNK_SIZE + 500
+    for i in range(count):
+        backend.collect(
+            "picker",
+            {
+                "bottle_id": f"c{i}",
+                "content": "",
+                "images": [{"type": "qq_url", "url": "https://example.com/a.jpg"}],
+                "sender": "🌸",
+                "sender_id": "sender",
+                "timestamp": "2024-01-01 00:00:00",
+            },
+        )
+    # 模拟旧版本数据库：还没有补建过索引
+    backend.conn.execute("DELETE FROM meta WHERE key = 'terms_indexed_through'")
+    asyncio.run(backend.close())
+
+    def reopen() -> List[str]:
+        errors = []
+        reopened = sqlite_backend.SqliteBackend(db_file)
+        try:
+            last_id = reopened.conn.execute("SELECT MAX(id) FROM bottles").fetchone()[0]
+            if reopened._get_meta("terms_indexed_through") != str(last_id):
+                errors.append("补建索引后没有记录已检查到的位置，下次启动会重新扫描")
+            if reopened.picked_count("picker") != count:
+                errors.append(f"历史数量为 {reopened.picked_count('picker')}，应为 {count}")
+        finally:
+            asyncio.run(reopened.close())
+        return errors
+
+    result = _run_with_timeout(reopen, 30)
+    if isinstance(result, Exception):
+        return [f"重新打开数据库失败: {result!r}"]
+    return result
+
+
+class _QQEvent(FakeEvent):
+    def get_platform_name(self) -> str:
+        return "aiocqhttp"
+
+
+class _UrlSafety:
+    """模拟审核接口：QQ 图片链接不带 rkey 时下载失败，接口返回错误"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def censor_async(self, type: str, content, cache_key=None):
+        self.calls += 1
+        if type == "image" and "&rkey=" not in content:
+            return None
+        return True
+
+
+@check
+def moderation_qq_url() -> List[str]:
+    """含 QQ 图片的本地瓶中信要带着 rkey 送审，无法送审时不能永远停留在待审核状态"""
+
+    async def run() -> List[str]:
+        bottle_storage = _plugin_module("bottle_storage")
+        moderation = _plugin_module("moderation")
+        utils = _plugin_module("utils")
+        client = _plugin_module("api_client").CloudApiClient("http://127.0.0.1:9")
+        storage = bottle_storage.BottleStorage(
+            data_dir=tempfile.mkdtemp(prefix="bottle_check_"),
+            api_base_url="http://127.0.0.1:9",
+            api_client=client,
+            enable_content_safety=False,
+            content_safety_config={},
+        )
+        safety = _UrlSafety()
+        storage.content_safety = safety
+        storage.moderation = moderation.ModerationQueue(
+            storage._moderate_bottle, storage._resolve_pending, retry_interval=0.01
+        )
+        event = _QQEvent("sender")
+        utils._rkey_cache.set(event.get_self_id(), "&rkey=check")
+        images = [{"type": "qq_url", "data": "https://multimedia.nt.qq.com/download?appid=1"}]
+        errors = []
+        try:
+            with_rkey = await storage.add_bottle(
+                "", images, "sender", "sender", False, False, event=event
+            )
+            # 重启后恢复的瓶中信没有扔出时的 rkey
+            without_rkey = await storage.add_bottle(
+                "", images, "sender", "sender", False, False
+            )
+            for _ in range(200):
+                if storage.moderation.pending == 0:
+                    break
+                await asyncio.sleep(0.01)
+            if storage.moderation.pending:
+                errors.append(f"{storage.moderation.pending} 个瓶中信一直停留在待审核状态")
+            if not storage.backend.is_active(with_rkey):
+                errors.append("带 rkey 送审的瓶中信没有放入海中")
+            if storage.backend.is_active(without_rkey) or storage.backend.list_pending():
+                errors.append("无法送审的瓶中信没有按未通过处理")
+            if safety.calls != 1:
+                errors.append(f"审核接口被调用 {safety.calls} 次，应只为带 rkey 的图片调用 1 次")
+        finally:
+            await storage.close()
+            await client.close()
+        return errors
+
+    return asyncio.run(run())
+
+
+@check
+def outbox_compaction_keeps_acked() -> List[str]:
+    """fsync 刚完成、扔瓶的协程还没恢复时压缩发件箱，这个瓶中信不能从文件中丢失"""
+    outbox_module = _plugin_module("outbox")
+
+    async def run() -> List[str]:
+        path = os.path.join(tempfile.mkdtemp(prefix="bottle_check_"), "outbox.ndjson")
+        stalled = asyncio.Event()
+
+        async def send(bottle):
+            # 云端一直不返回，发送完成由下面手动调用 _done 模拟
+            await stalled.wait()
+
+        outbox = outbox_module.CloudOutbox(path, send)
+        sent = [await outbox.put({"content": str(i)}) for i in range(60)]
+        racer = asyncio.ensure_future(outbox.put({"content": "racer"}))
+        await asyncio.sleep(0)
+        # 直接等待 fsync 的协程先于通过 shield 等待的 put 恢复
+        await outbox._syncing
+        for outbox_id in sent:
+            outbox._done(outbox_id)
+        racer_id = await racer
+        await outbox.close()
+        reloaded = outbox_module.CloudOutbox(path, send)
+        await reloaded.close()
+        if racer_id not in reloaded.entries:
+            return [f"已确认的瓶中信 {racer_id} 在压缩后从发件箱中丢失"]
+        return []
+
+    return asyncio.run(run())
+
+
+@check
+def journal_fsync_during_compaction() -> List[str]:
+    """后台 fsync 进行中时压缩日志，不能关闭正在 fsync 的文件，也不能在事件循环中 fsync"""
+    journal = _plugin_module("journal")
+    errors: List[str] = []
+    real_fsync = os.fsync
+
+    def slow_fsync(fd: int):
+        if threading.current_thread() is threading.main_thread():
+            errors.append("在事件循环线程中调用了 fsync")
+        before = os.fstat(fd)
+        threading.Event().wait(0.05)
+        try:
+            after = os.fstat(fd)
+        except OSError as e:
+            errors.append(f"fsync 期间文件描述符被关闭: {e!r}")
+            return
+        if (before.st_dev, before.st_ino) != (after.st_dev, after.st_ino):
+            errors.append("fsync 期间文件描述符被复用")
+            return
+        real_fsync(fd)
+
+    async def run():
+        snapshot_file = os.path.join(tempfile.mkdtemp(prefix="bottle_check_"), "sea.json")
+        data = {"active": [], "pending": [], "user_list": {}, "next_local_id": 1}
+        bottle_journal = journal.BottleJournal(snapshot_file, fsync_interval=3600)
+        bottle_journal.append({"op": "collect", "sender_id": "u", "bottle": {}})
+        flushing = asyncio.ensure_future(bottle_journal.flush())
+        await asyncio.sleep(0.01)
+        await bottle_journal.compact(data)
+        await flushing
+        await bottle_journal.close()
+
+    os.fsync = slow_fsync
+    try:
+        asyncio.run(run())
+    finally:
+        os.fsync = real_fsync
+    return errors
+
+
+@check
+def migration_claims_before_upload() -> List[str]:
+    """迁移上传期间瓶中信不能被捡起，上传失败的放回海中；导出导入不能丢掉待审核的瓶中信"""
+    import aiohttp
+    from multidict import CIMultiDict, CIMultiDictProxy
+    from yarl import URL
+
+    bottle_storage = _plugin_module("bottle_storage")
+    api_client = _plugin_module("api_client")
+
+    def open_storage(data_dir: str, mode: str, client):
+        return bottle_storage.BottleStorage(
+            data_dir=data_dir,
+            api_base_url="http://127.0.0.1:9",
+            api_client=client,
+            enable_content_safety=False,
+            content_safety_config={},
+            storage_mode=mode,
+        )
+
+    async def run(mode: str) -> List[str]:
+        errors = []
+        client = api_client.CloudApiClient("http://127.0.0.1:9")
+        storage = open_storage(tempfile.mkdtemp(prefix="bottle_check_"), mode, client)
+        uploaded, picked = set(), set()
+
+        async def send(payload):
+            # 上传期间其他用户捡瓶
+            bottle, _ = await storage.pick_random_bottle(FakeEvent("picker"))
+            if bottle is not None:
+                picked.add(bottle["content"])
+            await asyncio.sleep(0)
+            if payload["content"].startswith("reject"):
+                url = URL("http://127.0.0.1:9/bottles/")
+                request_info = aiohttp.RequestInfo(url, "POST", CIMultiDictProxy(CIMultiDict()), url)
+                raise aiohttp.ClientResponseError(request_info, (), status=400)
+            uploaded.add(payload["content"])
+            return "c1"
+
+        storage._send_cloud_bottle = send
+        try:
+            for i in range(20):
+                content = f"{'reject' if i % 5 == 0 else 'bottle'} {i}"
+                await storage.add_bottle(content, [], "sender", "sender", False, False)
+            counts = await storage.migrate_to_cloud()
+            both = uploaded & picked
+            if both:
+                errors.append(f"{mode}: {len(both)} 个瓶中信既上传到云端又被捡起")
+            remaining = {b["content"] for b in storage.backend.iter_active()}
+            rejected = {f"reject {i}" for i in range(0, 20, 5)} - picked
+            if remaining != rejected:
+                errors.append(f"{mode}: 被拒收的瓶中信没有放回海中: {remaining} != {rejected}")
+            if storage.backend.list_pending():
+                errors.append(f"{mode}: 迁移结束后仍有瓶中信停留在待审核状态")
+            if sum(counts[k] for k in ("uploaded", "rejected", "gone", "failed")) != 20:
+                errors.append(f"{mode}: 迁移计数不守恒: {counts}")
+
+            # 待审核的瓶中信随导出文件导入后回到海中
+            held = storage.backend.hold(
+                {"content": "held", "images": [], "sender": "s", "sender_id": "s", "poke": False}
+            )
+            path, exported = await storage.export_bottles()
+            if exported["pending"] != 1:
+                errors.append(f"{mode}: 导出了 {exported['pending']} 个待审核的瓶中信，应为 1")
+        finally:
+            await storage.close()
+        imported_storage = open_storage(tempfile.mkdtemp(prefix="bottle_check_"), mode, client)
+        try:
+            imported = await imported_storage.import_bottles(path)
+            contents = {b["content"] for b in imported_storage.backend.iter_active()}
+            if imported["pending"] != 1 or "held" not in contents:
+                errors.append(f"{mode}: 待审核的瓶中信 {held} 没有随导出文件导入")
+        finally:
+            await imported_storage.close()
+            await client.close()
+        return errors
+
+    errors = []
+    for mode in ("json", "journal", "sqlite", "snapshot"):
+        errors += asyncio.run(run(mode))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", default="", help="只运行这些检查，以逗号分隔")
+    args = parser.parse_args()
+
+    names = [name for name in args.only.split(",") if name] or list(CHECKS)
+    failed = False
+    for name in names:
+        errors = CHECKS[name]()
+        print(f"{name} -> {'OK' if not errors else 'FAILED'}")
+        for error in errors:
+            print(f"  {error}")
+        failed = failed or bool(errors)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
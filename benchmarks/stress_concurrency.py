@@ -0,0 +1,244 @@
+"""
+瓶中信并发压力测试
+
+大量用户同时扔瓶、捡本地瓶和捡云瓶，结束后检查：
+同一个瓶子不会被捡起两次、不会捡到自己的瓶子、瓶子总数守恒，
+并在重新打开存储后确认落盘的数据与内存一致。
+--processes 大于 1 时，另外让多个进程通过 shared_sea_path 共享同一片海域并做同样的检查。
+任一检查失败时以非零状态退出。
+
+    python benchmarks/stress_concurrency.py --modes json,journal,sqlite --users 200
+    python benchmarks/stress_concurrency.py --modes sqlite --processes 4
+"""
+
+from collections import Counter
+from typing import Dict, List
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_storage import FakeEvent, _plugin_module, seed_sea, start_cloud_stub  # noqa: E402
+
+
+def _open_storage(data_dir: str, mode: str, base_url: str, shared_sea_path: str = ""):
+    bottle_storage = _plugin_module("bottle_storage")
+    api_client = _plugin_module("api_client")
+    client = api_client.CloudApiClient(base_url)
+    storage = bottle_storage.BottleStorage(
+        data_dir=data_dir,
+        api_base_url=base_url,
+        api_client=client,
+        enable_content_safety=False,
+        content_safety_config={},
+        storage_mode=mode,
+        shared_sea_path=shared_sea_path,
+    )
+    return storage, client
+
+
+def _histories(storage, users: List[str]) -> Dict[str, List[Dict]]:
+    return {user: storage.backend.list_picked(user) for user in users}
+
+
+async def _user_session(storage, user_id: str, rounds: int) -> int:
+    """随机扔瓶和捡瓶，返回成功扔出的本地瓶中信数量"""
+    thrown = 0
+    rng = random.Random(user_id)
+    for i in range(rounds):
+        action = rng.random()
+        if action < 0.2:
+            bottle_id = await storage.add_bottle(
+                f"{user_id} round {i}", [], user_id, user_id, False, False
+            )
+            if bottle_id is not None:
+                thrown += 1
+        elif action < 0.3:
+            await storage.pick_random_cloud_bottle(FakeEvent(user_id))
+        else:
+            await storage.pick_random_bottle(FakeEvent(user_id))
+        # 让出事件循环，增加交错
+        await asyncio.sleep(0)
+    return thrown
+
+
+async def run_stress(mode: str, size: int, users: int, rounds: int) -> List[str]:
+    data_dir = tempfile.mkdtemp(prefix="bottle_stress_")
+    seed_sea(data_dir, size, 0, [])
+    runner, base_url = await start_cloud_stub([])
+    storage, client = _open_storage(data_dir, mode, base_url)
+    user_ids = [f"user-{i}" for i in range(users)]
+
+    errors = []
+    try:
+        thrown = sum(
+            await asyncio.gather(*(_user_session(storage, u, rounds) for u in user_ids))
+        )
+        histories = _histories(storage, user_ids)
+        local_picks = Counter()
+        for user_id, bottles in histories.items():
+            for bottle in bottles:
+                if not bottle["bottle_id"].startswith("l"):
+                    continue
+                local_picks[bottle["bottle_id"]] += 1
+                if bottle["sender_id"] == user_id:
+                    errors.append(f"{user_id} 捡到了自己的瓶中信 {bottle['bottle_id']}")
+        duplicates = [bid for bid, n in local_picks.items() if n > 1]
+        if duplicates:
+            errors.append(f"{len(duplicates)} 个瓶中信被重复捡起，例如 {duplicates[:5]}")
+        active = storage.backend.active_count()
+        if active + len(local_picks) != size + thrown:
+            errors.append(
+                f"瓶中信总数不守恒: 海面 {active} + 已捡 {len(local_picks)}"
+                f" != 初始 {size} + 新扔 {thrown}"
+            )
+    finally:
+        await storage.close()
+        await client.close()
+
+    # 重新打开，确认落盘数据与内存一致
+    reopened, client = _open_storage(data_dir, mode, base_url)
+    try:
+        if reopened.backend.active_count() != active:
+            errors.append(
+                f"重新打开后海面数量为 {reopened.backend.active_count()}，应为 {active}"
+            )
+        for user_id, bottles in _histories(reopened, user_ids).items():
+            expected = [b["bottle_id"] for b in histories[user_id]]
+            if [b["bottle_id"] for b in bottles] != expected:
+                errors.append(f"重新打开后 {user_id} 的历史与内存不一致")
+                break
+    finally:
+        await reopened.close()
+        await client.close()
+        await runner.cleanup()
+
+    print(
+        f"mode={mode} size={size} users={users} rounds={rounds}"
+        f" thrown={thrown} picked={len(local_picks)} active={active}"
+        f" -> {'OK' if not errors else 'FAILED'}"
+    )
+    return errors
+
+
+async def run_worker(shared_sea_path: str, worker: int, users: int, rounds: int):
+    """共享海域压力测试中的一个进程，输出扔出的瓶中信数量"""
+    runner, base_url = await start_cloud_stub([])
+    data_dir = tempfile.mkdtemp(prefix="bottle_worker_")
+    storage, client = _open_storage(data_dir, "sqlite", base_url, shared_sea_path)
+    user_ids = [f"worker{worker}-user-{i}" for i in range(users)]
+    try:
+        thrown = sum(
+            await asyncio.gather(*(_user_session(storage, u, rounds) for u in user_ids))
+        )
+    finally:
+        await storage.close()
+        await client.close()
+        await runner.cleanup()
+    print(thrown)
+
+
+async def _seed_shared(shared_sea_path: str, size: int):
+    data_dir = tempfile.mkdtemp(prefix="bottle_seed_")
+    seed_sea(data_dir, size, 0, [])
+    storage, client = _open_storage(data_dir, "sqlite", "http://127.0.0.1:9", shared_sea_path)
+    await storage.close()
+    await client.close()
+
+
+def run_shared_stress(processes: int, size: int, users: int, rounds: int) -> List[str]:
+    shared_sea_path = os.path.join(tempfile.mkdtemp(prefix="bottle_shared_"), "sea.db")
+    asyncio.run(_seed_shared(shared_sea_path, size))
+    workers = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                __file__,
+                "--worker", str(i),
+                "--shared-sea-path", shared_sea_path,
+                "--users", str(users),
+                "--rounds", str(rounds),
+            ],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for i in range(processes)
+    ]
+    errors = []
+    thrown = 0
+    for i, proc in enumerate(workers):
+        out, _ = proc.communicate()
+        if proc.returncode != 0:
+            errors.append(f"进程 {i} 异常退出: {proc.returncode}")
+            continue
+        thrown += int(out.strip().splitlines()[-1])
+
+    conn = sqlite3.connect(shared_sea_path)
+    duplicates = conn.execute(
+        "SELECT bottle_id FROM bottles WHERE picked = 1 AND bottle_id LIKE 'l%'"
+        " GROUP BY bottle_id HAVING COUNT(*) > 1"
+    ).fetchall()
+    if duplicates:
+        errors.append(f"{len(duplicates)} 个瓶中信被重复捡起，例如 {duplicates[:5]}")
+    own = conn.execute(
+        "SELECT COUNT(*) FROM bottles WHERE picker = sender_id"
+    ).fetchone()[0]
+    if own:
+        errors.append(f"{own} 个瓶中信被发送者自己捡起")
+    local = conn.execute(
+        "SELECT COUNT(DISTINCT bottle_id) FROM bottles WHERE bottle_id LIKE 'l%'"
+    ).fetchone()[0]
+    if local != size + thrown:
+        errors.append(f"本地瓶中信数量 {local} != 初始 {size} + 新扔 {thrown}")
+    active, picked = conn.execute(
+        "SELECT SUM(picked = 0), SUM(picked = 1 AND bottle_id LIKE 'l%') FROM bottles"
+    ).fetchone()
+    conn.close()
+
+    print(
+        f"shared processes={processes} size={size} users={users} rounds={rounds}"
+        f" thrown={thrown} picked={picked} active={active}"
+        f" -> {'OK' if not errors else 'FAILED'}"
+    )
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", default="json,journal,sqlite,snapshot")
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--processes", type=int, default=1, help="共享海域的进程数")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--shared-sea-path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        asyncio.run(
+            run_worker(args.shared_sea_path, args.worker, args.users, args.rounds)
+        )
+        return
+
+    failed = False
+    if args.processes > 1:
+        errors = run_shared_stress(args.processes, args.size, args.users, args.rounds)
+        for error in errors:
+            print(f"  {error}")
+        failed = bool(errors)
+    for mode in args.modes.split(","):
+        errors = asyncio.run(run_stress(mode, args.size, args.users, args.rounds))
+        for error in errors:
+            print(f"  {error}")
+        failed = failed or bool(errors)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
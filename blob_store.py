@@ -0,0 +1,125 @@
+"""
+按内容寻址的图片存储：图片以哈希命名保存一次，瓶中信中只保存引用
+"""
+
+from typing import Dict, Iterable, List
+from astrbot.api import logger
+import asyncio
+import base64
+import hashlib
+import os
+import tempfile
+import time
+
+# 清理时跳过最近写入的文件，其他进程可能正在写入引用它的瓶中信
+SWEEP_GRACE_SECONDS = 3600
+
+
+class BlobStore:
+    def __init__(self, root_dir: str, shared: bool = False):
+        self.root_dir = root_dir
+        # 多个进程共享时，本进程的引用计数不完整，释放引用时不删除文件
+        self.shared = shared
+        os.makedirs(self.root_dir, exist_ok=True)
+        # 引用计数只保存在内存中，启动时由 rebuild 根据已有瓶中信重建
+        self.refs: Dict[str, int] = {}
+        # 正在写入的图片，同时保存同一图片时共用一次写入
+        self._writes: Dict[str, asyncio.Future] = {}
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root_dir, digest[:2], digest)
+
+    def _write(self, digest: str, data: bytes):
+        path = self.path(digest)
+        if os.path.exists(path):
+            # 刷新修改时间，避免被其他进程当作未引用的旧文件清理
+            os.utime(path)
+            return
+        shard = os.path.dirname(path)
+        os.makedirs(shard, exist_ok=True)
+        # 临时文件名唯一，共享模式下其他进程同时写入同一图片也不会冲突；
+        # 残留的临时文件不在引用中，会被 rebuild 清理
+        fd, tmp_file = tempfile.mkstemp(prefix=digest, suffix=".tmp", dir=shard)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_file, path)
+        except BaseException:
+            try:
+                os.remove(tmp_file)
+            except FileNotFoundError:
+                pass
+            raise
+
+    async def put(self, data: bytes) -> str:
+        """保存图片并增加一次引用，返回其哈希"""
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self.refs:
+            write = self._writes.get(digest)
+            if write is None:
+                write = asyncio.ensure_future(
+                    asyncio.to_thread(self._write, digest, data)
+                )
+                self._writes[digest] = write
+                write.add_done_callback(lambda _: self._writes.pop(digest, None))
+            # 一个调用方被取消时不影响其他等待同一写入的调用方
+            await asyncio.shield(write)
+        self.refs[digest] = self.refs.get(digest, 0) + 1
+        return digest
+
+    async def externalize(self, images: List[Dict]) -> List[Dict]:
+        """将内联的 base64 图片转存为引用，其余图片原样返回"""
+        result = []
+        for img in images:
+            if img["type"] == "base64":
+                digest = await self.put(base64.b64decode(img["data"]))
+                img = {"type": "blob", "data": digest}
+            result.append(img)
+        return result
+
+    def release(self, images: Iterable[Dict]):
+        """释放图片引用，没有引用的图片文件会被删除"""
+        for img in images:
+            if img["type"] != "blob":
+                continue
+            digest = img["data"]
+            count = self.refs.get(digest, 0) - 1
+            if count > 0:
+                self.refs[digest] = count
+                continue
+            self.refs.pop(digest, None)
+            if self.shared:
+                continue
+            try:
+                os.remove(self.path(digest))
+            except FileNotFoundError:
+                pass
+
+    def read(self, digest: str) -> bytes:
+        with open(self.path(digest), "rb") as f:
+            return f.read()
+
+    def rebuild(self, digests: Iterable[str]):
+        """根据瓶中信中的引用重建引用计数，并清理未被引用的图片文件"""
+        self.refs = {}
+        for digest in digests:
+            self.refs[digest] = self.refs.get(digest, 0) + 1
+        removed = 0
+        deadline = time.time() - SWEEP_GRACE_SECONDS
+        for shard in os.listdir(self.root_dir):
+            shard_dir = os.path.join(self.root_dir, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                path = os.path.join(shard_dir, name)
+                if name in self.refs:
+                    continue
+                try:
+                    if os.path.getmtime(path) > deadline:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+        if removed:
+            logger.info(f"已清理 {removed} 个未被引用的瓶中信图片")
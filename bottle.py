@@ -0,0 +1,204 @@
+"""
+紧凑的瓶中信记录
+
+固定字段保存在 __slots__ 中，时间戳保存为整数秒，投放者字符串和图片引用在所有瓶中信之间共享。
+记录仍可以像字典一样按键读写，与 JSON 中的字典格式无损互转，缺失的字段转换后仍然缺失，
+其余字段原样保存在 extra 中。
+"""
+
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+import sys
+import weakref
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+# 按顺序排列的固定字段，to_dict 按此顺序输出
+FIELDS = (
+    "content",
+    "images",
+    "sender",
+    "sender_id",
+    "poke",
+    "picked",
+    "timestamp",
+    "bottle_id",
+)
+_FIELD_SET = frozenset(FIELDS)
+
+
+class ImageRef(Mapping):
+    """不可变的图片引用，相同的图片在所有瓶中信之间共享一个对象"""
+
+    __slots__ = ("type", "data", "__weakref__")
+
+    def __init__(self, type: str, data: str):
+        self.type = type
+        self.data = data
+
+    def __getitem__(self, key: str) -> str:
+        if key == "type":
+            return self.type
+        if key == "data":
+            return self.data
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(("type", "data"))
+
+    def __len__(self) -> int:
+        return 2
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"type": self.type, "data": self.data}
+
+
+_images: "weakref.WeakValueDictionary[Tuple[str, str], ImageRef]" = (
+    weakref.WeakValueDictionary()
+)
+
+
+def image_ref(img: Mapping) -> ImageRef:
+    if isinstance(img, ImageRef):
+        return img
+    key = (img["type"], img["data"])
+    ref = _images.get(key)
+    if ref is None:
+        ref = _images[key] = ImageRef(sys.intern(key[0]), key[1])
+    return ref
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+# 表示字段缺失，与值为 None 区分
+_MISSING = object()
+
+
+def _parse_timestamp(value: Any) -> Any:
+    """按墙上时间换算为整数秒（不做时区转换，格式化后与原字符串一致）
+
+    其他格式的字符串和 None 原样保存，其余类型返回 _MISSING，由调用方放入 extra
+    """
+    if isinstance(value, str):
+        if len(value) == 19 and value[10] == " " and value[13] == value[16] == ":":
+            try:
+                return (datetime.fromisoformat(value) - _EPOCH) // _SECOND
+            except (TypeError, ValueError):
+                # 带时区等格式，相减会报错
+                pass
+        return value
+    return None if value is None else _MISSING
+
+
+def _format_timestamp(value: Any) -> Any:
+    if isinstance(value, int):
+        return str(_EPOCH + timedelta(seconds=value))
+    return value
+
+
+class Bottle(Mapping):
+    __slots__ = (
+        "content",
+        "images",
+        "sender",
+        "sender_id",
+        "poke",
+        "picked",
+        "ts",
+        "bottle_id",
+        "extra",
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, _MISSING)
+        self.extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_dict(cls, data: Mapping) -> "Bottle":
+        if isinstance(data, Bottle):
+            return data
+        # 载入大量历史时的热点路径，直接设置字段而不经过 __setitem__
+        bottle = cls.__new__(cls)
+        get = data.get
+        bottle.content = get("content", _MISSING)
+        images = get("images", _MISSING)
+        if images is not _MISSING and images is not None:
+            images = tuple(map(image_ref, images)) if images else ()
+        bottle.images = images
+        bottle.sender = _intern(get("sender", _MISSING))
+        bottle.sender_id = _intern(get("sender_id", _MISSING))
+        bottle.poke = get("poke", _MISSING)
+        bottle.picked = get("picked", _MISSING)
+        ts = get("timestamp", _MISSING)
+        bottle.ts = _parse_timestamp(ts)
+        bottle.bottle_id = get("bottle_id", _MISSING)
+        bottle.extra = None
+        if not _FIELD_SET.issuperset(data):
+            bottle.extra = {k: v for k, v in data.items() if k not in _FIELD_SET}
+        if bottle.ts is _MISSING and ts is not _MISSING:
+            bottle["timestamp"] = ts
+        return bottle
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _FIELD_SET:
+            value = self.ts if key == "timestamp" else getattr(self, key)
+            if value is not _MISSING:
+                return _format_timestamp(value) if key == "timestamp" else value
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key == "images":
+            self.images = value if value is None else tuple(map(image_ref, value))
+        elif key in ("sender", "sender_id"):
+            setattr(self, key, _intern(value))
+        elif key == "timestamp":
+            self.ts = _parse_timestamp(value)
+            if self.ts is _MISSING:
+                # 非字符串的时间戳原样保存在 extra 中，避免与换算后的整数混淆
+                self._set_extra(key, value)
+            elif self.extra is not None:
+                self.extra.pop(key, None)
+        elif key in _FIELD_SET:
+            setattr(self, key, value)
+        else:
+            self._set_extra(key, value)
+
+    def _set_extra(self, key: str, value: Any):
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __iter__(self) -> Iterator[str]:
+        for key in FIELDS:
+            if (self.ts if key == "timestamp" else getattr(self, key)) is not _MISSING:
+                yield key
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"Bottle({self.to_dict()!r})"
+
+
+def object_hook(obj: Dict[str, Any]) -> Union[Bottle, Dict[str, Any]]:
+    """json.load 的 object_hook 参数，解析时逐个转换瓶中信，不必先构造出全部字典"""
+    return Bottle.from_dict(obj) if "bottle_id" in obj else obj
+
+
+def json_default(value: Any) -> Any:
+    """json.dump 的 default 参数，将瓶中信记录和图片引用转换为字典"""
+    if isinstance(value, (Bottle, ImageRef)):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -2,19 +2,74 @@ from typing import Dict, List, Optional
 import os
 from astrbot.api.event import AstrMessageEvent
 from astrbot.api import logger
-import random
 import aiohttp
 from typing import Any
 from datetime import datetime
 from .utils import (
-    _ensure_data_file,
-    _load_bottles,
-    _save_bottles,
+    BottleView,
     get_bottle2handle,
+    get_images_rkey,
     check_bottle,
-    get_rkey,
+    censor_bottle,
 )
+from .bottle import Bottle
+from .local_backend import LocalBackend, JsonBackend
+from .api_client import CloudApiClient, CircuitOpenError
+from .caching import CachedCount, KeyedLock
+from .blob_store import BlobStore
+from .metrics import metrics
+from .pick_policy import PickPolicy
+from .moderation import ModerationQueue
+from .outbox import CloudOutbox
+from .background import BackgroundTasks
+from .transfer import CHUNK_SIZE, CloudMigration, export_ndjson, read_ndjson
 import asyncio
+import itertools
+
+
+def create_local_backend(
+    data_dir: str,
+    storage_mode: str = "json",
+    journal_fsync_interval: float = 1.0,
+    journal_compact_threshold: int = 1000,
+    history_cache_size: int = 256,
+    shared_sea_path: str = "",
+    pick_policy: Optional[PickPolicy] = None,
+) -> LocalBackend:
+    """根据存储模式创建本地瓶中信存储后端"""
+    data_file = os.path.join(data_dir, "astrbot_plugin_message_bottle.json")
+    if storage_mode == "sqlite" or shared_sea_path:
+        from .sqlite_backend import SqliteBackend, migrate_json_to_sqlite
+
+        # 配置了共享海域时，多个进程使用同一个 SQLite 数据库
+        db_file = shared_sea_path or os.path.join(
+            data_dir, "astrbot_plugin_message_bottle.db"
+        )
+        if pick_policy is not None and not pick_policy.uniform:
+            logger.warning("SQLite 存储暂不支持加权捡瓶策略，将均匀随机捡瓶")
+        backend = SqliteBackend(db_file)
+        migrate_json_to_sqlite(data_file, backend)
+        return backend
+    if storage_mode == "snapshot":
+        from .snapshot_backend import SnapshotBackend, migrate_json_to_snapshot
+
+        snapshot_file = os.path.join(data_dir, "astrbot_plugin_message_bottle.snap")
+        migrate_json_to_snapshot(data_file, snapshot_file)
+        return SnapshotBackend(
+            snapshot_file,
+            journal_fsync_interval=journal_fsync_interval,
+            journal_compact_threshold=journal_compact_threshold,
+            history_cache_size=history_cache_size,
+            pick_policy=pick_policy,
+        )
+    return JsonBackend(
+        data_file,
+        use_journal=storage_mode == "journal",
+        journal_fsync_interval=journal_fsync_interval,
+        journal_compact_threshold=journal_compact_threshold,
+        history_cache_size=history_cache_size,
+        pick_policy=pick_policy,
+    )
 
 
 class BottleStorage:
@@ -22,16 +77,74 @@ class BottleStorage:
         self,
         data_dir: str,
         api_base_url: str,
-        http_client: aiohttp.ClientSession,
+        api_client: CloudApiClient,
         enable_content_safety: bool,
         content_safety_config: dict,
+        content_safety_cache_ttl: float = 86400,
+        content_safety_cache_size: int = 4096,
+        content_safety_workers: int = 4,
+        storage_mode: str = "json",
+        journal_fsync_interval: float = 1.0,
+        journal_compact_threshold: int = 1000,
+        history_cache_size: int = 256,
+        shared_sea_path: str = "",
+        cloud_count_ttl: float = 30,
+        cloud_count_max_stale: float = 600,
+        pick_policy: str = "uniform",
+        pick_age_half_life_hours: float = 24,
+        pick_other_group_boost: float = 3,
+        moderation_workers: int = 2,
+        cloud_outbox: bool = True,
+        cloud_outbox_batch_size: int = 10,
+        cloud_outbox_concurrency: int = 4,
+        cloud_migration_concurrency: int = 8,
+        background: Optional[BackgroundTasks] = None,
     ):
+        self.data_dir = data_dir
         self.api_base_url = api_base_url  # 这是 FastAPI 服务的基URL
-        self.http_client = http_client
-        self.data_file = os.path.join(data_dir, "astrbot_plugin_message_bottle.json")
-        _ensure_data_file(self.data_file)
-        self.data = _load_bottles(self.data_file)
-        self.lock = asyncio.Lock()
+        self.api_client = api_client
+        self.backend = create_local_backend(
+            data_dir,
+            storage_mode,
+            journal_fsync_interval,
+            journal_compact_threshold,
+            history_cache_size,
+            shared_sea_path,
+            PickPolicy(pick_policy, pick_age_half_life_hours, pick_other_group_boost),
+        )
+        # base64 图片按内容哈希保存在磁盘上，瓶中信中只保存引用
+        blob_dir = data_dir
+        if shared_sea_path:
+            blob_dir = os.path.dirname(os.path.abspath(shared_sea_path))
+        self.blob_store = BlobStore(
+            os.path.join(blob_dir, "astrbot_plugin_message_bottle_blobs"),
+            shared=bool(shared_sea_path),
+        )
+        self.blob_store.rebuild(self.backend.blob_refs())
+        # 海面上的瓶中信池只在放入和捡起的瞬间加锁，用户历史按用户加锁，
+        # 落盘在锁外的后台任务中完成
+        self.pool_lock = asyncio.Lock()
+        self.user_locks = KeyedLock()
+        # 导入、导出和迁移同一时间只运行一个
+        self.transfer_lock = asyncio.Lock()
+        self.cloud_migration_concurrency = cloud_migration_concurrency
+        # 捡到的云瓶中信在回复之后才写入历史，未提供时在捡瓶时写入
+        self.background = background
+        metrics.gauge("local_active_bottles", self.backend.active_count)
+        metrics.gauge("image_blobs", lambda: len(self.blob_store.refs))
+        # 云端海面上的瓶中信数量，统计指令直接从内存中读取
+        self.cloud_count = CachedCount(
+            self._fetch_cloud_bottle_count, cloud_count_ttl, cloud_count_max_stale
+        )
+        # 云瓶中信先写入本地发件箱，由后台分批发往云端
+        self.outbox: Optional[CloudOutbox] = None
+        if cloud_outbox:
+            self.outbox = CloudOutbox(
+                os.path.join(data_dir, "astrbot_plugin_message_bottle_outbox.jsonl"),
+                self._send_cloud_bottle,
+                batch_size=cloud_outbox_batch_size,
+                concurrency=cloud_outbox_concurrency,
+            )
         self.enable_content_safety = enable_content_safety
         # 检查瓶中信内容是否合规
         if enable_content_safety:
@@ -44,33 +157,72 @@ class BottleStorage:
                 content_safety_config["app_id"],
                 content_safety_config["api_key"],
                 content_safety_config["secret_key"],
+                cache_ttl=content_safety_cache_ttl,
+                cache_size=content_safety_cache_size,
+                max_workers=content_safety_workers,
+            )
+        # 本地瓶中信扔出后在后台审核，通过后才放入海中
+        self.moderation: Optional[ModerationQueue] = None
+        # 扔出时查询到的 rkey，QQ 图片链接需要带上它才能下载送审。
+        # 不落盘，重启后恢复的含 QQ 图片的瓶中信无法送审，重试次数用完后按未通过处理
+        self._moderation_rkeys: Dict[str, str] = {}
+        if enable_content_safety:
+            self.moderation = ModerationQueue(
+                self._moderate_bottle, self._resolve_pending, moderation_workers
             )
+        for bottle in self.backend.list_pending():
+            if self.moderation is not None:
+                self.moderation.submit(bottle)
+            else:
+                # 关闭了内容安全检查，之前待审核的瓶中信直接放入海中
+                self.backend.resolve_pending(bottle["bottle_id"], True)
 
     async def _make_api_request(
-        self, method: str, path: str, json_data: Optional[Dict] = None
+        self,
+        method: str,
+        path: str,
+        json_data: Optional[Dict] = None,
+        endpoint: Optional[str] = None,
     ) -> Any:
         url = f"{self.api_base_url}{path}"
+        if method not in ("GET", "POST"):
+            raise ValueError(f"Unsupported HTTP method: {method}")
+        # 指标按接口聚合，路径中的用户 ID 等参数不计入标签
+        endpoint = f"{method} {endpoint or path}"
+        result = "ok"
         try:
-            if method == "GET":
-                async with self.http_client.get(url) as response:
-                    response.raise_for_status()
-                    return await response.json()
-            elif method == "POST":
-                async with self.http_client.post(url, json=json_data) as response:
-                    response.raise_for_status()
-                    return await response.json()
-            else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
+            with metrics.timer("cloud_request_seconds", endpoint=endpoint):
+                return await self.api_client.request(method, path, json_data)
         except aiohttp.ClientResponseError as e:
             # 捕获 HTTP 状态码错误 (例如 404, 500)
+            result = f"http_{e.status}"
             logger.error(
                 f"API请求失败 (HTTP Status Error {e.status} - {method} {url}): {e}"
             )
             raise  # 重新抛出，让调用者处理，或根据需要返回 None
-        except aiohttp.ClientError as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             # 捕获更广泛的客户端错误 (例如连接问题，超时)
-            logger.error(f"API请求失败 (Client Error - {method} {url}): {e}")
+            result = "error"
+            logger.error(f"API请求失败 (Client Error - {method} {url}): {e!r}")
             raise  # 重新抛出，让调用者处理，或根据需要返回 None
+        except CircuitOpenError as e:
+            # 熔断期间快速失败，不再等待超时
+            result = "circuit_open"
+            logger.warning(f"API请求被熔断 ({method} {url}): {e}")
+            raise
+        finally:
+            metrics.inc("cloud_requests_total", endpoint=endpoint, result=result)
+
+    async def close(self):
+        """关闭存储，确保数据落盘"""
+        self.cloud_count.close()
+        if self.outbox is not None:
+            await self.outbox.close()
+        if self.moderation is not None:
+            await self.moderation.close()
+        await self.backend.close()
+        if self.enable_content_safety:
+            self.content_safety.close()
 
     async def add_bottle(
         self,
@@ -80,6 +232,8 @@ class BottleStorage:
         sender_id: str,
         is_cloud: bool,
         poke: bool,
+        group_id: str = "",
+        event: Optional[AstrMessageEvent] = None,
     ) -> str:
         bottle_data = {
             "content": content,
@@ -89,28 +243,39 @@ class BottleStorage:
             "poke": poke,
         }
         try:
-            if is_cloud:
+            if is_cloud and self.outbox is not None:
+                # 放入发件箱并落盘后返回临时编号
+                new_id = await self.outbox.put(bottle_data)
+            elif is_cloud:
                 # 添加新云瓶中信
-                response_data = await self._make_api_request(
-                    "POST", "/bottles/", json_data=bottle_data
-                )
-                response_id = response_data.get("bottle_id")
-                new_id = f"c{response_id}"
-                if new_id is None:
-                    raise ValueError("API did not return a bottle_id.")
+                new_id = await self._send_cloud_bottle(bottle_data)
             else:
                 # 本地添加瓶中信
-                async with self.lock:
-                    bottle_data["picked"] = False
-                    bottle_data["timestamp"] = datetime.now().strftime(
-                        "%Y-%m-%d %H:%M:%S"
-                    )
-                    local_id_counter = self.data.get("next_local_id", 1)
-                    new_id = f"l{local_id_counter}"
-                    bottle_data["bottle_id"] = new_id
-                    self.data["next_local_id"] = local_id_counter + 1
-                    self.data["active"].append(bottle_data)
-                    _save_bottles(self.data_file, self.data)
+                bottle_data = Bottle.from_dict(bottle_data)
+                bottle_data["images"] = await self.blob_store.externalize(images)
+                # 记录来源群聊，供 other_group 捡瓶策略使用
+                if group_id:
+                    bottle_data["group_id"] = group_id
+                try:
+                    async with metrics.timed_lock(self.pool_lock, scope="pool"):
+                        bottle_data["picked"] = False
+                        bottle_data["timestamp"] = datetime.now().strftime(
+                            "%Y-%m-%d %H:%M:%S"
+                        )
+                        if self.moderation is not None:
+                            with metrics.timer("local_backend_seconds", op="hold"):
+                                new_id = self.backend.hold(bottle_data)
+                        else:
+                            with metrics.timer("local_backend_seconds", op="add"):
+                                new_id = self.backend.add(bottle_data)
+                except Exception:
+                    self.blob_store.release(bottle_data["images"])
+                    raise
+                if self.moderation is not None:
+                    rkey = await self._moderation_rkey(images, event)
+                    if rkey is not None:
+                        self._moderation_rkeys[new_id] = rkey
+                    self.moderation.submit(bottle_data)
 
             logger.info(f"成功添加瓶中信，ID: {new_id}")
             return new_id
@@ -118,17 +283,51 @@ class BottleStorage:
             logger.error(f"添加瓶中信失败: {str(e)}")
             return None
 
+    async def _send_cloud_bottle(self, bottle: Dict) -> str:
+        response_data = await self._make_api_request(
+            "POST", "/bottles/", json_data=bottle
+        )
+        response_id = response_data.get("bottle_id")
+        if response_id is None:
+            raise ValueError("API did not return a bottle_id.")
+        self.cloud_count.adjust(1)
+        return f"c{response_id}"
+
+    async def _moderation_rkey(
+        self, images: List[Dict], event: Optional[AstrMessageEvent]
+    ) -> Optional[str]:
+        try:
+            return await get_images_rkey(images, event)
+        except Exception as e:
+            logger.warning(f"查询 rkey 失败，瓶中信中的 QQ 图片将无法送审: {str(e)}")
+            return None
+
+    async def _moderate_bottle(self, bottle: Dict) -> Optional[bool]:
+        view = BottleView(bottle, self._moderation_rkeys.get(bottle["bottle_id"]))
+        return await censor_bottle(view, self.content_safety, self.blob_store)
+
+    async def _resolve_pending(self, bottle: Dict, approved: bool):
+        async with metrics.timed_lock(self.pool_lock, scope="pool"):
+            with metrics.timer("local_backend_seconds", op="resolve_pending"):
+                resolved = self.backend.resolve_pending(bottle["bottle_id"], approved)
+        self._moderation_rkeys.pop(bottle["bottle_id"], None)
+        if resolved is not None and not approved:
+            self.blob_store.release(resolved["images"])
+            logger.info(f"瓶中信 {bottle['bottle_id']} 未通过内容审核，已删除")
+
     async def pick_random_cloud_bottle(
         self, event: AstrMessageEvent
     ) -> tuple[Optional[Dict], str]:
         """随机捡起一个云瓶中信"""
         try:
             sender_id = event.get_sender_id()
-            rkey = await get_rkey(event)
-            bottle = await self._make_api_request("POST", f"/bottles/pick/{sender_id}")
+            bottle = await self._make_api_request(
+                "POST", f"/bottles/pick/{sender_id}", endpoint="/bottles/pick/{sender_id}"
+            )
+            self.cloud_count.adjust(-1)
             bottle["bottle_id"] = f"c{bottle['bottle_id']}"
             # 对于含qq图片的bottle, bottle2handle中添加了rkey(qq平台接收时)
-            bottle2handle = await get_bottle2handle(bottle, rkey)
+            bottle2handle = await get_bottle2handle(bottle, event)
             # 检查瓶中信内容是否合规
             if self.enable_content_safety:
                 bottle2handle, msg = await check_bottle(
@@ -138,11 +337,10 @@ class BottleStorage:
                     return None, msg
 
             if bottle and bottle.get("bottle_id") is not None:
-                async with self.lock:
-                    if sender_id not in self.data["user_list"]:
-                        self.data["user_list"][sender_id] = []
-                    self.data["user_list"][sender_id].append(bottle)
-                    _save_bottles(self.data_file, self.data)
+                if self.background is None or not self.background.submit(
+                    "collect_cloud_bottle", self._collect_cloud_bottle, sender_id, bottle
+                ):
+                    await self._collect_cloud_bottle(sender_id, bottle)
                 logger.info(
                     f"用户 {sender_id} 成功捡起瓶中信，ID: {bottle.get('bottle_id')}"
                 )
@@ -163,39 +361,39 @@ class BottleStorage:
             msg = "捡起瓶中信失败，请稍后重试..."
             return None, msg
 
+    async def _collect_cloud_bottle(self, sender_id: str, bottle: Dict):
+        # 视图仍引用 API 返回的原瓶中信，历史中保存转存图片后的副本
+        stored = Bottle.from_dict(bottle)
+        stored["images"] = await self.blob_store.externalize(bottle["images"])
+        async with metrics.timed_lock(self.user_locks.hold(sender_id), scope="user"):
+            with metrics.timer("local_backend_seconds", op="collect"):
+                self.backend.collect(sender_id, stored)
+
     async def pick_random_bottle(
         self, event: AstrMessageEvent
     ) -> tuple[Optional[Dict], str]:
         """随机捡起一个瓶中信"""
         try:
             sender_id = event.get_sender_id()
-            rkey = await get_rkey(event)
-            async with self.lock:
-                available_bottles = [
-                    b
-                    for b in self.data["active"]
-                    if not b.get("picked") and b.get("sender_id") != sender_id
-                ]
-                if not available_bottles:
-                    msg = "海面上没有别人的瓶中信了..."
-                    return None, msg
-                bottle = random.choice(available_bottles)
+            # 先按用户加锁再锁池，顺序固定避免死锁
+            async with metrics.timed_lock(
+                self.user_locks.hold(sender_id), scope="user"
+            ), metrics.timed_lock(self.pool_lock, scope="pool"):
+                with metrics.timer("local_backend_seconds", op="claim"):
+                    bottle = self.backend.claim_random(
+                        sender_id, event.get_group_id()
+                    )
+            if not bottle:
+                msg = "海面上没有别人的瓶中信了..."
+                return None, msg
 
-            if bottle and bottle.get("bottle_id") is not None:
-                self.data["active"].remove(bottle)
-                bottle["picked"] = True
-                # 对于本地瓶中信，不需要审查, bottle2handle仅用于返回
-                bottle2handle = await get_bottle2handle(bottle, rkey)
-                async with self.lock:
-                    if sender_id not in self.data["user_list"]:
-                        self.data["user_list"][sender_id] = []
-                    self.data["user_list"][sender_id].append(bottle)
-                    _save_bottles(self.data_file, self.data)
-                logger.info(
-                    f"用户 {sender_id} 成功捡起瓶中信，ID: {bottle.get('bottle_id')}"
-                )
-                msg = "你捡到了一个瓶中信！"
-                return bottle2handle, msg
+            # 本地瓶中信在扔出时已在后台审核, bottle2handle仅用于返回
+            bottle2handle = await get_bottle2handle(bottle, event)
+            logger.info(
+                f"用户 {sender_id} 成功捡起瓶中信，ID: {bottle.get('bottle_id')}"
+            )
+            msg = "你捡到了一个瓶中信！"
+            return bottle2handle, msg
         except Exception as e:  # 捕获其他可能的异常，如连接问题
             logger.error(f"捡起瓶中信失败: {str(e)}")
             msg = "捡起瓶中信失败，请稍后重试..."
@@ -206,51 +404,172 @@ class BottleStorage:
     ) -> Optional[Dict]:
         """获取指定ID或随机一个已捡起的瓶中信"""
         sender_id = event.get_sender_id()
-        rkey = await get_rkey(event)
-        if sender_id not in self.data["user_list"]:
+        selected_bottle = self.backend.get_picked(sender_id, bottle_id)
+        if not selected_bottle:
             return None
-        selected_bottle = None
-        if bottle_id is not None:
-            for bottle in self.data["user_list"][sender_id]:
-                if bottle["bottle_id"] == bottle_id:
-                    selected_bottle = bottle
-                    break
-            if not selected_bottle:
-                return None
-        else:
-            selected_bottle = random.choice(self.data["user_list"][sender_id])
 
-        bottle2handle = await get_bottle2handle(selected_bottle, rkey)
+        bottle2handle = await get_bottle2handle(selected_bottle, event)
         return bottle2handle
 
     def get_local_bottle_counts(self, sender_id: str) -> tuple[int, int]:
         """获取瓶中信数量"""
         # total active bottles: 通过本地获取
-        total_active_bottles = len(self.data["active"])
+        total_active_bottles = self.backend.active_count()
 
         # picked bottles: 从本地数据获取
-        picked_bottles = self.data["user_list"].get(sender_id, [])
-        user_picked_bottles_count = len(picked_bottles)
+        user_picked_bottles_count = self.backend.picked_count(sender_id)
 
         # 尚有瓶中信数量，用户已捡起瓶中信数量
         return total_active_bottles, user_picked_bottles_count
 
+    async def _fetch_cloud_bottle_count(self) -> int:
+        response_data = await self._make_api_request("GET", "/bottles/counts/active")
+        return response_data.get("total_active_bottles", 0)
+
     async def get_cloud_bottle_counts(self) -> int:
         """获取瓶中信数量"""
-        # total active bottles: 通过API获取
+        # total active bottles: 优先使用缓存，过期后在后台通过API刷新
         total_active_bottles = -1
         try:
-            response_data = await self._make_api_request(
-                "GET", "/bottles/counts/active"
-            )
-            total_active_bottles = response_data.get("total_active_bottles", 0)
+            total_active_bottles = await self.cloud_count.get()
         except Exception as e:
             logger.error(f"获取总活跃瓶中信数量失败: {str(e)}")
 
         return total_active_bottles
 
-    def get_picked_bottles(self, sender_id: str) -> List[Dict]:
-        """获取所有已捡起的瓶中信"""
-        bottles = self.data["user_list"].get(sender_id, [])
+    def get_picked_bottles(
+        self, sender_id: str, page: int = 1, page_size: int = 10
+    ) -> tuple[List[Dict], int, int]:
+        """分页获取已捡起的瓶中信，页码超出范围时取最近的一页，
+        返回该页瓶中信、实际页码和总页数"""
+        total_pages = max(1, -(-self.backend.picked_count(sender_id) // page_size))
+        page = min(max(page, 1), total_pages)
+        bottles = self.backend.list_picked(
+            sender_id, offset=(page - 1) * page_size, limit=page_size
+        )
+        return bottles, page, total_pages
+
+    def search_picked_bottles(
+        self, sender_id: str, keyword: str, limit: int = 10
+    ) -> List[Dict]:
+        """搜索已捡起的瓶中信，多个关键词以空格分隔，需同时匹配"""
+        return self.backend.search_picked(sender_id, keyword.strip(), limit)
+
+    async def export_bottles(self, path: Optional[str] = None) -> tuple[str, Dict]:
+        """导出本地瓶中信到 NDJSON 文件，返回文件路径和各类记录的数量"""
+        path = path or os.path.join(
+            self.data_dir, "astrbot_plugin_message_bottle_export.ndjson"
+        )
+        async with self.transfer_lock:
+            counts = await export_ndjson(self.backend, self.blob_store, path)
+        logger.info(f"已导出瓶中信到 {path}: {counts}")
+        return path, counts
+
+    async def import_bottles(self, path: str) -> Dict[str, int]:
+        """从导出文件导入瓶中信，海面上和待审核的瓶中信重新分配编号"""
+        counts = {"active": 0, "pending": 0, "picked": 0, "skipped": 0}
+        async with self.transfer_lock:
+            records = read_ndjson(path)
+            while True:
+                # 读取和解析文件在线程中进行，每批写入后让出事件循环
+                chunk = await asyncio.to_thread(
+                    list, itertools.islice(records, CHUNK_SIZE)
+                )
+                if not chunk:
+                    break
+                active: List[Dict] = []
+                pending: List[Dict] = []
+                picked: List[tuple[str, Dict]] = []
+                for record in chunk:
+                    bottle = await self._import_record(record)
+                    if bottle is None:
+                        counts["skipped"] += 1
+                    elif record["kind"] == "active":
+                        active.append(bottle)
+                    elif record["kind"] == "pending":
+                        pending.append(bottle)
+                    else:
+                        picked.append((record["sender_id"], bottle))
+                try:
+                    async with metrics.timed_lock(self.pool_lock, scope="pool"):
+                        with metrics.timer("local_backend_seconds", op="import"):
+                            await self.backend.import_bottles(active, picked)
+                except Exception:
+                    for bottle in (*active, *pending, *(b for _, b in picked)):
+                        self.blob_store.release(bottle["images"])
+                    raise
+                counts["active"] += len(active)
+                counts["picked"] += len(picked)
+                for i, bottle in enumerate(pending):
+                    try:
+                        await self._import_pending(bottle)
+                    except Exception:
+                        for rest in pending[i:]:
+                            self.blob_store.release(rest["images"])
+                        raise
+                    counts["pending"] += 1
+                await asyncio.sleep(0)
+        logger.info(f"已从 {path} 导入瓶中信: {counts}")
+        return counts
+
+    async def _import_record(self, record: Dict) -> Optional[Bottle]:
+        kind = record.get("kind")
+        bottle = record.get("bottle")
+        if kind not in ("active", "pending", "picked") or not isinstance(bottle, dict):
+            return None
+        if kind == "picked" and not record.get("sender_id"):
+            return None
+        try:
+            images = await self.blob_store.externalize(bottle.get("images") or [])
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"跳过图片格式错误的瓶中信 {bottle.get('bottle_id')}: {e!r}")
+            return None
+        bottle = Bottle.from_dict({**bottle, "images": images})
+        if kind != "picked":
+            bottle["picked"] = False
+        return bottle
+
+    async def _import_pending(self, bottle: Bottle):
+        """导出时待审核的瓶中信：启用审核时重新送审，否则直接放入海中"""
+        async with metrics.timed_lock(self.pool_lock, scope="pool"):
+            if self.moderation is not None:
+                with metrics.timer("local_backend_seconds", op="hold"):
+                    self.backend.hold(bottle)
+            else:
+                with metrics.timer("local_backend_seconds", op="add"):
+                    self.backend.add(bottle)
+        if self.moderation is not None:
+            self.moderation.submit(bottle)
+
+    async def migrate_to_cloud(self, keep_local: bool = False) -> Dict[str, int]:
+        """把海面上的本地瓶中信逐个发往云端，进度保存在数据目录中，中断后可以继续
+
+        上传成功的瓶中信从本地海域移除，避免同一个瓶中信在本地和云端各被捡起一次；
+        keep_local 为 True 时只复制到云端
+        """
+        checkpoint_path = os.path.join(
+            self.data_dir, "astrbot_plugin_message_bottle_migration.jsonl"
+        )
+        migration = CloudMigration(
+            checkpoint_path,
+            self._send_cloud_bottle,
+            self.blob_store,
+            concurrency=self.cloud_migration_concurrency,
+            claim=None if keep_local else self._claim_for_migration,
+            settle=None if keep_local else self._settle_migration,
+        )
+        async with self.transfer_lock:
+            return await migration.run(self.backend.iter_active())
+
+    async def _claim_for_migration(self, bottle: Dict) -> Optional[Dict]:
+        # 上传期间瓶中信处于待审核状态，不会被捡起；进程中断时它仍保存在本地，重启后放回海中
+        async with metrics.timed_lock(self.pool_lock, scope="pool"):
+            with metrics.timer("local_backend_seconds", op="suspend"):
+                return self.backend.suspend(bottle["bottle_id"])
 
-        return sorted(bottles, key=lambda x: x["timestamp"], reverse=True)
+    async def _settle_migration(self, bottle: Dict, uploaded: bool):
+        async with metrics.timed_lock(self.pool_lock, scope="pool"):
+            with metrics.timer("local_backend_seconds", op="resolve_pending"):
+                resolved = self.backend.resolve_pending(bottle["bottle_id"], not uploaded)
+        if resolved is not None and uploaded:
+            self.blob_store.release(resolved["images"])
@@ -0,0 +1,155 @@
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+from astrbot.api import logger
+import asyncio
+import time
+
+
+class TTLCache:
+    """带过期时间的 LRU 缓存"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+
+class SingleFlight:
+    """合并并发请求：同一个键同时只有一个请求在执行，其余调用者等待它的结果"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+
+class KeyedLock:
+    """按键区分的锁，没有持有者和等待者时自动回收"""
+
+    def __init__(self):
+        # key -> [锁, 持有者和等待者数量]
+        self._locks: Dict[Hashable, List] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+
+class CachedCount:
+    """短时缓存的计数：过期后先返回旧值并在后台刷新，并发加载合并为一次
+
+    两次刷新之间可以通过 adjust 计入本地已知的增减
+    """
+
+    def __init__(
+        self, loader: Callable[[], Awaitable[int]], ttl: float = 30, max_stale: float = 600
+    ):
+        self._loader = loader
+        self.ttl = ttl
+        # 超过此时间的旧值不再直接返回，必须等待刷新
+        self.max_stale = max_stale
+        self._value: Optional[int] = None
+        self._loaded_at = 0.0
+        self._delta = 0
+        self._flight = SingleFlight()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def _load(self) -> int:
+        delta_before = self._delta
+        value = await self._loader()
+        self._value = value
+        self._loaded_at = time.monotonic()
+        # 加载期间发生的增减尚未反映在新值中，予以保留
+        self._delta -= delta_before
+        return value
+
+    async def _refresh(self):
+        try:
+            await self._flight.do(None, self._load)
+        except Exception as e:
+            logger.warning(f"后台刷新计数失败: {e!r}")
+
+    def adjust(self, n: int):
+        self._delta += n
+
+    def invalidate(self):
+        self._loaded_at = 0.0
+
+    async def get(self) -> int:
+        age = time.monotonic() - self._loaded_at
+        if self._value is None or age > self.max_stale:
+            await self._flight.do(None, self._load)
+        elif age > self.ttl and (
+            self._refresh_task is None or self._refresh_task.done()
+        ):
+            self._refresh_task = asyncio.get_running_loop().create_task(
+                self._refresh()
+            )
+        return max(0, self._value + self._delta)
+
+    def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
@@ -1,5 +1,6 @@
 from typing import Any
-from astrbot.api import AstrBotConfig
+from astrbot.api import AstrBotConfig, logger
+from .utils import PILImage, image_size
 
 
 class ConfigManager:
@@ -8,8 +9,56 @@ class ConfigManager:
         self.max_text_length = self.config.get("max_text_length", 500)
         self.max_images = self.config.get("max_images", 1)
         self.api_base_url = self.config.get("api_base_url", "")
+        self.api_connect_timeout = self.config.get("api_connect_timeout", 5)
+        self.api_read_timeout = self.config.get("api_read_timeout", 10)
+        self.api_pool_size = self.config.get("api_pool_size", 20)
+        self.api_keepalive_timeout = self.config.get("api_keepalive_timeout", 30)
+        self.api_dns_cache_ttl = self.config.get("api_dns_cache_ttl", 300)
+        self.api_max_retries = self.config.get("api_max_retries", 2)
+        self.api_retry_backoff = self.config.get("api_retry_backoff", 0.3)
+        self.api_breaker_failures = self.config.get("api_breaker_failures", 5)
+        self.api_breaker_reset = self.config.get("api_breaker_reset", 30)
+        self.cloud_count_ttl = self.config.get("cloud_count_ttl", 30)
+        self.cloud_count_max_stale = self.config.get("cloud_count_max_stale", 600)
+        self.cloud_outbox = self.config.get("cloud_outbox", True)
+        self.cloud_outbox_batch_size = self.config.get("cloud_outbox_batch_size", 10)
+        self.cloud_outbox_concurrency = self.config.get("cloud_outbox_concurrency", 4)
+        self.cloud_migration_concurrency = self.config.get(
+            "cloud_migration_concurrency", 8
+        )
+        self.picked_list_page_size = max(1, self.config.get("picked_list_page_size", 10))
+        self.user_rate_limit = self.config.get("user_rate_limit", 6)
+        self.group_rate_limit = self.config.get("group_rate_limit", 30)
+        self.dedup_window = self.config.get("dedup_window", 10000)
+        self.dedup_max_distance = self.config.get("dedup_max_distance", 6)
+        self.dedup_min_length = self.config.get("dedup_min_length", 10)
+        self.metrics_export_file = self.config.get("metrics_export_file", "")
+        self.metrics_export_interval = self.config.get("metrics_export_interval", 60)
         self.use_base64 = self.config.get("use_base64", False)
+        self.max_image_size_kb = self.config.get("max_image_size_kb", 2048)
+        self.image_max_dimension = self.config.get("image_max_dimension", 0)
+        self.image_quality = self.config.get("image_quality", 85)
+        if self.image_max_dimension > 0 and PILImage is None:
+            logger.error("压缩图片应该先 pip install pillow，将保存原图")
         self.enable_content_safety = self.config.get("enable_content_safety", False)
+        self.content_safety_cache_ttl = self.config.get(
+            "content_safety_cache_ttl", 86400
+        )
+        self.content_safety_cache_size = self.config.get(
+            "content_safety_cache_size", 4096
+        )
+        self.content_safety_workers = self.config.get("content_safety_workers", 4)
+        self.moderation_workers = self.config.get("moderation_workers", 2)
+        self.storage_mode = self.config.get("storage_mode", "json")
+        self.journal_fsync_interval = self.config.get("journal_fsync_interval", 1.0)
+        self.journal_compact_threshold = self.config.get(
+            "journal_compact_threshold", 1000
+        )
+        self.history_cache_size = self.config.get("history_cache_size", 256)
+        self.shared_sea_path = self.config.get("shared_sea_path", "")
+        self.pick_policy = self.config.get("pick_policy", "uniform")
+        self.pick_age_half_life_hours = self.config.get("pick_age_half_life_hours", 24)
+        self.pick_other_group_boost = self.config.get("pick_other_group_boost", 3)
 
     def check_content_limits(self, content: str, images: list) -> tuple[bool, str]:
         """检查内容是否符合限制"""
@@ -19,4 +68,9 @@ class ConfigManager:
         if len(images) > self.max_images:
             return False, f"图片数量超过限制（最大 {self.max_images} 张）"
 
+        if self.max_image_size_kb > 0 and any(
+            image_size(img) > self.max_image_size_kb * 1024 for img in images
+        ):
+            return False, f"图片大小超过限制（最大 {self.max_image_size_kb} KB）"
+
         return True, ""
@@ -2,25 +2,77 @@
 使用此功能应该先 pip install baidu-aip
 """
 
+from typing import Optional, Union
+from concurrent.futures import ThreadPoolExecutor
 from aip import AipContentCensor
+from .caching import TTLCache
+from .metrics import metrics
+import asyncio
+import hashlib
 
 
 class ContentSafety:
-    def __init__(self, appid: str, ak: str, sk: str) -> None:
+    def __init__(
+        self,
+        appid: str,
+        ak: str,
+        sk: str,
+        cache_ttl: float = 86400,
+        cache_size: int = 4096,
+        max_workers: int = 4,
+    ) -> None:
         self.app_id = appid
         self.api_key = ak
         self.secret_key = sk
         self.client = AipContentCensor(self.app_id, self.api_key, self.secret_key)
+        # 审核结果按内容哈希缓存，热门瓶中信和图片无需重复审核
+        self.cache = TTLCache(cache_size, cache_ttl)
+        # 百度 SDK 是同步阻塞的，放到独立线程池中执行
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="bottle_censor"
+        )
 
-    def check(self, type: str, content: str):
+    def _censor(self, type: str, content: Union[str, bytes]) -> Optional[bool]:
+        """调用审核接口，接口出错时返回 None"""
         if type == "text":
             res = self.client.textCensorUserDefined(content)
         elif type == "image":
             res = self.client.imageCensorUserDefined(content)
         if "conclusionType" not in res:
-            return False
+            return None
         # 合规
-        if res["conclusionType"] == 1:
-            return True
-        else:
-            return False
+        return res["conclusionType"] == 1
+
+    async def censor_async(
+        self, type: str, content: Union[str, bytes], cache_key: Optional[str] = None
+    ) -> Optional[bool]:
+        """在线程池中审核，结果按内容哈希缓存，接口出错时返回 None"""
+        if cache_key is None:
+            raw = content.encode("utf-8") if isinstance(content, str) else content
+            cache_key = hashlib.sha256(raw).hexdigest()
+        key = (type, cache_key)
+        verdict = self.cache.get(key)
+        if verdict is not None:
+            metrics.inc("content_safety_cache_total", type=type, result="hit")
+            return verdict
+        metrics.inc("content_safety_cache_total", type=type, result="miss")
+        loop = asyncio.get_running_loop()
+        with metrics.timer("content_safety_seconds", type=type):
+            verdict = await loop.run_in_executor(
+                self._executor, self._censor, type, content
+            )
+        if verdict is None:
+            # 接口出错不缓存
+            metrics.inc("content_safety_errors_total", type=type)
+            return None
+        self.cache.set(key, verdict)
+        return verdict
+
+    async def check_async(
+        self, type: str, content: Union[str, bytes], cache_key: Optional[str] = None
+    ) -> bool:
+        """审核内容，接口出错时按不合规处理"""
+        return bool(await self.censor_async(type, content, cache_key))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,155 @@
+"""
+扔瓶时的近似重复检测：为最近扔出的瓶中信的文字计算 64 位 SimHash，图片按内容记录，
+新瓶中信与窗口内的瓶中信过于相似时拒绝，窗口满后淘汰最早的记录
+"""
+
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+import re
+from .metrics import metrics
+
+FINGERPRINT_BITS = 64
+# 文字按字符切成这么长的片段作为特征
+SHINGLE_SIZE = 2
+# 长文字只取哈希值最小的这么多个特征，相似文字取到的特征也大多相同
+MAX_FEATURES = 128
+_NON_WORD = re.compile(r"[\W_]+")
+# 第 b 张表把字节映射为它的第 b 位
+_BIT_TABLES = [bytes(v >> b & 1 for v in range(256)) for b in range(8)]
+
+
+def normalize(text: str) -> str:
+    """去掉空白和标点并转为小写，只保留文字和数字"""
+    return _NON_WORD.sub("", text.lower())
+
+
+def simhash(text: str) -> int:
+    """已规范化文字的 SimHash 指纹
+
+    所有特征的哈希值拼接为字节串，每个比特位的计数由 translate 和 count 在 C 中完成
+    """
+    count = max(1, len(text) - SHINGLE_SIZE + 1)
+    features = {hash(text[i : i + SHINGLE_SIZE]) for i in range(count)}
+    if len(features) > MAX_FEATURES:
+        features = sorted(features)[:MAX_FEATURES]
+    blob = b"".join(h.to_bytes(8, "little", signed=True) for h in features)
+    # 计数超过特征数一半的比特位为 1
+    threshold = len(features) // 2
+    fingerprint = 0
+    for i in range(FINGERPRINT_BITS // 8):
+        column = blob[i::8]
+        for b, table in enumerate(_BIT_TABLES):
+            if column.translate(table).count(1) > threshold:
+                fingerprint |= 1 << (i * 8 + b)
+    return fingerprint
+
+
+def image_key(img: Dict) -> int:
+    # qq 图片链接中的 rkey 会变化，比较时不包含 rkey
+    data = img["data"]
+    if img["type"] == "qq_url":
+        data = data.split("&rkey=")[0]
+    return hash((img["type"], data))
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "images", "alive")
+
+    def __init__(self, fingerprint: Optional[int], images: Tuple[int, ...]):
+        self.fingerprint = fingerprint
+        self.images = images
+        self.alive = True
+
+
+class DuplicateFilter:
+    """
+    指纹按鸽巢原理分块建立索引：海明距离不超过 max_distance 的两个指纹，
+    在 max_distance + 1 个分块中至少有一块完全相同，查找时只需比较同块的候选
+    """
+
+    def __init__(
+        self, window: int = 10000, max_distance: int = 6, min_length: int = 10
+    ):
+        self.window = max(1, window)
+        self.max_distance = min(max(0, max_distance), FINGERPRINT_BITS // 4)
+        # 规范化后短于此长度的文字不参与比较，避免误伤"晚安"之类的常见短句
+        self.min_length = min_length
+        blocks = self.max_distance + 1
+        width = FINGERPRINT_BITS // blocks
+        # (右移位数, 掩码)，最后一块包含除不尽的剩余比特位
+        self._blocks: List[Tuple[int, int]] = []
+        for i in range(blocks):
+            bits = width if i < blocks - 1 else FINGERPRINT_BITS - i * width
+            self._blocks.append((i * width, (1 << bits) - 1))
+        # 每个分块: 块的值 -> {指纹: 窗口内出现次数}
+        self._tables: List[Dict[int, Dict[int, int]]] = [{} for _ in self._blocks]
+        self._images: Dict[int, int] = {}
+        self._entries: Deque[_Entry] = deque()
+        metrics.gauge("dedup_window_size", lambda: len(self._entries))
+
+    def _fingerprint(self, content: str) -> Optional[int]:
+        text = normalize(content or "")
+        if len(text) < self.min_length:
+            return None
+        return simhash(text)
+
+    def _near(self, fingerprint: int) -> bool:
+        for (shift, mask), table in zip(self._blocks, self._tables):
+            candidates = table.get(fingerprint >> shift & mask)
+            if not candidates:
+                continue
+            for other in candidates:
+                if (fingerprint ^ other).bit_count() <= self.max_distance:
+                    return True
+        return False
+
+    def check(self, content: str, images: List[Dict]) -> Optional[_Entry]:
+        """未重复时记入窗口并返回记录，重复时返回 None
+
+        文字和图片都与窗口内的重复(或不参与比较)时才算重复；扔瓶失败时用 discard 撤销记录
+        """
+        fingerprint = self._fingerprint(content)
+        keys = tuple(image_key(img) for img in images)
+        if fingerprint is not None or keys:
+            text_dup = fingerprint is None or self._near(fingerprint)
+            images_dup = all(key in self._images for key in keys)
+            if text_dup and images_dup:
+                metrics.inc("duplicate_bottles_total")
+                return None
+        entry = _Entry(fingerprint, keys)
+        self._add(entry)
+        return entry
+
+    def _add(self, entry: _Entry):
+        if entry.fingerprint is not None:
+            for (shift, mask), table in zip(self._blocks, self._tables):
+                bucket = table.setdefault(entry.fingerprint >> shift & mask, {})
+                bucket[entry.fingerprint] = bucket.get(entry.fingerprint, 0) + 1
+        for key in entry.images:
+            self._images[key] = self._images.get(key, 0) + 1
+        self._entries.append(entry)
+        while len(self._entries) > self.window:
+            self.discard(self._entries.popleft())
+
+    def discard(self, entry: _Entry):
+        """从索引中移除一条记录，已移除的记录留在队列中等待淘汰"""
+        if not entry.alive:
+            return
+        entry.alive = False
+        if entry.fingerprint is not None:
+            for (shift, mask), table in zip(self._blocks, self._tables):
+                block = entry.fingerprint >> shift & mask
+                bucket = table[block]
+                count = bucket[entry.fingerprint] - 1
+                if count:
+                    bucket[entry.fingerprint] = count
+                    continue
+                del bucket[entry.fingerprint]
+                if not bucket:
+                    del table[block]
+        for key in entry.images:
+            count = self._images[key] - 1
+            if count:
+                self._images[key] = count
+            else:
+                del self._images[key]
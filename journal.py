@@ -0,0 +1,267 @@
+"""
+追加写日志存储：每次变更只向日志追加一条记录，定期在后台压缩为快照
+"""
+
+from typing import Dict, Optional
+from astrbot.api import logger
+import asyncio
+import json
+import os
+from .bottle import Bottle, json_default
+from .metrics import metrics
+
+
+def pop_pending(data: Dict, bottle_id: str) -> Optional[Dict]:
+    """从待审核列表中取出指定瓶中信，待审核的瓶中信通常很少，线性查找即可"""
+    pending = data.setdefault("pending", [])
+    for i, bottle in enumerate(pending):
+        if bottle["bottle_id"] == bottle_id:
+            return pending.pop(i)
+    return None
+
+
+def _apply_record(data: Dict, record: Dict, active_index: Dict[str, Dict]):
+    """将一条日志记录应用到内存数据上
+
+    被捡起和正在迁移到云端的瓶中信只从 active_index 中移除，由调用方统一从 active 列表中过滤
+    """
+    op = record.get("op")
+    if op == "add":
+        bottle = Bottle.from_dict(record["bottle"])
+        data["active"].append(bottle)
+        active_index[bottle["bottle_id"]] = bottle
+        data["next_local_id"] = max(
+            data.get("next_local_id", 1), record.get("next_local_id", 1)
+        )
+    elif op == "hold":
+        data.setdefault("pending", []).append(Bottle.from_dict(record["bottle"]))
+        data["next_local_id"] = max(
+            data.get("next_local_id", 1), record.get("next_local_id", 1)
+        )
+    elif op in ("approve", "reject"):
+        bottle = pop_pending(data, record["bottle_id"])
+        if bottle is not None and op == "approve":
+            data["active"].append(bottle)
+            active_index[bottle["bottle_id"]] = bottle
+    elif op == "pick":
+        bottle = active_index.pop(record["bottle_id"], None)
+        if bottle is None:
+            return
+        bottle["picked"] = True
+        data["user_list"].setdefault(record["sender_id"], []).append(bottle)
+    elif op == "suspend":
+        bottle = active_index.pop(record["bottle_id"], None)
+        if bottle is not None:
+            data.setdefault("pending", []).append(bottle)
+    elif op == "remove":
+        # 旧版本迁移时直接移除的记录
+        active_index.pop(record["bottle_id"], None)
+    elif op == "collect":
+        data["user_list"].setdefault(record["sender_id"], []).append(
+            Bottle.from_dict(record["bottle"])
+        )
+    else:
+        logger.warning(f"未知的瓶中信日志记录: {op}")
+
+
+class BottleJournal:
+    def __init__(
+        self,
+        snapshot_file: str,
+        fsync_interval: float = 1.0,
+        compact_threshold: int = 1000,
+    ):
+        self.snapshot_file = snapshot_file
+        self.journal_file = snapshot_file + ".journal"
+        # 压缩进行中时被轮转出去的旧日志
+        self.rotated_file = self.journal_file + ".1"
+        self.fsync_interval = fsync_interval
+        self.compact_threshold = compact_threshold
+        self.seq = 0
+        self._records_since_compact = 0
+        self._dirty = False
+        self._fp = None
+        self._flusher: Optional[asyncio.Task] = None
+        # 线程中进行的 fsync，完成前不能关闭文件，否则可能 fsync 到已关闭或被复用的描述符
+        self._flushing: Optional[asyncio.Future] = None
+        self._compacting: Optional[asyncio.Task] = None
+
+    def replay(self, data: Dict) -> int:
+        """在快照数据上重放日志，返回重放的记录数"""
+        snapshot_seq = data.pop("journal_seq", 0)
+        self.seq = snapshot_seq
+        active_index = {b["bottle_id"]: b for b in data["active"] if "bottle_id" in b}
+        replayed = 0
+        for path in (self.rotated_file, self.journal_file):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 崩溃时写了一半的尾部记录，丢弃
+                        logger.warning(f"跳过损坏的瓶中信日志记录: {path}")
+                        continue
+                    seq = record.get("seq", 0)
+                    if seq <= snapshot_seq:
+                        continue
+                    _apply_record(data, record, active_index)
+                    self.seq = max(self.seq, seq)
+                    replayed += 1
+        if replayed:
+            # 只保留仍在 active_index 中的瓶中信，过滤掉被捡起和迁移到云端的；
+            # 迁移失败放回海中的瓶中信会在 active 列表中出现两次，只保留一次
+            kept = set()
+            active = []
+            for b in data["active"]:
+                if "bottle_id" in b and active_index.get(b["bottle_id"]) is not b:
+                    continue
+                if id(b) not in kept:
+                    kept.add(id(b))
+                    active.append(b)
+            data["active"] = active
+        self._records_since_compact = replayed
+        return replayed
+
+    def _open(self):
+        if self._fp is None:
+            self._fp = open(self.journal_file, "a", encoding="utf-8")
+
+    def append(self, record: Dict):
+        """追加一条记录，写入操作系统缓冲区，fsync 由后台批量完成"""
+        self._open()
+        self.seq += 1
+        record["seq"] = self.seq
+        self._fp.write(json.dumps(record, ensure_ascii=False, default=json_default) + "\n")
+        self._fp.flush()
+        self._dirty = True
+        self._records_since_compact += 1
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and not self._flusher.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._flusher = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"同步瓶中信日志时出错: {str(e)}")
+
+    async def flush(self):
+        """将已写入的记录批量落盘"""
+        await self._wait_flushing()
+        if not self._dirty or self._fp is None:
+            return
+        self._dirty = False
+        self._flushing = asyncio.ensure_future(self._fsync(self._fp.fileno()))
+        # 调用方被取消时 fsync 仍在线程中进行，由 _flushing 继续跟踪
+        await asyncio.shield(self._flushing)
+
+    async def _fsync(self, fd: int):
+        with metrics.timer("journal_fsync_seconds"):
+            await asyncio.to_thread(os.fsync, fd)
+
+    async def _wait_flushing(self):
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self._records_since_compact >= self.compact_threshold
+
+    def maybe_compact(self, data: Dict):
+        """日志记录数超过阈值时，在后台将当前数据压缩为快照"""
+        if not self.needs_compaction:
+            return
+        if self._compacting is not None and not self._compacting.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._compacting = loop.create_task(self.compact(data))
+
+    async def compact(self, data: Dict):
+        """轮转日志并写出快照，快照包含轮转出去的全部记录"""
+        await self._wait_flushing()
+        # 从这里到截取快照不再让出事件循环，之后追加的记录写入新的日志文件
+        fp, self._fp = self._fp, None
+        self._dirty = False
+        if os.path.exists(self.journal_file):
+            if os.path.exists(self.rotated_file):
+                # 上一次压缩未完成，先把残留的旧日志并入
+                with open(self.rotated_file, "a", encoding="utf-8") as dst, open(
+                    self.journal_file, "r", encoding="utf-8"
+                ) as src:
+                    dst.write(src.read())
+                os.remove(self.journal_file)
+            else:
+                os.replace(self.journal_file, self.rotated_file)
+        self._records_since_compact = 0
+        snapshot = self._take_snapshot(data)
+        try:
+            if fp is not None:
+                # 快照写完前轮转出去的日志是这些记录唯一的落盘副本
+                with metrics.timer("journal_fsync_seconds"):
+                    await asyncio.to_thread(_close_synced, fp)
+            with metrics.timer("journal_compact_seconds"):
+                await asyncio.to_thread(self._write_snapshot, snapshot)
+            self._snapshot_written(snapshot)
+            if os.path.exists(self.rotated_file):
+                os.remove(self.rotated_file)
+            logger.info(f"瓶中信日志已压缩为快照，序号 {snapshot['journal_seq']}")
+        except Exception as e:
+            logger.error(f"压缩瓶中信日志时出错: {str(e)}")
+
+    def _take_snapshot(self, data: Dict) -> Dict:
+        """在事件循环中截取快照内容，写入在线程中进行"""
+        # 只复制容器结构，瓶中信本身共享引用
+        return {
+            "active": list(data["active"]),
+            "pending": list(data.get("pending", [])),
+            "user_list": {k: list(v) for k, v in data["user_list"].items()},
+            "next_local_id": data["next_local_id"],
+            "journal_seq": self.seq,
+        }
+
+    def _snapshot_written(self, snapshot: Dict):
+        """快照写入完成后在事件循环中调用"""
+
+    def _write_snapshot(self, snapshot: Dict):
+        tmp_file = self.snapshot_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, default=json_default)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+    async def close(self):
+        """停止后台任务并落盘"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._compacting is not None:
+            await asyncio.shield(self._compacting)
+            self._compacting = None
+        if self._fp is not None:
+            await self.flush()
+            self._fp.close()
+            self._fp = None
+
+
+def _close_synced(fp):
+    fp.flush()
+    os.fsync(fp.fileno())
+    fp.close()
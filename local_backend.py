@@ -0,0 +1,333 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from astrbot.api import logger
+import asyncio
+import os
+import random
+from .utils import _ensure_data_file, _load_bottles, _save_bottles
+from .journal import BottleJournal, pop_pending
+from .active_pool import ActivePool
+from .pick_policy import PickPolicy
+from .caching import TTLCache
+from .search import SearchIndex
+
+
+class DataFileLock:
+    """进程间独占数据文件，防止多个进程同时写入同一份数据"""
+
+    def __init__(self, data_file: str):
+        self._fp = open(data_file + ".lock", "a+")
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                msvcrt.locking(self._fp.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(self._fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._fp.close()
+            raise RuntimeError(
+                f"{data_file} 正被其他进程使用，多个进程共享海域请配置 shared_sea_path"
+            )
+
+    def release(self):
+        if not self._fp.closed:
+            # 关闭文件即释放锁
+            self._fp.close()
+
+
+class LocalBackend:
+    """本地瓶中信存储后端接口"""
+
+    def add(self, bottle: Dict) -> str:
+        """分配编号并放入海中，返回瓶中信编号"""
+        raise NotImplementedError
+
+    def hold(self, bottle: Dict) -> str:
+        """分配编号并放入待审核列表，审核通过前不会被捡起，返回瓶中信编号"""
+        raise NotImplementedError
+
+    def resolve_pending(self, bottle_id: str, approved: bool) -> Optional[Dict]:
+        """审核通过的瓶中信放入海中，未通过的删除，返回该瓶中信"""
+        raise NotImplementedError
+
+    def list_pending(self) -> List[Dict]:
+        """返回全部待审核的瓶中信"""
+        raise NotImplementedError
+
+    def claim_random(
+        self, sender_id: str, group_id: Optional[str] = None
+    ) -> Optional[Dict]:
+        """按捡瓶策略随机捡起一个不属于 sender_id 的瓶中信，并记入其历史"""
+        raise NotImplementedError
+
+    def collect(self, sender_id: str, bottle: Dict):
+        """将捡到的云瓶中信记入用户历史"""
+        raise NotImplementedError
+
+    def is_active(self, bottle_id: str) -> bool:
+        """瓶中信是否还在海面上"""
+        raise NotImplementedError
+
+    def suspend(self, bottle_id: str) -> Optional[Dict]:
+        """把海面上的瓶中信移入待审核列表（正在迁移到云端），之后由 resolve_pending
+        放回海中或删除；返回该瓶中信，不在海面上时返回 None"""
+        raise NotImplementedError
+
+    def get_picked(self, sender_id: str, bottle_id: Optional[str] = None) -> Optional[Dict]:
+        """获取用户指定编号或随机一个已捡起的瓶中信"""
+        raise NotImplementedError
+
+    def active_count(self) -> int:
+        raise NotImplementedError
+
+    def picked_count(self, sender_id: str) -> int:
+        raise NotImplementedError
+
+    def list_picked(
+        self, sender_id: str, offset: int = 0, limit: Optional[int] = None
+    ) -> List[Dict]:
+        """按捡起时间倒序分页返回用户捡起的瓶中信"""
+        raise NotImplementedError
+
+    def search_picked(self, sender_id: str, query: str, limit: int = 10) -> List[Dict]:
+        """在用户捡起的瓶中信的内容和投放者中搜索，最近捡起的在前"""
+        raise NotImplementedError
+
+    def blob_refs(self) -> Iterator[str]:
+        """逐个返回瓶中信引用的图片哈希，每处引用返回一次"""
+        raise NotImplementedError
+
+    def iter_active(self) -> Iterator[Dict]:
+        """逐个返回海面上的瓶中信，供导出和迁移使用"""
+        raise NotImplementedError
+
+    def iter_picked(self) -> Iterator[Tuple[str, Dict]]:
+        """逐个返回 (用户, 已捡起的瓶中信)，同一用户的历史按捡起顺序连续返回"""
+        raise NotImplementedError
+
+    async def import_bottles(
+        self, active: List[Dict], picked: List[Tuple[str, Dict]]
+    ):
+        """批量导入：海面上的瓶中信重新分配编号，已捡起的原样记入用户历史"""
+        for bottle in active:
+            self.add(bottle)
+        for sender_id, bottle in picked:
+            self.collect(sender_id, bottle)
+
+    async def close(self):
+        pass
+
+
+class JsonBackend(LocalBackend):
+    """整个海域保存在内存字典中，持久化为 JSON 文件（可选追加写日志）"""
+
+    def __init__(
+        self,
+        data_file: str,
+        use_journal: bool = False,
+        journal_fsync_interval: float = 1.0,
+        journal_compact_threshold: int = 1000,
+        history_cache_size: int = 256,
+        pick_policy: Optional[PickPolicy] = None,
+    ):
+        self.data_file = data_file
+        _ensure_data_file(self.data_file)
+        self.file_lock = DataFileLock(self.data_file)
+        self.data = _load_bottles(self.data_file)
+        # journal 模式下变更只追加到日志，否则每次变更重写整个文件
+        self.journal = BottleJournal(
+            self.data_file, journal_fsync_interval, journal_compact_threshold
+        )
+        replayed = self.journal.replay(self.data)
+        if not use_journal:
+            self.journal = None
+            if replayed:
+                # 从 journal 模式切换回来，把日志并入数据文件
+                _save_bottles(self.data_file, self.data)
+                for path in (self.data_file + ".journal", self.data_file + ".journal.1"):
+                    if os.path.exists(path):
+                        os.remove(path)
+        self._save_pending = False
+        self._saver: Optional[asyncio.Task] = None
+        # 池直接维护 data["active"] 列表，持久化格式不变
+        self.pool = ActivePool(self.data["active"], pick_policy)
+        # 用户历史按捡起顺序追加，另按编号建立索引
+        self.picked_index: Dict[str, Dict[str, Dict]] = {}
+        for sender_id, bottles in self.data["user_list"].items():
+            for bottle in bottles:
+                self._index_picked(sender_id, bottle)
+        # 全文索引在用户第一次搜索时建立，之后随捡起增量更新；
+        # 只保留最近搜索过的用户，过期后下次搜索重新建立
+        self.search_indexes = TTLCache(maxsize=history_cache_size, ttl=3600)
+
+    def _index_picked(self, sender_id: str, bottle: Dict):
+        index = self.picked_index.setdefault(sender_id, {})
+        # 同一编号出现多次时保留最早的一个
+        index.setdefault(bottle["bottle_id"], bottle)
+
+    def _append_picked(self, sender_id: str, bottle: Dict):
+        self.data["user_list"].setdefault(sender_id, []).append(bottle)
+        self._index_picked(sender_id, bottle)
+        search_index = self.search_indexes.get(sender_id)
+        if search_index is not None:
+            search_index.add(bottle)
+
+    def _persist(self, record: Dict):
+        """持久化一次变更：journal 模式追加日志，否则在后台重写数据文件"""
+        if self.journal is None:
+            self._schedule_save()
+            return
+        try:
+            self.journal.append(record)
+        except Exception as e:
+            logger.error(f"写入瓶中信日志时出错: {str(e)}")
+            return
+        self.journal.maybe_compact(self.data)
+
+    def _schedule_save(self):
+        self._save_pending = True
+        if self._saver is not None and not self._saver.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._save_pending = False
+            _save_bottles(self.data_file, self.data)
+            return
+        self._saver = loop.create_task(self._save_loop())
+
+    async def _save_loop(self):
+        # 写入期间发生的变更合并为下一次写入
+        while self._save_pending:
+            self._save_pending = False
+            # 只复制容器结构，瓶中信本身共享引用
+            snapshot = {
+                **self.data,
+                "active": list(self.data["active"]),
+                "pending": list(self.data["pending"]),
+                "user_list": {k: list(v) for k, v in self.data["user_list"].items()},
+            }
+            await asyncio.to_thread(_save_bottles, self.data_file, snapshot)
+
+    def add(self, bottle: Dict) -> str:
+        local_id_counter = self.data.get("next_local_id", 1)
+        new_id = f"l{local_id_counter}"
+        bottle["bottle_id"] = new_id
+        self.data["next_local_id"] = local_id_counter + 1
+        self.pool.add(bottle)
+        self._persist(
+            {"op": "add", "bottle": bottle, "next_local_id": local_id_counter + 1}
+        )
+        return new_id
+
+    def hold(self, bottle: Dict) -> str:
+        local_id_counter = self.data.get("next_local_id", 1)
+        new_id = f"l{local_id_counter}"
+        bottle["bottle_id"] = new_id
+        self.data["next_local_id"] = local_id_counter + 1
+        self.data["pending"].append(bottle)
+        self._persist(
+            {"op": "hold", "bottle": bottle, "next_local_id": local_id_counter + 1}
+        )
+        return new_id
+
+    def resolve_pending(self, bottle_id: str, approved: bool) -> Optional[Dict]:
+        bottle = pop_pending(self.data, bottle_id)
+        if bottle is None:
+            return None
+        if approved:
+            self.pool.add(bottle)
+        self._persist({"op": "approve" if approved else "reject", "bottle_id": bottle_id})
+        return bottle
+
+    def list_pending(self) -> List[Dict]:
+        return list(self.data["pending"])
+
+    def claim_random(
+        self, sender_id: str, group_id: Optional[str] = None
+    ) -> Optional[Dict]:
+        bottle = self.pool.choice_excluding(sender_id, group_id)
+        if bottle is None:
+            return None
+        self.pool.remove(bottle["bottle_id"])
+        bottle["picked"] = True
+        self._append_picked(sender_id, bottle)
+        self._persist(
+            {"op": "pick", "bottle_id": bottle["bottle_id"], "sender_id": sender_id}
+        )
+        return bottle
+
+    def collect(self, sender_id: str, bottle: Dict):
+        self._append_picked(sender_id, bottle)
+        self._persist({"op": "collect", "sender_id": sender_id, "bottle": bottle})
+
+    def is_active(self, bottle_id: str) -> bool:
+        return bottle_id in self.pool
+
+    def suspend(self, bottle_id: str) -> Optional[Dict]:
+        bottle = self.pool.remove(bottle_id)
+        if bottle is not None:
+            self.data["pending"].append(bottle)
+            self._persist({"op": "suspend", "bottle_id": bottle_id})
+        return bottle
+
+    def get_picked(self, sender_id: str, bottle_id: Optional[str] = None) -> Optional[Dict]:
+        bottles = self.data["user_list"].get(sender_id)
+        if not bottles:
+            return None
+        if bottle_id is None:
+            return random.choice(bottles)
+        return self.picked_index[sender_id].get(bottle_id)
+
+    def active_count(self) -> int:
+        return len(self.pool)
+
+    def picked_count(self, sender_id: str) -> int:
+        return len(self.data["user_list"].get(sender_id, []))
+
+    def list_picked(
+        self, sender_id: str, offset: int = 0, limit: Optional[int] = None
+    ) -> List[Dict]:
+        bottles = self.data["user_list"].get(sender_id, [])
+        end = len(bottles) - offset
+        if end <= 0:
+            return []
+        start = 0 if limit is None else max(0, end - limit)
+        return bottles[start:end][::-1]
+
+    def search_picked(self, sender_id: str, query: str, limit: int = 10) -> List[Dict]:
+        search_index = self.search_indexes.get(sender_id)
+        if search_index is None:
+            search_index = SearchIndex(self.data["user_list"].get(sender_id, []))
+            self.search_indexes.set(sender_id, search_index)
+        return search_index.search(query, limit)
+
+    def blob_refs(self) -> Iterator[str]:
+        for bottles in (
+            self.data["active"],
+            self.data["pending"],
+            *self.data["user_list"].values(),
+        ):
+            for bottle in bottles:
+                for img in bottle.get("images") or []:
+                    if img["type"] == "blob":
+                        yield img["data"]
+
+    def iter_active(self) -> Iterator[Dict]:
+        # 只复制列表，导出过程中海面的变化不影响遍历
+        return iter(list(self.data["active"]))
+
+    def iter_picked(self) -> Iterator[Tuple[str, Dict]]:
+        for sender_id in list(self.data["user_list"]):
+            for bottle in list(self.data["user_list"].get(sender_id, [])):
+                yield sender_id, bottle
+
+    async def close(self):
+        if self._saver is not None:
+            await asyncio.shield(self._saver)
+            self._saver = None
+        if self.journal is not None:
+            await self.journal.close()
+        self.file_lock.release()
@@ -7,51 +7,126 @@ from .bottle_storage import BottleStorage
 from .utils import collect_images, _handle_qq_poke
 from .config_manager import ConfigManager
 from .message_formatter import MessageFormatter
-import aiohttp
+from .api_client import CloudApiClient
+from .metrics import metrics, PrometheusFileExporter
+from .rate_limit import CommandRateLimiter, rate_limited
+from .dedup import DuplicateFilter
+from .background import BackgroundTasks
 
 OPTIONS = ["-p"]
+DUPLICATE_MESSAGE = "这个瓶中信和最近扔出的瓶中信太像了，换点内容再扔吧～"
 
 @register("message_bottle", "Flartiny", "", "")
 class DriftBottlePlugin(Star):
     def __init__(self, context: Context, config: AstrBotConfig):
         super().__init__(context)
         self.config_manager = ConfigManager(config)
-        self.message_formatter = MessageFormatter()
+        # 扔瓶和捡瓶指令在访问存储和网络之前按用户和群聊限流
+        self.rate_limiter = CommandRateLimiter(
+            self.config_manager.user_rate_limit,
+            self.config_manager.group_rate_limit,
+        )
+        # 戳一戳等不影响回复内容的操作在回复之后执行
+        self.background = BackgroundTasks()
+        self.duplicate_filter = None
+        if self.config_manager.dedup_window > 0:
+            self.duplicate_filter = DuplicateFilter(
+                self.config_manager.dedup_window,
+                self.config_manager.dedup_max_distance,
+                self.config_manager.dedup_min_length,
+            )
         try:
-            self._http_client = aiohttp.ClientSession()
+            self._http_client = CloudApiClient(
+                self.config_manager.api_base_url,
+                connect_timeout=self.config_manager.api_connect_timeout,
+                read_timeout=self.config_manager.api_read_timeout,
+                pool_size=self.config_manager.api_pool_size,
+                keepalive_timeout=self.config_manager.api_keepalive_timeout,
+                dns_cache_ttl=self.config_manager.api_dns_cache_ttl,
+                max_retries=self.config_manager.api_max_retries,
+                retry_backoff=self.config_manager.api_retry_backoff,
+                breaker_failures=self.config_manager.api_breaker_failures,
+                breaker_reset=self.config_manager.api_breaker_reset,
+            )
             self.storage = BottleStorage(
                 data_dir="data",
                 api_base_url=self.config_manager.api_base_url,
-                http_client=self._http_client,
+                api_client=self._http_client,
                 enable_content_safety=self.config_manager.enable_content_safety,
                 content_safety_config=context.get_config()["content_safety"][
                     "baidu_aip"
                 ],
+                content_safety_cache_ttl=self.config_manager.content_safety_cache_ttl,
+                content_safety_cache_size=self.config_manager.content_safety_cache_size,
+                content_safety_workers=self.config_manager.content_safety_workers,
+                storage_mode=self.config_manager.storage_mode,
+                journal_fsync_interval=self.config_manager.journal_fsync_interval,
+                journal_compact_threshold=self.config_manager.journal_compact_threshold,
+                history_cache_size=self.config_manager.history_cache_size,
+                shared_sea_path=self.config_manager.shared_sea_path,
+                cloud_count_ttl=self.config_manager.cloud_count_ttl,
+                cloud_count_max_stale=self.config_manager.cloud_count_max_stale,
+                pick_policy=self.config_manager.pick_policy,
+                pick_age_half_life_hours=self.config_manager.pick_age_half_life_hours,
+                pick_other_group_boost=self.config_manager.pick_other_group_boost,
+                moderation_workers=self.config_manager.moderation_workers,
+                cloud_outbox=self.config_manager.cloud_outbox,
+                cloud_outbox_batch_size=self.config_manager.cloud_outbox_batch_size,
+                cloud_outbox_concurrency=self.config_manager.cloud_outbox_concurrency,
+                cloud_migration_concurrency=self.config_manager.cloud_migration_concurrency,
+                background=self.background,
             )
         except Exception as e:
             logger.error(f"DriftBottlePlugin: 初始化失败，服务可能不可用: {e}")
             self._http_client = None
             self.storage = None
+        self.message_formatter = MessageFormatter(
+            self.storage.blob_store if self.storage else None
+        )
+        self.metrics_exporter = None
+        if self.config_manager.metrics_export_file:
+            self.metrics_exporter = PrometheusFileExporter(
+                self.config_manager.metrics_export_file,
+                self.config_manager.metrics_export_interval,
+            )
+            self.metrics_exporter.start()
 
     async def terminate(self):
-        """插件终止时的清理工作：关闭 aiohttp.ClientSession"""
+        """插件终止时的清理工作：关闭 HTTP 客户端"""
         logger.info("DriftBottlePlugin: 插件终止中，关闭HTTP客户端...")
+        # 先等待后台任务完成，它们可能还要写入存储
+        await self.background.close()
+        if self.metrics_exporter:
+            await self.metrics_exporter.close()
+            self.metrics_exporter = None
         if self._http_client:
             try:
                 await self._http_client.close()  # 确保关闭异步 HTTP 客户端
-                logger.info("DriftBottlePlugin: aiohttp ClientSession 已关闭。")
+                logger.info("DriftBottlePlugin: HTTP 客户端已关闭。")
             except Exception as e:
-                logger.error(f"DriftBottlePlugin: 关闭 aiohttp ClientSession 失败: {e}")
+                logger.error(f"DriftBottlePlugin: 关闭 HTTP 客户端失败: {e}")
             self._http_client = None  # 清理引用
+        if self.storage:
+            try:
+                await self.storage.close()  # 确保日志落盘
+            except Exception as e:
+                logger.error(f"DriftBottlePlugin: 关闭瓶中信存储失败: {e}")
         self.storage = None  # 清理引用
         logger.info("DriftBottlePlugin: 插件清理完成。")
 
     @filter.command("扔云瓶中信", alias={"throw_cloud_bottle"})
+    @metrics.timed_command("throw_cloud_bottle")
+    @rate_limited
     async def throw_cloud_bottle(
         self, event: AstrMessageEvent, input: GreedyStr
     ):
         """扔一个云瓶中信"""
-        images = await collect_images(event, self.config_manager.use_base64)
+        images = await collect_images(
+            event,
+            self.config_manager.use_base64,
+            self.config_manager.image_max_dimension,
+            self.config_manager.image_quality,
+        )
         options = []
         for option in OPTIONS:
             if option in input:
@@ -72,6 +147,13 @@ class DriftBottlePlugin(Star):
 
         poke = True if "-p" in options else False
 
+        entry = None
+        if self.duplicate_filter is not None:
+            entry = self.duplicate_filter.check(content, images)
+            if entry is None:
+                yield event.plain_result(DUPLICATE_MESSAGE)
+                return
+
         # 添加瓶中信
         bottle_id = await self.storage.add_bottle(
             content=content,
@@ -82,13 +164,22 @@ class DriftBottlePlugin(Star):
             poke=poke,
         )
         if bottle_id == None:
+            if entry is not None:
+                self.duplicate_filter.discard(entry)
             yield event.plain_result("添加云瓶中信失败，请稍后重试或查看日志...")
             return
+        if self.storage.outbox is not None:
+            yield event.plain_result(
+                f"你的瓶中信已经扔出，正在漂向云端海域！临时编号是 {bottle_id}"
+            )
+            return
         yield event.plain_result(
             f"你的瓶中信已经扔进大海了！云瓶中信的编号是 {bottle_id}"
         )
 
     @filter.command("捡云瓶中信", alias={"pick_cloud_bottle"})
+    @metrics.timed_command("pick_cloud_bottle")
+    @rate_limited
     async def pick_cloud_bottle(self, event: AstrMessageEvent):
         """捡起一个瓶中信"""
         bottle, msg = await self.storage.pick_random_cloud_bottle(event)
@@ -97,13 +188,15 @@ class DriftBottlePlugin(Star):
             yield event.plain_result(msg)
             return
         if bottle["poke"]:
-            await _handle_qq_poke(event)
-            bottle["content"] = bottle["content"] + "\n👉并戳了戳你"
+            bottle = bottle.with_suffix("\n👉并戳了戳你")
         yield self.message_formatter.create_bottle_message(event, bottle, msg)
+        if bottle["poke"]:
+            self.background.submit("poke", _handle_qq_poke, event)
 
     @filter.command(
         "被捡起的瓶中信", alias={"selected_picked_bottle", "random_picked_bottle"}
     )
+    @metrics.timed_command("picked_bottle")
     async def picked_bottle(
         self, event: AstrMessageEvent, bottle_id: Optional[str] = None
     ):
@@ -116,14 +209,16 @@ class DriftBottlePlugin(Star):
                 yield event.plain_result("还没有被捡起的瓶中信...")
             return
         if bottle["poke"]:
-            await _handle_qq_poke(event)
-            bottle["content"] = bottle["content"] + "\n👉并戳了戳你"
+            bottle = bottle.with_suffix("\n👉并戳了戳你")
 
         yield self.message_formatter.create_bottle_message(
             event, bottle, "这是一个被捡起的瓶中信！"
         )
+        if bottle["poke"]:
+            self.background.submit("poke", _handle_qq_poke, event)
 
     @filter.command("未被捡起的瓶中信", alias={"bottle_count"})
+    @metrics.timed_command("bottle_count")
     async def bottle_count(self, event: AstrMessageEvent):
         """查看当前瓶中信数量"""
         local_active_count, picked_count = self.storage.get_local_bottle_counts(
@@ -143,17 +238,48 @@ class DriftBottlePlugin(Star):
         )
 
     @filter.command("被捡起的瓶中信列表", alias={"list_picked_bottles"})
-    async def list_picked_bottles(self, event: AstrMessageEvent):
-        """显示所有被捡起的瓶中信列表"""
-        bottles = self.storage.get_picked_bottles(event.get_sender_id())
-        message = self.message_formatter.format_picked_bottles_list(bottles)
+    @metrics.timed_command("list_picked_bottles")
+    async def list_picked_bottles(self, event: AstrMessageEvent, page: int = 1):
+        """分页显示被捡起的瓶中信列表"""
+        bottles, page, total_pages = self.storage.get_picked_bottles(
+            event.get_sender_id(),
+            page=page,
+            page_size=self.config_manager.picked_list_page_size,
+        )
+        message = self.message_formatter.format_picked_bottles_list(
+            bottles, page, total_pages
+        )
         yield event.plain_result(message)
 
+    @filter.command("搜索瓶中信", alias={"search_bottles"})
+    @metrics.timed_command("search_bottles")
+    async def search_bottles(self, event: AstrMessageEvent, keyword: GreedyStr):
+        """在被捡起的瓶中信的内容和投放者中搜索"""
+        keyword = keyword.strip()
+        if not keyword:
+            yield event.plain_result("请输入要搜索的关键词")
+            return
+        bottles = self.storage.search_picked_bottles(
+            event.get_sender_id(),
+            keyword,
+            limit=self.config_manager.picked_list_page_size,
+        )
+        yield event.plain_result(
+            self.message_formatter.format_search_results(bottles, keyword)
+        )
+
     @filter.command("扔瓶中信", alias={"throw_bottle"})
+    @metrics.timed_command("throw_bottle")
+    @rate_limited
     async def throw_bottle(self, event: AstrMessageEvent, input: GreedyStr):
         """扔一个瓶中信"""
         # 收集所有图片
-        images = await collect_images(event, self.config_manager.use_base64)
+        images = await collect_images(
+            event,
+            self.config_manager.use_base64,
+            self.config_manager.image_max_dimension,
+            self.config_manager.image_quality,
+        )
         options = []
         for option in OPTIONS:
             if option in input:
@@ -175,6 +301,13 @@ class DriftBottlePlugin(Star):
 
         poke = True if "-p" in options else False
 
+        entry = None
+        if self.duplicate_filter is not None:
+            entry = self.duplicate_filter.check(content, images)
+            if entry is None:
+                yield event.plain_result(DUPLICATE_MESSAGE)
+                return
+
         # 添加瓶中信
         bottle_id = await self.storage.add_bottle(
             content=content,
@@ -183,13 +316,24 @@ class DriftBottlePlugin(Star):
             sender_id=event.get_sender_id(),
             is_cloud=False,
             poke=poke,
+            group_id=event.get_group_id(),
+            event=event,
         )
         if bottle_id is None:
+            if entry is not None:
+                self.duplicate_filter.discard(entry)
             yield event.plain_result("添加瓶中信失败，请稍后重试...")
             return
+        if self.storage.moderation is not None:
+            yield event.plain_result(
+                f"你的瓶中信已经扔出，审核通过后就会漂到海面上！瓶子的编号是 {bottle_id}"
+            )
+            return
         yield event.plain_result(f"你的瓶中信已经扔进大海了！瓶子的编号是 {bottle_id}")
 
     @filter.command("捡瓶中信", alias={"pick_bottle"})
+    @metrics.timed_command("pick_bottle")
+    @rate_limited
     async def pick_bottle(self, event: AstrMessageEvent):
         """捡起一个瓶中信"""
         bottle, msg = await self.storage.pick_random_bottle(event)
@@ -198,9 +342,83 @@ class DriftBottlePlugin(Star):
             yield event.plain_result(msg)
             return
         if bottle["poke"]:
-            await _handle_qq_poke(event)
-            bottle["content"] = bottle["content"] + "\n👉并戳了戳你"
+            bottle = bottle.with_suffix("\n👉并戳了戳你")
 
         yield self.message_formatter.create_bottle_message(
             event, bottle, "你捡到了一个瓶中信！"
         )
+        if bottle["poke"]:
+            self.background.submit("poke", _handle_qq_poke, event)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("瓶中信统计", alias={"bottle_metrics"})
+    async def bottle_metrics(self, event: AstrMessageEvent):
+        """查看瓶中信插件的性能指标（仅管理员）"""
+        yield event.plain_result(metrics.summary())
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("导出瓶中信", alias={"export_bottles"})
+    async def export_bottles(self, event: AstrMessageEvent, path: Optional[str] = None):
+        """将本地海域和所有用户的历史导出为 NDJSON 文件（仅管理员）"""
+        if self.storage.transfer_lock.locked():
+            yield event.plain_result("已有导入、导出或迁移任务正在进行，请稍后再试")
+            return
+        try:
+            path, counts = await self.storage.export_bottles(path)
+        except Exception as e:
+            logger.error(f"导出瓶中信失败: {e}")
+            yield event.plain_result(f"导出失败: {e}")
+            return
+        yield event.plain_result(
+            f"已导出 {counts['active']} 个海面上的瓶中信、"
+            f"{counts['pending']} 个待审核的瓶中信和 "
+            f"{counts['picked']} 个被捡起的瓶中信到 {path}"
+        )
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("导入瓶中信", alias={"import_bottles"})
+    async def import_bottles(self, event: AstrMessageEvent, path: str):
+        """从 NDJSON 文件导入瓶中信到本地海域（仅管理员）"""
+        if self.storage.transfer_lock.locked():
+            yield event.plain_result("已有导入、导出或迁移任务正在进行，请稍后再试")
+            return
+        try:
+            counts = await self.storage.import_bottles(path)
+        except Exception as e:
+            logger.error(f"导入瓶中信失败: {e}")
+            yield event.plain_result(f"导入失败: {e}")
+            return
+        message = (
+            f"已导入 {counts['active']} 个海面上的瓶中信、"
+            f"{counts['pending']} 个待审核的瓶中信和 "
+            f"{counts['picked']} 个被捡起的瓶中信"
+        )
+        if counts["skipped"]:
+            message += f"，跳过 {counts['skipped']} 条格式错误的记录"
+        yield event.plain_result(message)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("迁移瓶中信到云端", alias={"migrate_bottles_to_cloud"})
+    async def migrate_bottles_to_cloud(self, event: AstrMessageEvent):
+        """把本地海面上的瓶中信上传到云端，中断后再次执行会继续（仅管理员）"""
+        if self.storage.transfer_lock.locked():
+            yield event.plain_result("已有导入、导出或迁移任务正在进行，请稍后再试")
+            return
+        yield event.plain_result(
+            f"开始迁移 {self.storage.backend.active_count()} 个本地瓶中信到云端..."
+        )
+        try:
+            counts = await self.storage.migrate_to_cloud()
+        except Exception as e:
+            logger.error(f"迁移瓶中信到云端失败: {e}")
+            yield event.plain_result(f"迁移失败: {e}，再次执行将从中断处继续")
+            return
+        message = (
+            f"迁移完成：上传 {counts['uploaded']} 个，"
+            f"之前已上传 {counts['skipped']} 个，云端拒收 {counts['rejected']} 个"
+        )
+        if counts["gone"]:
+            message += f"，{counts['gone']} 个在迁移期间已被捡起"
+        if counts["failed"]:
+            message += f"，{counts['failed']} 个上传失败，再次执行将重试"
+        yield event.plain_result(message)
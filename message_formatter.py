@@ -1,11 +1,15 @@
-from typing import Dict, List
+from typing import Dict, List, Mapping, Optional
 import astrbot.api.message_components as Comp
 from astrbot.api.event import AstrMessageEvent, MessageEventResult
+from .blob_store import BlobStore
 
 
 class MessageFormatter:
+    def __init__(self, blob_store: Optional[BlobStore] = None):
+        self.blob_store = blob_store
+
     @staticmethod
-    def format_bottle_message(bottle: Dict) -> str:
+    def format_bottle_message(bottle: Mapping) -> str:
         """格式化瓶中信消息"""
         message = f"瓶中信编号：{bottle['bottle_id']}\n"
         message += f"发送者：{bottle['sender']}\n"
@@ -13,13 +17,13 @@ class MessageFormatter:
         message += f"内容：{bottle['content']}"
         return message
 
-    @staticmethod
     def create_bottle_message(
-        event: AstrMessageEvent, bottle: Dict, prefix_message: str = ""
+        self,
+        event: AstrMessageEvent, bottle: Mapping, prefix_message: str = ""
     ) -> MessageEventResult:
         """创建瓶中信消息结果"""
         message = prefix_message + "\n" if prefix_message else ""
-        message += MessageFormatter.format_bottle_message(bottle)
+        message += self.format_bottle_message(bottle)
 
         # 构建消息链
         message_chain = [Comp.Plain(message)]
@@ -32,20 +36,50 @@ class MessageFormatter:
                 message_chain.append(Comp.Image.fromURL(img["data"]))
             elif img["type"] == "qq_url":
                 message_chain.append(Comp.Image.fromURL(img["data"]))
+            elif img["type"] == "blob" and self.blob_store is not None:
+                # 只传递文件路径，图片内容在发送时才读取
+                message_chain.append(
+                    Comp.Image.fromFileSystem(self.blob_store.path(img["data"]))
+                )
 
         return event.chain_result(message_chain)
 
     @staticmethod
-    def format_picked_bottles_list(bottles: List[Dict]) -> str:
+    def format_picked_bottles_list(
+        bottles: List[Dict], page: int = 1, total_pages: int = 1
+    ) -> str:
         """格式化已捡起的瓶中信列表"""
         if not bottles:
             return "还没有被捡起的瓶中信..."
 
-        message = "以下是所有被捡起的瓶中信：\n\n"
+        lines = [f"以下是被捡起的瓶中信（第 {page}/{total_pages} 页）：", ""]
+        for bottle in bottles:
+            lines.append(f"瓶子编号：{bottle['bottle_id']}")
+            lines.append(f"投放者：{bottle['sender']}")
+            lines.append(f"投放时间：{bottle['timestamp']}")
+            lines.append("------------------------")
+        if page < total_pages:
+            lines.append(f"发送 /被捡起的瓶中信列表 {page + 1} 查看下一页")
+
+        return "\n".join(lines)
+
+    @staticmethod
+    def format_search_results(bottles: List[Dict], keyword: str) -> str:
+        """格式化瓶中信搜索结果"""
+        if not bottles:
+            return f"没有找到包含「{keyword}」的瓶中信..."
+
+        lines = [f"以下是包含「{keyword}」的瓶中信：", ""]
         for bottle in bottles:
-            message += f"瓶子编号：{bottle['bottle_id']}\n"
-            message += f"投放者：{bottle['sender']}\n"
-            message += f"投放时间：{bottle['timestamp']}\n"
-            message += "------------------------\n"
+            content = bottle.get("content") or ""
+            if len(content) > 30:
+                content = content[:30] + "..."
+            lines.append(f"瓶子编号：{bottle['bottle_id']}")
+            lines.append(f"投放者：{bottle['sender']}")
+            lines.append(f"投放时间：{bottle['timestamp']}")
+            if content:
+                lines.append(f"内容：{content}")
+            lines.append("------------------------")
+        lines.append("发送 /被捡起的瓶中信 <瓶子编号> 查看完整内容")
 
-        return message.strip()
+        return "\n".join(lines)
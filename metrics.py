@@ -0,0 +1,250 @@
+"""
+插件内置的指标：延迟直方图、计数器和仪表，可汇总为文本或导出为 Prometheus 文本格式
+"""
+
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncContextManager, Callable, Dict, Iterator, List, Optional, Tuple
+from astrbot.api import logger
+import asyncio
+import bisect
+import functools
+import os
+import time
+
+# 直方图桶的上界(秒)
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in key) + "}"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # 最后一个桶对应 +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """按桶上界估算分位数"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def observe(self, name: str, value: float, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = _label_key(labels)
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = Histogram()
+        hist.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def gauge(self, name: str, fn: Callable[[], float]):
+        """注册一个在读取时才求值的仪表"""
+        self.gauges[name] = fn
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @asynccontextmanager
+    async def timed_lock(
+        self, lock: AsyncContextManager, name: str = "lock_wait_seconds", **labels
+    ):
+        """获取锁并记录等待时间"""
+        start = time.perf_counter()
+        async with lock:
+            self.observe(name, time.perf_counter() - start, **labels)
+            yield
+
+    def timed(self, name: str, **labels):
+        """记录函数耗时的装饰器，支持普通函数和协程函数"""
+
+        def decorator(fn):
+            if asyncio.iscoroutinefunction(fn):
+
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(name, **labels):
+                        return await fn(*args, **kwargs)
+
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def timed_command(self, command: str):
+        """记录指令处理器（异步生成器）的耗时和结果"""
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                result = "ok"
+                try:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                except Exception:
+                    result = "error"
+                    raise
+                finally:
+                    self.observe(
+                        "command_seconds", time.perf_counter() - start, command=command
+                    )
+                    self.inc("commands_total", command=command, result=result)
+
+            return wrapper
+
+        return decorator
+
+    def _gauge_values(self) -> List[Tuple[str, float]]:
+        values = []
+        for name, fn in self.gauges.items():
+            try:
+                values.append((name, float(fn())))
+            except Exception as e:
+                logger.debug(f"读取指标 {name} 失败: {e!r}")
+        return values
+
+    def summary(self) -> str:
+        """人类可读的汇总"""
+        lines = []
+        for name, value in self._gauge_values():
+            lines.append(f"{name} = {value:g}")
+        for name, series in sorted(self.histograms.items()):
+            for key, hist in sorted(series.items()):
+                avg = hist.sum / hist.count if hist.count else 0
+                lines.append(
+                    f"{name}{_format_labels(key)}: n={hist.count}"
+                    f" avg={avg * 1000:.2f}ms p50≤{hist.quantile(0.5) * 1000:g}ms"
+                    f" p99≤{hist.quantile(0.99) * 1000:g}ms"
+                )
+        for name, series in sorted(self.counters.items()):
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(key)} = {value:g}")
+        return "\n".join(lines) if lines else "暂无指标数据"
+
+    def prometheus(self, prefix: str = "message_bottle_") -> str:
+        """Prometheus 文本格式"""
+        lines = []
+        for name, value in self._gauge_values():
+            lines.append(f"# TYPE {prefix}{name} gauge")
+            lines.append(f"{prefix}{name} {value}")
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE {prefix}{name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{prefix}{name}{_format_labels(key)} {value}")
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {prefix}{name} histogram")
+            for key, hist in sorted(series.items()):
+                cumulative = 0
+                for bound, n in zip(hist.buckets + (float("inf"),), hist.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    bucket_key = key + (("le", le),)
+                    lines.append(
+                        f"{prefix}{name}_bucket{_format_labels(bucket_key)} {cumulative}"
+                    )
+                lines.append(f"{prefix}{name}_sum{_format_labels(key)} {hist.sum}")
+                lines.append(f"{prefix}{name}_count{_format_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        self.histograms.clear()
+        self.counters.clear()
+
+
+# 全局指标，各模块直接导入使用
+metrics = Metrics()
+
+
+class PrometheusFileExporter:
+    """定期将指标写入文件，供 node_exporter 的 textfile collector 等采集"""
+
+    def __init__(self, path: str, interval: float = 60, registry: Metrics = metrics):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("没有运行中的事件循环，指标导出未启动")
+            return
+        self._task = loop.create_task(self._run())
+
+    def _write(self, text: str):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_file, self.path)
+
+    async def export(self):
+        await asyncio.to_thread(self._write, self.registry.prometheus())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.export()
+            except Exception as e:
+                logger.error(f"导出瓶中信指标失败: {str(e)}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            try:
+                await self.export()
+            except Exception as e:
+                logger.error(f"导出瓶中信指标失败: {str(e)}")
@@ -0,0 +1,100 @@
+"""
+本地瓶中信的后台审核：扔出的瓶中信先进入待审核状态，由固定数量的后台任务送审，
+审核通过后才会放入海中，捡瓶无需等待审核
+"""
+
+from typing import Awaitable, Callable, Dict, List, Optional
+from astrbot.api import logger
+import asyncio
+from .metrics import metrics
+
+# 审核接口出错时，瓶中信保持待审核状态，间隔一段时间后重新送审，每次间隔翻倍
+RETRY_INTERVAL = 60
+# 连续这么多次无法得出结果(约 15 分钟)后按未通过处理，不让瓶中信永远停留在待审核状态
+MAX_ATTEMPTS = 5
+
+
+class ModerationQueue:
+    def __init__(
+        self,
+        moderate: Callable[[Dict], Awaitable[Optional[bool]]],
+        resolve: Callable[[Dict, bool], Awaitable[None]],
+        workers: int = 2,
+        retry_interval: float = RETRY_INTERVAL,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        # moderate 返回 True/False 表示是否合规，接口出错时返回 None
+        self._moderate = moderate
+        self._resolve = resolve
+        self.workers = max(1, workers)
+        self.retry_interval = retry_interval
+        self.max_attempts = max(1, max_attempts)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._retries: Dict[str, asyncio.TimerHandle] = {}
+        # 每个瓶中信已经失败的审核次数
+        self._attempts: Dict[str, int] = {}
+        # 已提交但尚未审核完成的瓶中信数量，包括等待重试的
+        self.pending = 0
+        metrics.gauge("moderation_pending", lambda: self.pending)
+
+    def submit(self, bottle: Dict):
+        self.pending += 1
+        self._queue.put_nowait(bottle)
+        self._ensure_workers()
+
+    def _ensure_workers(self):
+        if self._tasks:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 启动时恢复的待审核瓶中信在下一次提交时开始处理
+            return
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            bottle = await self._queue.get()
+            bottle_id = bottle["bottle_id"]
+            attempts = self._attempts.get(bottle_id, 0) + 1
+            result = None
+            try:
+                verdict = await self._moderate(bottle)
+                if verdict is None and attempts >= self.max_attempts:
+                    logger.warning(
+                        f"瓶中信 {bottle_id} 连续 {attempts} 次无法完成审核，按未通过处理"
+                    )
+                    verdict, result = False, "gave_up"
+                if verdict is not None:
+                    await self._resolve(bottle, verdict)
+            except Exception as e:
+                logger.error(f"审核瓶中信 {bottle_id} 时出错: {str(e)}")
+                verdict = None
+            if verdict is None:
+                metrics.inc("moderation_total", result="error")
+                self._attempts[bottle_id] = attempts
+                loop = asyncio.get_running_loop()
+                self._retries[bottle_id] = loop.call_later(
+                    self.retry_interval * 2 ** (attempts - 1), self._requeue, bottle
+                )
+                continue
+            self._attempts.pop(bottle_id, None)
+            self.pending -= 1
+            if result is None:
+                result = "approved" if verdict else "rejected"
+            metrics.inc("moderation_total", result=result)
+
+    def _requeue(self, bottle: Dict):
+        self._retries.pop(bottle["bottle_id"], None)
+        self._queue.put_nowait(bottle)
+
+    async def close(self):
+        """停止后台任务，未审核完成的瓶中信仍保存在待审核列表中，下次启动时继续"""
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries = {}
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
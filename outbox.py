@@ -0,0 +1,237 @@
+"""
+云瓶中信发件箱：扔出的云瓶中信先追加写入本地文件并落盘，然后立即返回临时编号，
+由后台任务分批发往云端，失败时保留在发件箱中退避重试，重启后继续发送
+"""
+
+from typing import Awaitable, Callable, Dict, List, Optional
+from astrbot.api import logger
+import aiohttp
+import asyncio
+import json
+import os
+import random
+from .api_client import CircuitOpenError
+from .metrics import metrics
+
+# 连续失败时的重试间隔上限(秒)
+MAX_BACKOFF = 300
+# 瓶中信本身被云端拒收的状态码，其余错误(包括地址配置错误)都保留重试
+DROP_STATUSES = (400, 413, 422)
+
+
+class CloudOutbox:
+    def __init__(
+        self,
+        path: str,
+        send: Callable[[Dict], Awaitable[str]],
+        batch_size: int = 10,
+        concurrency: int = 4,
+        retry_backoff: float = 5,
+    ):
+        # send 发送一个瓶中信并返回云端编号
+        self.path = path
+        self._send = send
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.retry_backoff = retry_backoff
+        # 临时编号 -> 待发送的瓶中信，按扔出顺序排列
+        self.entries: Dict[str, Dict] = {}
+        self.next_id = 1
+        # 文件中已发送的记录数，超过待发送数量时重写文件
+        self._dead_records = 0
+        # 已追加和已落盘的记录序号，同时扔出的瓶中信共用一次 fsync
+        self._written = 0
+        self._synced = 0
+        self._syncing: Optional[asyncio.Future] = None
+        # 已追加但还没有落盘确认的瓶中信，压缩时同样要写入新文件
+        self._writing: Dict[str, Dict] = {}
+        # 压缩在后台进行，期间追加的记录同时暂存在 _tail 中，之后补写到新文件
+        self._compactor: Optional[asyncio.Task] = None
+        self._tail: Optional[List[str]] = None
+        self._load()
+        self._fp = open(self.path, "a", encoding="utf-8")
+        self._wake = asyncio.Event()
+        self._sender: Optional[asyncio.Task] = None
+        self._failures = 0
+        metrics.gauge("cloud_outbox_pending", lambda: len(self.entries))
+        self._ensure_sender()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时写了一半的尾部记录，丢弃
+                    logger.warning(f"跳过损坏的云瓶中信发件箱记录: {self.path}")
+                    continue
+                outbox_id = record["id"]
+                self.next_id = max(self.next_id, int(outbox_id[1:]) + 1)
+                if record["op"] == "put":
+                    self.entries[outbox_id] = record["bottle"]
+                elif self.entries.pop(outbox_id, None) is not None:
+                    self._dead_records += 2
+        if self.entries:
+            logger.info(f"云瓶中信发件箱中有 {len(self.entries)} 个瓶中信待发送")
+
+    def _append(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        self._fp.write(line)
+        self._fp.flush()
+        self._written += 1
+        if self._tail is not None:
+            self._tail.append(line)
+
+    async def _sync(self):
+        """等待到目前为止追加的记录全部落盘"""
+        target = self._written
+        while self._synced < target:
+            if self._syncing is None or self._syncing.done():
+                self._syncing = asyncio.ensure_future(self._fsync(self._written))
+            # 一个调用方被取消时不影响其他等待同一次 fsync 的调用方
+            await asyncio.shield(self._syncing)
+
+    async def _fsync(self, upto: int):
+        with metrics.timer("cloud_outbox_fsync_seconds"):
+            await asyncio.to_thread(os.fsync, self._fp.fileno())
+        self._synced = max(self._synced, upto)
+
+    def _fsync_in_flight(self) -> bool:
+        return self._syncing is not None and not self._syncing.done()
+
+    async def _compact(self):
+        """只保留待发送的瓶中信重写发件箱文件，写入和 fsync 都在线程中进行"""
+        dead_records = self._dead_records
+        tmp_file = self.path + ".tmp"
+        self._tail = []
+        try:
+            pending = {**self.entries, **self._writing}
+            lines = [
+                json.dumps({"op": "put", "id": i, "bottle": b}, ensure_ascii=False) + "\n"
+                for i, b in pending.items()
+            ]
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                await asyncio.to_thread(_write_synced, f, lines)
+                # 重写期间追加的记录补写到新文件，直到追上为止；
+                # 旧文件上的 fsync 完成前不能关闭它
+                while self._tail or self._fsync_in_flight():
+                    if self._fsync_in_flight():
+                        await asyncio.gather(self._syncing, return_exceptions=True)
+                        continue
+                    tail, self._tail = self._tail, []
+                    await asyncio.to_thread(_write_synced, f, tail)
+            # 从这里到换用新文件不再让出事件循环，不会有新记录写入旧文件
+            self._fp.close()
+            os.replace(tmp_file, self.path)
+            self._fp = open(self.path, "a", encoding="utf-8")
+            self._dead_records -= dead_records
+        except Exception as e:
+            logger.error(f"压缩云瓶中信发件箱失败: {str(e)}")
+            if self._fp.closed:
+                self._fp = open(self.path, "a", encoding="utf-8")
+        finally:
+            self._tail = None
+
+    async def put(self, bottle: Dict) -> str:
+        """放入发件箱，落盘后返回临时编号"""
+        outbox_id = f"o{self.next_id}"
+        self.next_id += 1
+        self._writing[outbox_id] = bottle
+        try:
+            self._append({"op": "put", "id": outbox_id, "bottle": bottle})
+            await self._sync()
+        finally:
+            # 没有返回编号的瓶中信不保证发送
+            self._writing.pop(outbox_id, None)
+        self.entries[outbox_id] = bottle
+        self._ensure_sender()
+        self._wake.set()
+        return outbox_id
+
+    def _done(self, outbox_id: str):
+        if self.entries.pop(outbox_id, None) is None:
+            return
+        self._append({"op": "done", "id": outbox_id})
+        self._dead_records += 2
+        compacting = self._compactor is not None and not self._compactor.done()
+        if self._dead_records > max(len(self.entries), 100) and not compacting:
+            self._compactor = asyncio.ensure_future(self._compact())
+
+    def _ensure_sender(self):
+        if self._sender is not None and not self._sender.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 启动时遗留的瓶中信在下一次扔出时开始发送
+            return
+        self._sender = loop.create_task(self._drain())
+
+    async def _drain(self):
+        while True:
+            if not self.entries:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            batch = list(self.entries.items())[: self.batch_size]
+            semaphore = asyncio.Semaphore(self.concurrency)
+            results = await asyncio.gather(
+                *(self._send_one(i, bottle, semaphore) for i, bottle in batch)
+            )
+            if all(results):
+                self._failures = 0
+                continue
+            # 云端不可用时整批等待，避免不断重试
+            self._failures += 1
+            delay = min(MAX_BACKOFF, self.retry_backoff * 2 ** (self._failures - 1))
+            await asyncio.sleep(delay * random.uniform(0.5, 1))
+
+    async def _send_one(
+        self, outbox_id: str, bottle: Dict, semaphore: asyncio.Semaphore
+    ) -> bool:
+        async with semaphore:
+            try:
+                bottle_id = await self._send(bottle)
+            except aiohttp.ClientResponseError as e:
+                if e.status in DROP_STATUSES:
+                    # 云端拒收的瓶中信重试也不会成功，直接丢弃
+                    logger.error(f"云端拒收了发件箱中的瓶中信 {outbox_id}: {str(e)}")
+                    metrics.inc("cloud_outbox_total", result="dropped")
+                    self._done(outbox_id)
+                    return True
+                metrics.inc("cloud_outbox_total", result="retry")
+                return False
+            except (CircuitOpenError, aiohttp.ClientError, asyncio.TimeoutError):
+                metrics.inc("cloud_outbox_total", result="retry")
+                return False
+            except Exception as e:
+                logger.error(f"发送发件箱中的瓶中信 {outbox_id} 失败: {str(e)}")
+                metrics.inc("cloud_outbox_total", result="retry")
+                return False
+        metrics.inc("cloud_outbox_total", result="ok")
+        logger.info(f"发件箱中的瓶中信 {outbox_id} 已发往云端，编号 {bottle_id}")
+        self._done(outbox_id)
+        return True
+
+    async def close(self):
+        """停止后台发送，未发送的瓶中信保留在文件中，下次启动时继续"""
+        if self._sender is not None:
+            self._sender.cancel()
+            await asyncio.gather(self._sender, return_exceptions=True)
+            self._sender = None
+        if self._compactor is not None:
+            await asyncio.gather(self._compactor, return_exceptions=True)
+        if self._syncing is not None:
+            await asyncio.gather(self._syncing, return_exceptions=True)
+        self._fp.close()
+
+
+def _write_synced(f, lines: List[str]):
+    f.writelines(lines)
+    f.flush()
+    os.fsync(f.fileno())
@@ -0,0 +1,154 @@
+"""
+本地海域的捡瓶策略：按瓶中信年龄、投放者和群聊调整被捡起的概率
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from astrbot.api import logger
+import random
+import time
+
+PICK_POLICIES = ("uniform", "age", "other_group", "fair_sender", "balanced")
+
+# 年龄权重的指数上限。权重相差 2^40 倍时，最小的权重在前缀和中仍保留约 13 位有效数字
+# (双精度浮点数只有 53 位)，避免增删极端权重后前缀和失去精度
+MAX_AGE_EXPONENT = 20
+
+
+class FenwickTree:
+    """带权随机抽样用的树状数组，按位置修改权重和按前缀和抽样均为 O(log n)"""
+
+    def __init__(self, weights: Iterable[float] = ()):
+        self.values: List[float] = list(weights)
+        self._rebuild()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def _rebuild(self):
+        capacity = 1
+        while capacity < len(self.values):
+            capacity *= 2
+        tree = [0.0] * (capacity + 1)
+        tree[1 : len(self.values) + 1] = self.values
+        for i in range(1, capacity + 1):
+            parent = i + (i & -i)
+            if parent <= capacity:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._capacity = capacity
+        # 浮点增量更新会累积误差，更新次数超过容量时整体重建
+        self._updates = 0
+
+    def _add(self, index: int, delta: float):
+        i = index + 1
+        while i <= self._capacity:
+            self._tree[i] += delta
+            i += i & -i
+        self._updates += 1
+        if self._updates > self._capacity:
+            self._rebuild()
+
+    def set(self, index: int, weight: float):
+        delta = weight - self.values[index]
+        self.values[index] = weight
+        self._add(index, delta)
+
+    def append(self, weight: float):
+        self.values.append(weight)
+        if len(self.values) > self._capacity:
+            self._rebuild()
+        else:
+            self._add(len(self.values) - 1, weight)
+
+    def pop(self) -> float:
+        weight = self.values.pop()
+        self._add(len(self.values), -weight)
+        return weight
+
+    def total(self) -> float:
+        return self._tree[self._capacity]
+
+    def sample(self) -> Optional[int]:
+        """按权重随机返回一个位置"""
+        total = self.total()
+        if self.values and total <= 0:
+            # 增量更新的误差可能让总和变为非正数，重新计算一次
+            self._rebuild()
+            total = self.total()
+        if not self.values or total <= 0:
+            return None
+        r = random.random() * total
+        pos = 0
+        step = self._capacity
+        while step:
+            nxt = pos + step
+            if nxt <= self._capacity and self._tree[nxt] <= r:
+                pos = nxt
+                r -= self._tree[nxt]
+            step //= 2
+        return min(pos, len(self.values) - 1)
+
+
+def _timestamp(bottle: Dict) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(bottle["timestamp"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class PickPolicy:
+    """
+    uniform: 均匀随机；age: 越早扔出的瓶中信越容易被捡到；
+    other_group: 优先捡到其他群扔出的瓶中信；fair_sender: 降低大量扔瓶的用户的权重；
+    balanced: 同时启用以上三项
+    """
+
+    def __init__(
+        self,
+        name: str = "uniform",
+        age_half_life_hours: float = 24,
+        other_group_boost: float = 3,
+    ):
+        if name not in PICK_POLICIES:
+            logger.error(f"未知的捡瓶策略 {name}，将使用 uniform")
+            name = "uniform"
+        self.name = name
+        self.age_half_life = age_half_life_hours * 3600
+        self.age = name in ("age", "balanced") and self.age_half_life > 0
+        self.fair_sender = name in ("fair_sender", "balanced")
+        self.other_group_boost = (
+            other_group_boost if name in ("other_group", "balanced") else 1
+        )
+        # 年龄权重相对启动时刻计算，权重之比只取决于扔出时间之差
+        self.anchor = time.time()
+
+    @property
+    def weighted(self) -> bool:
+        """是否需要为每个瓶中信维护权重"""
+        return self.age or self.fair_sender
+
+    @property
+    def uniform(self) -> bool:
+        return not self.weighted and self.other_group_boost <= 1
+
+    def weight(self, bottle: Dict, sender_count: int) -> float:
+        """瓶中信放入海中时的权重，sender_count 为此时该投放者在海面上的瓶中信数量"""
+        weight = 1.0
+        if self.age:
+            ts = _timestamp(bottle)
+            if ts is not None:
+                exponent = (self.anchor - ts) / self.age_half_life
+                weight = 2.0 ** max(-MAX_AGE_EXPONENT, min(MAX_AGE_EXPONENT, exponent))
+        if self.fair_sender:
+            # 同一投放者第 n 个仍在海面上的瓶中信只有 1/n 的权重
+            weight /= max(1, sender_count)
+        return weight
+
+    def accept(self, bottle: Dict, group_id: Optional[str]) -> bool:
+        """抽到同群瓶中信时以 1/other_group_boost 的概率接受"""
+        if self.other_group_boost <= 1 or not group_id:
+            return True
+        if bottle.get("group_id") != group_id:
+            return True
+        return random.random() * self.other_group_boost < 1
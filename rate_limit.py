@@ -0,0 +1,84 @@
+"""
+指令限流：按用户和群聊分别维护令牌桶，超出频率的请求在访问存储和网络之前直接拒绝
+"""
+
+from typing import Optional
+import functools
+import math
+import time
+from .caching import TTLCache
+from .metrics import metrics
+
+# 每个限流器最多保存的令牌桶数量，超出时淘汰最久未使用的
+MAX_BUCKETS = 10000
+
+
+class TokenBucketLimiter:
+    """每个键一个令牌桶，容量为每分钟次数，令牌匀速恢复"""
+
+    def __init__(self, per_minute: float, max_buckets: int = MAX_BUCKETS):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        # 键 -> (剩余令牌, 更新时间)。令牌回满的桶与新桶等价，到期后直接丢弃
+        self.buckets = TTLCache(maxsize=max_buckets)
+
+    def _tokens(self, key: str, now: float) -> float:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        tokens, updated = bucket
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def wait_time(self, key: str) -> float:
+        """距离下一个可用令牌的秒数，0 表示可以立即执行"""
+        tokens = self._tokens(key, time.monotonic())
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, key: str):
+        now = time.monotonic()
+        tokens = self._tokens(key, now) - 1
+        self.buckets.set(key, (tokens, now), ttl=(self.capacity - tokens) / self.rate)
+
+
+class CommandRateLimiter:
+    def __init__(self, user_per_minute: float = 0, group_per_minute: float = 0):
+        # 频率为 0 表示不限制
+        self.user = TokenBucketLimiter(user_per_minute) if user_per_minute > 0 else None
+        self.group = (
+            TokenBucketLimiter(group_per_minute) if group_per_minute > 0 else None
+        )
+
+    def acquire(self, sender_id: str, group_id: Optional[str]) -> float:
+        """用户和群聊都有令牌时各扣除一个并返回 0，否则不扣除并返回需要等待的秒数"""
+        limiters = []
+        if self.user is not None:
+            limiters.append(("user", self.user, sender_id))
+        if self.group is not None and group_id:
+            limiters.append(("group", self.group, group_id))
+        for scope, limiter, key in limiters:
+            wait = limiter.wait_time(key)
+            if wait > 0:
+                metrics.inc("rate_limited_total", scope=scope)
+                return wait
+        for _, limiter, key in limiters:
+            limiter.consume(key)
+        return 0.0
+
+
+def rate_limited(fn):
+    """指令处理器的限流装饰器，使用插件实例上的 rate_limiter"""
+
+    @functools.wraps(fn)
+    async def wrapper(self, event, *args, **kwargs):
+        limiter: Optional[CommandRateLimiter] = getattr(self, "rate_limiter", None)
+        if limiter is not None:
+            wait = limiter.acquire(event.get_sender_id(), event.get_group_id())
+            if wait > 0:
+                yield event.plain_result(
+                    f"操作太频繁了，请 {math.ceil(wait)} 秒后再试..."
+                )
+                return
+        async for item in fn(self, event, *args, **kwargs):
+            yield item
+
+    return wrapper
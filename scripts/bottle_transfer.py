@@ -0,0 +1,179 @@
+"""
+瓶中信导出、导入和迁移到云端的独立脚本
+
+与管理员指令使用同一套实现，适合在 AstrBot 停止时处理大量瓶中信。
+json/journal/snapshot 存储模式下数据文件被 AstrBot 独占，需先停止 AstrBot。
+需要在装有 AstrBot 的环境中运行（插件目录名须是合法的 Python 标识符）：
+
+    python scripts/bottle_transfer.py export --data-dir data -o bottles.ndjson
+    python scripts/bottle_transfer.py import --data-dir data bottles.ndjson
+    python scripts/bottle_transfer.py migrate --data-dir data --api-base-url http://127.0.0.1:8000
+    python scripts/bottle_transfer.py migrate --from-file bottles.ndjson --api-base-url ...
+    python scripts/bottle_transfer.py serve --port 8000
+
+serve 启动一个本地替身云端，只实现 POST /bottles/，用于演练迁移。
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import importlib
+import random
+import sys
+import time
+
+PLUGIN_DIR = Path(__file__).resolve().parent.parent
+
+
+def _plugin_module(name: str):
+    if str(PLUGIN_DIR.parent) not in sys.path:
+        sys.path.insert(0, str(PLUGIN_DIR.parent))
+    return importlib.import_module(f"{PLUGIN_DIR.name}.{name}")
+
+
+def _open_storage(args, api_client=None):
+    bottle_storage = _plugin_module("bottle_storage")
+    return bottle_storage.BottleStorage(
+        data_dir=args.data_dir,
+        api_base_url=getattr(args, "api_base_url", ""),
+        api_client=api_client,
+        enable_content_safety=False,
+        content_safety_config={},
+        storage_mode=args.storage_mode,
+        shared_sea_path=args.shared_sea_path,
+        cloud_outbox=False,
+        cloud_migration_concurrency=getattr(args, "concurrency", 8),
+    )
+
+
+async def export_command(args):
+    storage = _open_storage(args)
+    try:
+        path, counts = await storage.export_bottles(args.output)
+    finally:
+        await storage.close()
+    print(f"exported to {path}: {counts}")
+
+
+async def import_command(args):
+    storage = _open_storage(args)
+    try:
+        counts = await storage.import_bottles(args.file)
+    finally:
+        await storage.close()
+    print(f"imported from {args.file}: {counts}")
+
+
+async def migrate_command(args):
+    api_client = _plugin_module("api_client").CloudApiClient(
+        args.api_base_url, pool_size=max(args.concurrency, 1)
+    )
+    start = time.perf_counter()
+    try:
+        if args.from_file:
+            transfer = _plugin_module("transfer")
+
+            async def send(bottle):
+                response = await api_client.request("POST", "/bottles/", bottle)
+                return f"c{response['bottle_id']}"
+
+            migration = transfer.CloudMigration(
+                args.checkpoint or args.from_file + ".progress",
+                send,
+                concurrency=args.concurrency,
+            )
+            counts = await migration.run(transfer.iter_file_bottles(args.from_file))
+        else:
+            storage = _open_storage(args, api_client)
+            try:
+                counts = await storage.migrate_to_cloud(keep_local=args.keep_local)
+            finally:
+                await storage.close()
+    finally:
+        await api_client.close()
+    elapsed = time.perf_counter() - start
+    rate = counts["uploaded"] / elapsed if elapsed > 0 else 0
+    print(f"migrated in {elapsed:.1f}s ({rate:.0f} bottles/s): {counts}")
+
+
+async def serve_command(args):
+    from aiohttp import web
+
+    state = {"next_id": 1}
+
+    async def add(request: web.Request):
+        await request.json()
+        if args.latency_ms:
+            await asyncio.sleep(args.latency_ms / 1000)
+        if random.random() < args.fail_rate:
+            return web.json_response({"detail": "injected failure"}, status=503)
+        bottle_id = state["next_id"]
+        state["next_id"] += 1
+        if bottle_id % 10000 == 0:
+            print(f"received {bottle_id} bottles")
+        return web.json_response({"bottle_id": bottle_id})
+
+    app = web.Application(client_max_size=64 * 1024**2)
+    app.router.add_post("/bottles/", add)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f"stand-in cloud listening on http://{args.host}:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(f"received {state['next_id'] - 1} bottles")
+        await runner.cleanup()
+
+
+def _add_storage_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--data-dir", required=True, help="插件数据目录")
+    parser.add_argument("--storage-mode", default="json")
+    parser.add_argument("--shared-sea-path", default="")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="导出为 NDJSON")
+    _add_storage_args(export)
+    export.add_argument("-o", "--output", help="默认写入数据目录")
+    export.set_defaults(func=export_command)
+
+    import_ = commands.add_parser("import", help="从 NDJSON 导入")
+    _add_storage_args(import_)
+    import_.add_argument("file")
+    import_.set_defaults(func=import_command)
+
+    migrate = commands.add_parser("migrate", help="上传到云端，可中断后继续")
+    migrate.add_argument("--data-dir", help="从本地海域上传")
+    migrate.add_argument("--storage-mode", default="json")
+    migrate.add_argument("--shared-sea-path", default="")
+    migrate.add_argument("--from-file", help="从导出文件上传，不需要数据目录")
+    migrate.add_argument("--checkpoint", help="--from-file 时的进度文件")
+    migrate.add_argument(
+        "--keep-local", action="store_true", help="上传后保留本地海域中的瓶中信"
+    )
+    migrate.add_argument("--api-base-url", required=True)
+    migrate.add_argument("--concurrency", type=int, default=8)
+    migrate.set_defaults(func=migrate_command)
+
+    serve = commands.add_parser("serve", help="本地替身云端")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--latency-ms", type=float, default=0, help="每个请求的延迟")
+    serve.add_argument("--fail-rate", type=float, default=0, help="返回 503 的比例")
+    serve.set_defaults(func=serve_command)
+
+    args = parser.parse_args()
+    if args.command == "migrate" and not (args.data_dir or args.from_file):
+        parser.error("migrate 需要 --data-dir 或 --from-file")
+    try:
+        asyncio.run(args.func(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
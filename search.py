@@ -0,0 +1,69 @@
+"""
+已捡起瓶中信的全文检索：中日韩文字按单字和双字切分，其他文字按词切分
+"""
+
+from typing import Dict, Iterable, List, Mapping, Set
+import re
+
+_WORD = re.compile(r"[^\W_]+")
+_CJK = re.compile(
+    r"([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+)"
+)
+
+
+def tokenize(text: str, for_query: bool = False) -> Set[str]:
+    """建索引时 CJK 文字同时生成单字和双字词元，查询时只在单字查询时使用单字"""
+    tokens = set()
+    for word in _WORD.findall(text.lower()):
+        for i, part in enumerate(_CJK.split(word)):
+            if not part:
+                continue
+            if i % 2 == 0:
+                tokens.add(part)
+                continue
+            if len(part) == 1 or not for_query:
+                tokens.update(part)
+            tokens.update(part[j : j + 2] for j in range(len(part) - 1))
+    return tokens
+
+
+def searchable_text(bottle: Mapping) -> str:
+    return f"{bottle.get('content') or ''}\n{bottle.get('sender') or ''}"
+
+
+def matches(bottle: Mapping, query: str) -> bool:
+    """双字词元可能拼出原文中不连续的片段，最后按子串确认"""
+    text = searchable_text(bottle).lower()
+    return all(term in text for term in query.lower().split())
+
+
+class SearchIndex:
+    """单个用户历史的倒排索引，按捡起顺序编号"""
+
+    def __init__(self, bottles: Iterable[Dict] = ()):
+        self.docs: List[Dict] = []
+        self.postings: Dict[str, Set[int]] = {}
+        for bottle in bottles:
+            self.add(bottle)
+
+    def add(self, bottle: Dict):
+        doc_id = len(self.docs)
+        self.docs.append(bottle)
+        for token in tokenize(searchable_text(bottle)):
+            self.postings.setdefault(token, set()).add(doc_id)
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """返回同时包含所有关键词的瓶中信，最近捡起的在前"""
+        tokens = tokenize(query, for_query=True)
+        if not tokens:
+            return []
+        postings = sorted((self.postings.get(t, set()) for t in tokens), key=len)
+        candidates = set.intersection(*postings)
+        results = []
+        for doc_id in sorted(candidates, reverse=True):
+            bottle = self.docs[doc_id]
+            if matches(bottle, query):
+                results.append(bottle)
+                if len(results) >= limit:
+                    break
+        return results
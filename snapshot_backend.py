@@ -0,0 +1,424 @@
+"""
+二进制快照存储：海面上的瓶中信在启动时全部载入，用户历史按需从 mmap 中解码
+
+快照文件布局：
+    MAGIC(8) | 索引偏移(u64) | 索引长度(u64) | 海面块 | 各用户历史块 | 索引(JSON)
+每个块都是一个 JSON 数组，索引记录每个块的偏移、长度、瓶中信数量和引用的图片，
+待审核的瓶中信很少，直接保存在索引中。
+快照之后的变更追加到日志中，用户历史在内存中只保留快照之后新增的部分。
+"""
+
+from typing import Dict, Iterator, List, Optional, Tuple
+from astrbot.api import logger
+import json
+import mmap
+import os
+import random
+import struct
+from .bottle import Bottle, json_default, object_hook
+from .local_backend import LocalBackend, DataFileLock
+from .journal import BottleJournal, pop_pending
+from .active_pool import ActivePool
+from .pick_policy import PickPolicy
+from .caching import TTLCache
+from .search import SearchIndex
+from .utils import _load_bottles
+
+MAGIC = b"MBSNAP01"
+_HEADER = struct.Struct("<QQ")
+_HEADER_SIZE = len(MAGIC) + _HEADER.size
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(
+        value, ensure_ascii=False, separators=(",", ":"), default=json_default
+    ).encode("utf-8")
+
+
+def _load_bottle_list(raw: bytes) -> List[Bottle]:
+    return [Bottle.from_dict(b) for b in json.loads(raw, object_hook=object_hook)]
+
+
+def _blob_counts(bottles: List[Dict]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for bottle in bottles:
+        for img in bottle.get("images") or []:
+            if img["type"] == "blob":
+                counts[img["data"]] = counts.get(img["data"], 0) + 1
+    return counts
+
+
+def _splice(old: Optional[bytes], new: Optional[bytes]) -> bytes:
+    """拼接两个 JSON 数组的编码，无需解码旧数组"""
+    if not old or old == b"[]":
+        return new or b"[]"
+    if not new or new == b"[]":
+        return old
+    return old[:-1] + b"," + new[1:]
+
+
+class SnapshotFile:
+    """只读打开的快照文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fp = open(path, "rb")
+        self._mm = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[: len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"不是瓶中信快照文件: {path}")
+        offset, length = _HEADER.unpack_from(self._mm, len(MAGIC))
+        index = json.loads(self._mm[offset : offset + length])
+        self.next_local_id: int = index["next_local_id"]
+        self.journal_seq: int = index["journal_seq"]
+        self._active: Tuple[int, int] = tuple(index["active"])
+        self.pending: List[Dict] = [
+            Bottle.from_dict(b) for b in index.get("pending", [])
+        ]
+        # sender_id -> [偏移, 长度, 数量, {图片哈希: 引用数}]
+        self.users: Dict[str, list] = index["users"]
+
+    def raw(self, offset: int, length: int) -> bytes:
+        return self._mm[offset : offset + length]
+
+    def load_active(self) -> List[Dict]:
+        return _load_bottle_list(self.raw(*self._active))
+
+    def count(self, sender_id: str) -> int:
+        entry = self.users.get(sender_id)
+        return entry[2] if entry else 0
+
+    def load_history(self, sender_id: str) -> List[Dict]:
+        entry = self.users.get(sender_id)
+        if not entry:
+            return []
+        return _load_bottle_list(self.raw(entry[0], entry[1]))
+
+    def close(self):
+        self._mm.close()
+        self._fp.close()
+
+
+def write_snapshot(
+    path: str,
+    old: Optional[SnapshotFile],
+    active: List[Dict],
+    tails: Dict[str, List[Dict]],
+    next_local_id: int,
+    journal_seq: int,
+    pending: Optional[List[Dict]] = None,
+):
+    """写出新快照到 path。未变化的用户历史直接从旧快照复制字节"""
+    index = {
+        "next_local_id": next_local_id,
+        "journal_seq": journal_seq,
+        "pending": pending or [],
+        "users": {},
+    }
+    with open(path, "wb") as f:
+        f.write(MAGIC + _HEADER.pack(0, 0))
+        pos = _HEADER_SIZE
+        block = _dumps(active)
+        f.write(block)
+        index["active"] = [pos, len(block)]
+        pos += len(block)
+        senders = set(old.users) if old is not None else set()
+        senders.update(tails)
+        for sender_id in senders:
+            entry = old.users.get(sender_id) if old is not None else None
+            tail = tails.get(sender_id) or []
+            old_raw = old.raw(entry[0], entry[1]) if entry else None
+            block = _splice(old_raw, _dumps(tail) if tail else None)
+            blobs = dict(entry[3]) if entry else {}
+            for digest, n in _blob_counts(tail).items():
+                blobs[digest] = blobs.get(digest, 0) + n
+            count = (entry[2] if entry else 0) + len(tail)
+            f.write(block)
+            index["users"][sender_id] = [pos, len(block), count, blobs]
+            pos += len(block)
+        block = _dumps(index)
+        f.write(block)
+        f.seek(len(MAGIC))
+        f.write(_HEADER.pack(pos, len(block)))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class _SnapshotJournal(BottleJournal):
+    """压缩时写出二进制快照的日志"""
+
+    def __init__(self, backend: "SnapshotBackend", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.backend = backend
+
+    def _take_snapshot(self, data: Dict) -> Dict:
+        return {
+            "active": list(data["active"]),
+            "pending": list(data["pending"]),
+            "tails": {k: list(v) for k, v in data["user_list"].items()},
+            "next_local_id": data["next_local_id"],
+            "journal_seq": self.seq,
+            "old": self.backend.snapshot,
+        }
+
+    def _write_snapshot(self, snapshot: Dict):
+        write_snapshot(
+            self.snapshot_file + ".tmp",
+            snapshot["old"],
+            snapshot["active"],
+            snapshot["tails"],
+            snapshot["next_local_id"],
+            snapshot["journal_seq"],
+            snapshot["pending"],
+        )
+
+    def _snapshot_written(self, snapshot: Dict):
+        self.backend._swap_snapshot(snapshot["tails"])
+
+
+class SnapshotBackend(LocalBackend):
+    def __init__(
+        self,
+        snapshot_file: str,
+        journal_fsync_interval: float = 1.0,
+        journal_compact_threshold: int = 1000,
+        history_cache_size: int = 256,
+        pick_policy: Optional[PickPolicy] = None,
+    ):
+        self.snapshot_file = snapshot_file
+        os.makedirs(os.path.dirname(snapshot_file), exist_ok=True)
+        if not os.path.exists(snapshot_file):
+            write_snapshot(snapshot_file + ".tmp", None, [], {}, 1, 0)
+            os.replace(snapshot_file + ".tmp", snapshot_file)
+        self.file_lock = DataFileLock(snapshot_file)
+        self.snapshot = SnapshotFile(snapshot_file)
+        # user_list 只保存快照之后新捡起的瓶中信
+        self.data = {
+            "active": self.snapshot.load_active(),
+            "pending": list(self.snapshot.pending),
+            "user_list": {},
+            "next_local_id": self.snapshot.next_local_id,
+            "journal_seq": self.snapshot.journal_seq,
+        }
+        self.journal = _SnapshotJournal(
+            self, snapshot_file, journal_fsync_interval, journal_compact_threshold
+        )
+        self.journal.replay(self.data)
+        self.pool = ActivePool(self.data["active"], pick_policy)
+        # 最近查看过的用户的快照历史及其编号索引
+        self.history_cache = TTLCache(maxsize=history_cache_size, ttl=3600)
+        # 最近搜索过的用户的全文索引，快照压缩后仍然有效
+        self.search_indexes = TTLCache(maxsize=history_cache_size, ttl=3600)
+
+    def _swap_snapshot(self, written_tails: Dict[str, List[Dict]]):
+        """换用新写出的快照，并丢弃已写入快照的新增历史"""
+        # Windows 上不能替换仍被映射的文件，先关闭旧快照
+        self.snapshot.close()
+        try:
+            os.replace(self.snapshot_file + ".tmp", self.snapshot_file)
+        finally:
+            self.snapshot = SnapshotFile(self.snapshot_file)
+        for sender_id, written in written_tails.items():
+            tail = self.data["user_list"].get(sender_id)
+            if tail is not None:
+                del tail[: len(written)]
+                if not tail:
+                    del self.data["user_list"][sender_id]
+            self.history_cache.pop(sender_id)
+
+    def _base_history(self, sender_id: str) -> Tuple[List[Dict], Dict[str, Dict]]:
+        cached = self.history_cache.get(sender_id)
+        if cached is None:
+            bottles = self.snapshot.load_history(sender_id)
+            index: Dict[str, Dict] = {}
+            for bottle in bottles:
+                index.setdefault(bottle["bottle_id"], bottle)
+            cached = (bottles, index)
+            self.history_cache.set(sender_id, cached)
+        return cached
+
+    def _append_picked(self, sender_id: str, bottle: Dict):
+        self.data["user_list"].setdefault(sender_id, []).append(bottle)
+        search_index = self.search_indexes.get(sender_id)
+        if search_index is not None:
+            search_index.add(bottle)
+
+    def _persist(self, record: Dict):
+        try:
+            self.journal.append(record)
+        except Exception as e:
+            logger.error(f"写入瓶中信日志时出错: {str(e)}")
+            return
+        self.journal.maybe_compact(self.data)
+
+    def add(self, bottle: Dict) -> str:
+        local_id_counter = self.data["next_local_id"]
+        new_id = f"l{local_id_counter}"
+        bottle["bottle_id"] = new_id
+        self.data["next_local_id"] = local_id_counter + 1
+        self.pool.add(bottle)
+        self._persist(
+            {"op": "add", "bottle": bottle, "next_local_id": local_id_counter + 1}
+        )
+        return new_id
+
+    def hold(self, bottle: Dict) -> str:
+        local_id_counter = self.data["next_local_id"]
+        new_id = f"l{local_id_counter}"
+        bottle["bottle_id"] = new_id
+        self.data["next_local_id"] = local_id_counter + 1
+        self.data["pending"].append(bottle)
+        self._persist(
+            {"op": "hold", "bottle": bottle, "next_local_id": local_id_counter + 1}
+        )
+        return new_id
+
+    def resolve_pending(self, bottle_id: str, approved: bool) -> Optional[Dict]:
+        bottle = pop_pending(self.data, bottle_id)
+        if bottle is None:
+            return None
+        if approved:
+            self.pool.add(bottle)
+        self._persist({"op": "approve" if approved else "reject", "bottle_id": bottle_id})
+        return bottle
+
+    def list_pending(self) -> List[Dict]:
+        return list(self.data["pending"])
+
+    def claim_random(
+        self, sender_id: str, group_id: Optional[str] = None
+    ) -> Optional[Dict]:
+        bottle = self.pool.choice_excluding(sender_id, group_id)
+        if bottle is None:
+            return None
+        self.pool.remove(bottle["bottle_id"])
+        bottle["picked"] = True
+        self._append_picked(sender_id, bottle)
+        self._persist(
+            {"op": "pick", "bottle_id": bottle["bottle_id"], "sender_id": sender_id}
+        )
+        return bottle
+
+    def collect(self, sender_id: str, bottle: Dict):
+        self._append_picked(sender_id, bottle)
+        self._persist({"op": "collect", "sender_id": sender_id, "bottle": bottle})
+
+    def is_active(self, bottle_id: str) -> bool:
+        return bottle_id in self.pool
+
+    def suspend(self, bottle_id: str) -> Optional[Dict]:
+        bottle = self.pool.remove(bottle_id)
+        if bottle is not None:
+            self.data["pending"].append(bottle)
+            self._persist({"op": "suspend", "bottle_id": bottle_id})
+        return bottle
+
+    def get_picked(self, sender_id: str, bottle_id: Optional[str] = None) -> Optional[Dict]:
+        tail = self.data["user_list"].get(sender_id, [])
+        base_count = self.snapshot.count(sender_id)
+        if bottle_id is None:
+            total = base_count + len(tail)
+            if not total:
+                return None
+            i = random.randrange(total)
+            if i >= base_count:
+                return tail[i - base_count]
+            return self._base_history(sender_id)[0][i]
+        if base_count:
+            bottle = self._base_history(sender_id)[1].get(bottle_id)
+            if bottle is not None:
+                return bottle
+        return next((b for b in tail if b["bottle_id"] == bottle_id), None)
+
+    def active_count(self) -> int:
+        return len(self.pool)
+
+    def picked_count(self, sender_id: str) -> int:
+        return self.snapshot.count(sender_id) + len(
+            self.data["user_list"].get(sender_id, [])
+        )
+
+    def list_picked(
+        self, sender_id: str, offset: int = 0, limit: Optional[int] = None
+    ) -> List[Dict]:
+        tail = self.data["user_list"].get(sender_id, [])
+        total = self.snapshot.count(sender_id) + len(tail)
+        end = total - offset
+        if end <= 0:
+            return []
+        start = 0 if limit is None else max(0, end - limit)
+        base_count = total - len(tail)
+        page = tail[max(0, start - base_count) : max(0, end - base_count)]
+        if start < base_count:
+            # 只有翻到快照中的部分时才解码该用户的历史
+            page = self._base_history(sender_id)[0][start : min(end, base_count)] + page
+        return page[::-1]
+
+    def search_picked(self, sender_id: str, query: str, limit: int = 10) -> List[Dict]:
+        search_index = self.search_indexes.get(sender_id)
+        if search_index is None:
+            base = self._base_history(sender_id)[0] if self.snapshot.count(sender_id) else []
+            search_index = SearchIndex(base)
+            for bottle in self.data["user_list"].get(sender_id, []):
+                search_index.add(bottle)
+            self.search_indexes.set(sender_id, search_index)
+        return search_index.search(query, limit)
+
+    def blob_refs(self) -> Iterator[str]:
+        for entry in self.snapshot.users.values():
+            for digest, n in entry[3].items():
+                for _ in range(n):
+                    yield digest
+        for bottles in (
+            self.data["active"],
+            self.data["pending"],
+            *self.data["user_list"].values(),
+        ):
+            for bottle in bottles:
+                for img in bottle.get("images") or []:
+                    if img["type"] == "blob":
+                        yield img["data"]
+
+    def iter_active(self) -> Iterator[Dict]:
+        return iter(list(self.data["active"]))
+
+    def iter_picked(self) -> Iterator[Tuple[str, Dict]]:
+        sender_ids = list(self.snapshot.users)
+        sender_ids += [s for s in self.data["user_list"] if s not in self.snapshot.users]
+        for sender_id in sender_ids:
+            # 快照部分和新增部分一起取出，避免两次之间压缩快照导致重复或遗漏
+            bottles = self.snapshot.load_history(sender_id) + list(
+                self.data["user_list"].get(sender_id, [])
+            )
+            for bottle in bottles:
+                yield sender_id, bottle
+
+    async def close(self):
+        await self.journal.close()
+        self.snapshot.close()
+        self.file_lock.release()
+
+
+def migrate_json_to_snapshot(json_file: str, snapshot_file: str) -> bool:
+    """将 JSON（及其未压缩的日志）中的数据一次性写入快照，导入后原文件改名备份"""
+    if not os.path.exists(json_file) or os.path.exists(snapshot_file):
+        return False
+    data = _load_bottles(json_file)
+    BottleJournal(json_file).replay(data)
+    write_snapshot(
+        snapshot_file + ".tmp",
+        None,
+        data["active"],
+        data["user_list"],
+        data["next_local_id"],
+        0,
+        data["pending"],
+    )
+    os.replace(snapshot_file + ".tmp", snapshot_file)
+    for path in (json_file, json_file + ".journal", json_file + ".journal.1"):
+        if os.path.exists(path):
+            os.replace(path, path + ".migrated")
+    logger.info(
+        f"已将 {len(data['active'])} 个瓶中信和 {len(data['user_list'])} 位用户的历史迁移到快照"
+    )
+    return True
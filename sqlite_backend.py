@@ -0,0 +1,522 @@
+"""
+SQLite (WAL) 本地瓶中信存储后端
+"""
+
+from typing import Dict, Iterator, List, Optional, Tuple
+from astrbot.api import logger
+from pathlib import Path
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import time
+from .bottle import json_default
+from .local_backend import LocalBackend
+from .journal import BottleJournal
+from .utils import _load_bottles
+from .search import matches, searchable_text, tokenize
+
+SCHEMA_VERSION = 2
+
+# picked 列：0 在海面上，1 已被捡起，-1 等待审核
+PENDING = -1
+# 随机捡瓶时先尝试这么多个随机编号，都不可捡时再按偏移量取
+RANDOM_ID_TRIES = 8
+# 事件循环上的连接等待其他进程写锁的秒数。各进程的写事务都很短（大批写入分批提交），
+# 超时时单次操作失败，而不是让整个事件循环长时间等待
+BUSY_TIMEOUT = 1
+# 线程中和启动时使用的连接不阻塞指令处理，可以等待更久
+BACKGROUND_BUSY_TIMEOUT = 30
+# 启动时迁移 JSON 数据和补建全文索引时每个事务写入的行数
+MIGRATION_CHUNK_SIZE = 1000
+
+# 这些字段有独立的列，其余字段原样保存在 extra 中，保证与 JSON 格式互转无损
+_COLUMNS = ("bottle_id", "content", "images", "sender", "sender_id", "poke", "timestamp")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bottles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bottle_id TEXT NOT NULL,
+    content TEXT NOT NULL DEFAULT '',
+    images TEXT NOT NULL DEFAULT '[]',
+    sender TEXT,
+    sender_id TEXT,
+    poke INTEGER NOT NULL DEFAULT 0,
+    timestamp TEXT,
+    picked INTEGER NOT NULL DEFAULT 0,
+    picker TEXT,
+    picked_at INTEGER,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_bottles_active ON bottles(picked, id);
+CREATE INDEX IF NOT EXISTS idx_bottles_sender ON bottles(sender_id);
+CREATE INDEX IF NOT EXISTS idx_bottles_picker ON bottles(picker, picked_at);
+CREATE INDEX IF NOT EXISTS idx_bottles_timestamp ON bottles(timestamp);
+CREATE INDEX IF NOT EXISTS idx_bottles_bottle_id ON bottles(bottle_id);
+CREATE TABLE IF NOT EXISTS bottle_terms (
+    picker TEXT NOT NULL,
+    term TEXT NOT NULL,
+    bottle_row INTEGER NOT NULL,
+    PRIMARY KEY (picker, term, bottle_row)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_bottle_terms_row ON bottle_terms(bottle_row);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _row_to_bottle(row: sqlite3.Row) -> Dict:
+    bottle = json.loads(row["extra"]) if row["extra"] else {}
+    bottle.update(
+        {
+            "content": row["content"],
+            "images": json.loads(row["images"]),
+            "sender": row["sender"],
+            "sender_id": row["sender_id"],
+            "poke": bool(row["poke"]),
+            "timestamp": row["timestamp"],
+            "bottle_id": row["bottle_id"],
+        }
+    )
+    if "picked" in bottle:
+        bottle["picked"] = row["picked"] == 1
+    return bottle
+
+
+def _bottle_params(bottle: Dict) -> tuple:
+    extra = {k: v for k, v in bottle.items() if k not in _COLUMNS}
+    return (
+        bottle["bottle_id"],
+        bottle.get("content") or "",
+        json.dumps(
+            bottle.get("images") or [], ensure_ascii=False, default=json_default
+        ),
+        bottle.get("sender"),
+        bottle.get("sender_id"),
+        1 if bottle.get("poke") else 0,
+        bottle.get("timestamp"),
+        json.dumps(extra, ensure_ascii=False) if extra else None,
+    )
+
+
+_INSERT = (
+    "INSERT INTO bottles (bottle_id, content, images, sender, sender_id, poke,"
+    " timestamp, extra, picked, picker, picked_at)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+class SqliteBackend(LocalBackend):
+    """数据库可以被同一台机器上的多个进程共享，捡起瓶中信在事务中完成"""
+
+    def __init__(self, db_file: str, busy_timeout: float = BUSY_TIMEOUT):
+        self.db_file = db_file
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        self.busy_timeout = busy_timeout
+        self.conn = self._connect()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        self.conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        self._index_missing_terms()
+        # 海面数量缓存，其他进程提交后 data_version 会变化，据此失效
+        self._active_count: Optional[int] = None
+        self._data_version: Optional[int] = None
+
+    def _connect(self, busy_timeout: Optional[float] = None) -> sqlite3.Connection:
+        # 其他进程持有写锁时最多等待 busy_timeout 秒
+        conn = sqlite3.connect(
+            self.db_file,
+            isolation_level=None,
+            timeout=self.busy_timeout if busy_timeout is None else busy_timeout,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _changed_elsewhere(self) -> bool:
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        changed = version != self._data_version
+        self._data_version = version
+        return changed
+
+    def _get_meta(
+        self, key: str, default: Optional[str] = None, conn=None
+    ) -> Optional[str]:
+        row = (conn or self.conn).execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row["value"] if row else default
+
+    def _set_meta(self, key: str, value: str, conn=None):
+        (conn or self.conn).execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def _index_terms(self, row_id: int, picker: str, bottle: Dict, conn=None):
+        (conn or self.conn).executemany(
+            "INSERT OR IGNORE INTO bottle_terms (picker, term, bottle_row) VALUES (?, ?, ?)",
+            ((picker, term, row_id) for term in tokenize(searchable_text(bottle))),
+        )
+
+    def _index_missing_terms(self):
+        """为还没有全文索引的已捡起瓶中信补建索引（旧版本数据库或迁移导入的历史）
+
+        按行号分批提交，避免长时间持有写锁阻塞共享数据库的其他进程。
+        内容和投放者中没有可索引词语的瓶中信（如只有图片、投放者昵称只有表情）不会产生索引行，
+        已检查到的位置记录在 meta 表中，这些瓶中信不会在每次启动时被重复扫描
+        """
+        conn = self._connect(BACKGROUND_BUSY_TIMEOUT)
+        total = 0
+        try:
+            last_id = int(self._get_meta("terms_indexed_through", "0", conn))
+            while True:
+                with conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    rows = conn.execute(
+                        "SELECT id, picker, content, sender FROM bottles WHERE id > ?"
+                        " AND picked = 1 AND picker IS NOT NULL AND NOT EXISTS"
+                        " (SELECT 1 FROM bottle_terms WHERE bottle_row = bottles.id)"
+                        " ORDER BY id LIMIT ?",
+                        (last_id, MIGRATION_CHUNK_SIZE),
+                    ).fetchall()
+                    for row in rows:
+                        self._index_terms(row["id"], row["picker"], dict(row), conn)
+                    if rows:
+                        last_id = rows[-1]["id"]
+                        self._set_meta("terms_indexed_through", str(last_id), conn)
+                total += len(rows)
+                if len(rows) < MIGRATION_CHUNK_SIZE:
+                    break
+        finally:
+            conn.close()
+        if total:
+            logger.info(f"已为 {total} 个已捡起的瓶中信建立全文索引")
+
+    def add(self, bottle: Dict) -> str:
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            local_id_counter = int(self._get_meta("next_local_id", "1"))
+            new_id = f"l{local_id_counter}"
+            bottle["bottle_id"] = new_id
+            self.conn.execute(_INSERT, _bottle_params(bottle) + (0, None, None))
+            self._set_meta("next_local_id", str(local_id_counter + 1))
+        self._active_count = None
+        return new_id
+
+    def hold(self, bottle: Dict) -> str:
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            local_id_counter = int(self._get_meta("next_local_id", "1"))
+            new_id = f"l{local_id_counter}"
+            bottle["bottle_id"] = new_id
+            self.conn.execute(_INSERT, _bottle_params(bottle) + (PENDING, None, None))
+            self._set_meta("next_local_id", str(local_id_counter + 1))
+        return new_id
+
+    def resolve_pending(self, bottle_id: str, approved: bool) -> Optional[Dict]:
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute(
+                "SELECT * FROM bottles WHERE bottle_id = ? AND picked = ? LIMIT 1",
+                (bottle_id, PENDING),
+            ).fetchone()
+            if row is None:
+                # 已被共享数据库的其他进程处理
+                return None
+            if approved:
+                self.conn.execute("UPDATE bottles SET picked = 0 WHERE id = ?", (row["id"],))
+            else:
+                self.conn.execute("DELETE FROM bottles WHERE id = ?", (row["id"],))
+        self._active_count = None
+        return _row_to_bottle(row)
+
+    def list_pending(self) -> List[Dict]:
+        rows = self.conn.execute(
+            "SELECT * FROM bottles WHERE picked = ? ORDER BY id", (PENDING,)
+        ).fetchall()
+        return [_row_to_bottle(row) for row in rows]
+
+    def _random_active_id(self, sender_id: str) -> Optional[int]:
+        bounds = self.conn.execute(
+            "SELECT MIN(id), MAX(id) FROM bottles WHERE picked = 0"
+        ).fetchone()
+        if bounds[0] is None:
+            return None
+        # 编号区间内均匀取随机编号，命中别人的海面瓶子即返回，每个瓶子被选中的概率相同
+        for _ in range(RANDOM_ID_TRIES):
+            row = self.conn.execute(
+                "SELECT id FROM bottles WHERE id = ? AND picked = 0 AND sender_id != ?",
+                (random.randint(bounds[0], bounds[1]), sender_id),
+            ).fetchone()
+            if row is not None:
+                return row["id"]
+        # 编号稀疏时在可捡的瓶子中按随机偏移量取
+        count = self.conn.execute(
+            "SELECT COUNT(*) FROM bottles WHERE picked = 0 AND sender_id != ?",
+            (sender_id,),
+        ).fetchone()[0]
+        if not count:
+            return None
+        row = self.conn.execute(
+            "SELECT id FROM bottles WHERE picked = 0 AND sender_id != ?"
+            " ORDER BY id LIMIT 1 OFFSET ?",
+            (sender_id, random.randrange(count)),
+        ).fetchone()
+        return row["id"] if row else None
+
+    def claim_random(
+        self, sender_id: str, group_id: Optional[str] = None
+    ) -> Optional[Dict]:
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row_id = self._random_active_id(sender_id)
+            if row_id is None:
+                return None
+            self.conn.execute(
+                "UPDATE bottles SET picked = 1, picker = ?, picked_at = ? WHERE id = ?",
+                (sender_id, time.time_ns(), row_id),
+            )
+            row = self.conn.execute("SELECT * FROM bottles WHERE id = ?", (row_id,)).fetchone()
+            bottle = _row_to_bottle(row)
+            self._index_terms(row_id, sender_id, bottle)
+        self._active_count = None
+        return bottle
+
+    def collect(self, sender_id: str, bottle: Dict):
+        with self.conn:
+            cursor = self.conn.execute(
+                _INSERT, _bottle_params(bottle) + (1, sender_id, time.time_ns())
+            )
+            self._index_terms(cursor.lastrowid, sender_id, bottle)
+
+    def is_active(self, bottle_id: str) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM bottles WHERE bottle_id = ? AND picked = 0 LIMIT 1",
+            (bottle_id,),
+        ).fetchone()
+        return row is not None
+
+    def suspend(self, bottle_id: str) -> Optional[Dict]:
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute(
+                "SELECT * FROM bottles WHERE bottle_id = ? AND picked = 0 LIMIT 1",
+                (bottle_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE bottles SET picked = ? WHERE id = ?", (PENDING, row["id"])
+            )
+        self._active_count = None
+        return _row_to_bottle(row)
+
+    def get_picked(self, sender_id: str, bottle_id: Optional[str] = None) -> Optional[Dict]:
+        if bottle_id is not None:
+            row = self.conn.execute(
+                "SELECT * FROM bottles WHERE bottle_id = ? AND picker = ? LIMIT 1",
+                (bottle_id, sender_id),
+            ).fetchone()
+            return _row_to_bottle(row) if row else None
+        count = self.picked_count(sender_id)
+        if not count:
+            return None
+        row = self.conn.execute(
+            "SELECT * FROM bottles WHERE picker = ? ORDER BY picked_at LIMIT 1 OFFSET ?",
+            (sender_id, random.randrange(count)),
+        ).fetchone()
+        return _row_to_bottle(row) if row else None
+
+    def active_count(self) -> int:
+        if self._changed_elsewhere() or self._active_count is None:
+            self._active_count = self.conn.execute(
+                "SELECT COUNT(*) FROM bottles WHERE picked = 0"
+            ).fetchone()[0]
+        return self._active_count
+
+    def picked_count(self, sender_id: str) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM bottles WHERE picker = ?", (sender_id,)
+        ).fetchone()[0]
+
+    def list_picked(
+        self, sender_id: str, offset: int = 0, limit: Optional[int] = None
+    ) -> List[Dict]:
+        rows = self.conn.execute(
+            "SELECT * FROM bottles WHERE picker = ?"
+            " ORDER BY picked_at DESC LIMIT ? OFFSET ?",
+            (sender_id, -1 if limit is None else limit, offset),
+        ).fetchall()
+        return [_row_to_bottle(row) for row in rows]
+
+    def search_picked(self, sender_id: str, query: str, limit: int = 10) -> List[Dict]:
+        terms = sorted(tokenize(query, for_query=True))
+        if not terms:
+            return []
+        rows = self.conn.execute(
+            "SELECT * FROM bottles WHERE id IN ("
+            " SELECT bottle_row FROM bottle_terms"
+            f" WHERE picker = ? AND term IN ({', '.join('?' * len(terms))})"
+            " GROUP BY bottle_row HAVING COUNT(*) = ?"
+            ") ORDER BY picked_at DESC",
+            (sender_id, *terms, len(terms)),
+        )
+        results = []
+        for row in rows:
+            bottle = _row_to_bottle(row)
+            if matches(bottle, query):
+                results.append(bottle)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def blob_refs(self) -> Iterator[str]:
+        rows = self.conn.execute(
+            "SELECT images FROM bottles WHERE images LIKE '%\"blob\"%'"
+        )
+        for row in rows:
+            for img in json.loads(row["images"]):
+                if img["type"] == "blob":
+                    yield img["data"]
+
+    def _iter_rows(self, sql: str, params: tuple = ()) -> Iterator[sqlite3.Row]:
+        """在独立的只读连接上逐行读取，WAL 下整个遍历看到同一个一致的快照"""
+        uri = Path(self.db_file).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("BEGIN")
+            yield from conn.execute(sql, params)
+        finally:
+            conn.close()
+
+    def iter_active(self) -> Iterator[Dict]:
+        for row in self._iter_rows("SELECT * FROM bottles WHERE picked = 0 ORDER BY id"):
+            yield _row_to_bottle(row)
+
+    def iter_picked(self) -> Iterator[Tuple[str, Dict]]:
+        rows = self._iter_rows(
+            "SELECT * FROM bottles WHERE picker IS NOT NULL ORDER BY picker, picked_at"
+        )
+        for row in rows:
+            yield row["picker"], _row_to_bottle(row)
+
+    async def import_bottles(
+        self, active: List[Dict], picked: List[Tuple[str, Dict]]
+    ):
+        # 在线程中使用独立连接写入，整批写入期间不阻塞事件循环
+        await asyncio.to_thread(self._import_batch, active, picked)
+        self._active_count = None
+
+    def _import_batch(self, active: List[Dict], picked: List[Tuple[str, Dict]]):
+        conn = self._connect(BACKGROUND_BUSY_TIMEOUT)
+        try:
+            # 整批在一个事务中写入
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                local_id_counter = int(self._get_meta("next_local_id", "1", conn))
+                for bottle in active:
+                    bottle["bottle_id"] = f"l{local_id_counter}"
+                    local_id_counter += 1
+                    conn.execute(_INSERT, _bottle_params(bottle) + (0, None, None))
+                self._set_meta("next_local_id", str(local_id_counter), conn)
+                # 同一批的捡起时间依次递增，保持历史顺序
+                picked_at = time.time_ns()
+                for i, (sender_id, bottle) in enumerate(picked):
+                    cursor = conn.execute(
+                        _INSERT, _bottle_params(bottle) + (1, sender_id, picked_at + i)
+                    )
+                    self._index_terms(cursor.lastrowid, sender_id, bottle, conn)
+        finally:
+            conn.close()
+
+    async def close(self):
+        self.conn.close()
+
+
+def _renumber_local_bottles(data: Dict, first_id: int) -> int:
+    """为并入共享数据库的本地瓶中信重新编号，避免与已有编号冲突，返回下一个编号"""
+    id_map: Dict[str, str] = {}
+    for bottles in (data["active"], data["pending"], *data["user_list"].values()):
+        for bottle in bottles:
+            old_id = bottle.get("bottle_id", "")
+            if not old_id.startswith("l"):
+                continue
+            if old_id not in id_map:
+                id_map[old_id] = f"l{first_id + len(id_map)}"
+            bottle["bottle_id"] = id_map[old_id]
+    return first_id + len(id_map)
+
+
+def migrate_json_to_sqlite(json_file: str, backend: SqliteBackend) -> bool:
+    """将 JSON（及其未压缩的日志）中的数据导入 SQLite，导入后原文件改名备份
+
+    分批提交以免长时间持有写锁，进度记录在 meta 表中，中断后重启会从中断处继续
+    """
+    if not os.path.exists(json_file):
+        return False
+    json_file = os.path.abspath(json_file)
+    done_key = f"migrated_from_json:{json_file}"
+    if backend._get_meta(done_key):
+        return False
+    progress_key = f"json_migration_progress:{json_file}"
+    data = _load_bottles(json_file)
+    BottleJournal(json_file).replay(data)
+    conn = backend._connect(BACKGROUND_BUSY_TIMEOUT)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            raw = backend._get_meta(progress_key, conn=conn)
+            if raw is None:
+                # 第一次迁移：确定编号方式并预留编号，之后每批都按相同方式处理
+                next_local_id = int(backend._get_meta("next_local_id", "1", conn))
+                progress = {"first_id": None, "done": 0, "picked_at": time.time_ns()}
+                if conn.execute("SELECT 1 FROM bottles LIMIT 1").fetchone():
+                    # 数据库已被其他进程使用
+                    progress["first_id"] = next_local_id
+                    next_local_id = _renumber_local_bottles(data, next_local_id)
+                else:
+                    next_local_id = max(next_local_id, data["next_local_id"])
+                backend._set_meta("next_local_id", str(next_local_id), conn)
+                backend._set_meta(progress_key, json.dumps(progress), conn)
+            else:
+                progress = json.loads(raw)
+                if progress["first_id"] is not None:
+                    _renumber_local_bottles(data, progress["first_id"])
+        # (瓶中信, (picked, picker, picked_at))，顺序固定，按已完成的行数跳过
+        rows = [(b, (0, None, None)) for b in data["active"]]
+        rows += [(b, (PENDING, None, None)) for b in data["pending"]]
+        for sender_id, bottles in data["user_list"].items():
+            # 保持原有的捡起顺序
+            rows += [
+                (b, (1, sender_id, progress["picked_at"] + i))
+                for i, b in enumerate(bottles)
+            ]
+        for start in range(progress["done"], len(rows), MIGRATION_CHUNK_SIZE):
+            chunk = rows[start : start + MIGRATION_CHUNK_SIZE]
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    _INSERT, (_bottle_params(b) + state for b, state in chunk)
+                )
+                progress["done"] = start + len(chunk)
+                backend._set_meta(progress_key, json.dumps(progress), conn)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            backend._set_meta(done_key, "1", conn)
+            conn.execute("DELETE FROM meta WHERE key = ?", (progress_key,))
+    finally:
+        conn.close()
+    backend._index_missing_terms()
+    for path in (json_file, json_file + ".journal", json_file + ".journal.1"):
+        if os.path.exists(path):
+            os.replace(path, path + ".migrated")
+    logger.info(
+        f"已将 {len(data['active'])} 个瓶中信和 {len(data['user_list'])} 位用户的历史迁移到 SQLite"
+    )
+    return True
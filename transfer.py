@@ -0,0 +1,283 @@
+"""
+瓶中信的 NDJSON 导出导入，以及把本地瓶中信批量迁移到云端
+
+导出文件每行一条记录，逐行读写，不会一次性载入全部瓶中信：
+
+    {"kind": "header", "version": 1}
+    {"kind": "active", "bottle": {...}}
+    {"kind": "pending", "bottle": {...}}
+    {"kind": "picked", "sender_id": "...", "bottle": {...}}
+
+pending 是导出时还在等待审核（或正在迁移到云端）的瓶中信。
+
+本地图片在导出时内联为 base64，导出文件可以在其他机器上导入或上传到云端。
+"""
+
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Optional
+from astrbot.api import logger
+import aiohttp
+import asyncio
+import base64
+import json
+import os
+import random
+from .blob_store import BlobStore
+from .bottle import json_default
+from .local_backend import LocalBackend
+from .outbox import DROP_STATUSES
+
+FORMAT_VERSION = 1
+# 每处理这么多条记录让出一次事件循环
+CHUNK_SIZE = 500
+# 迁移时每上传这么多个瓶中信记录一次进度日志
+PROGRESS_INTERVAL = 1000
+# 云端发送的字段，与扔云瓶中信一致
+CLOUD_FIELDS = ("content", "images", "sender", "sender_id", "poke")
+
+
+def inline_images(
+    images: Iterable[Dict], blob_store: Optional[BlobStore]
+) -> List[Dict]:
+    """将图片引用还原为内联的 base64，图片文件丢失时跳过该图片"""
+    result = []
+    for img in images or []:
+        if img["type"] == "blob" and blob_store is not None:
+            try:
+                data = blob_store.read(img["data"])
+            except FileNotFoundError:
+                logger.warning(f"瓶中信图片 {img['data']} 已丢失，导出时跳过")
+                continue
+            img = {"type": "base64", "data": base64.b64encode(data).decode()}
+        result.append({"type": img["type"], "data": img["data"]})
+    return result
+
+
+def _portable(bottle: Dict, blob_store: Optional[BlobStore]) -> Dict:
+    record = dict(bottle)
+    if "images" in record:
+        record["images"] = inline_images(record["images"], blob_store)
+    return record
+
+
+def _dumps(record: Dict) -> str:
+    return json.dumps(record, ensure_ascii=False, default=json_default) + "\n"
+
+
+async def export_ndjson(
+    backend: LocalBackend, blob_store: Optional[BlobStore], path: str
+) -> Dict[str, int]:
+    """导出海面上和待审核的瓶中信以及全部用户历史，返回各类记录的数量"""
+    counts = {"active": 0, "pending": 0, "picked": 0}
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        f.write(_dumps({"kind": "header", "version": FORMAT_VERSION}))
+        for bottle in backend.iter_active():
+            f.write(_dumps({"kind": "active", "bottle": _portable(bottle, blob_store)}))
+            counts["active"] += 1
+            if counts["active"] % CHUNK_SIZE == 0:
+                await asyncio.sleep(0)
+        for bottle in backend.list_pending():
+            f.write(_dumps({"kind": "pending", "bottle": _portable(bottle, blob_store)}))
+            counts["pending"] += 1
+        for sender_id, bottle in backend.iter_picked():
+            record = {
+                "kind": "picked",
+                "sender_id": sender_id,
+                "bottle": _portable(bottle, blob_store),
+            }
+            f.write(_dumps(record))
+            counts["picked"] += 1
+            if counts["picked"] % CHUNK_SIZE == 0:
+                await asyncio.sleep(0)
+    os.replace(tmp_file, path)
+    return counts
+
+
+def read_ndjson(path: str) -> Iterator[Dict]:
+    """逐行读取导出文件，跳过损坏的行"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"跳过 {path} 第 {line_no} 行损坏的记录")
+                continue
+            if record.get("kind") == "header":
+                if record.get("version", 1) > FORMAT_VERSION:
+                    raise ValueError(f"不支持的导出文件版本: {record['version']}")
+                continue
+            yield record
+
+
+def iter_file_bottles(path: str) -> Iterator[Dict]:
+    """导出文件中海面上的瓶中信，供迁移到云端使用"""
+    for record in read_ndjson(path):
+        if record.get("kind") == "active" and isinstance(record.get("bottle"), dict):
+            yield record["bottle"]
+
+
+def cloud_payload(bottle: Dict, blob_store: Optional[BlobStore] = None) -> Dict:
+    payload = {key: bottle.get(key) for key in CLOUD_FIELDS}
+    payload["content"] = payload["content"] or ""
+    payload["images"] = inline_images(payload["images"], blob_store)
+    payload["poke"] = bool(payload["poke"])
+    return payload
+
+
+class CloudMigration:
+    """
+    以有限并发把瓶中信逐个发往云端，已上传的本地编号追加写入进度文件，
+    中断后重新运行会跳过已上传的瓶中信
+
+    提供 claim 时，每个瓶中信上传前先调用它从本地海域取出，返回 None 表示已被捡起，不再上传；
+    上传结束后调用 settle(bottle, uploaded)：上传成功的从本地删除，失败或被拒收的放回海中。
+    之前已上传但中断前没来得及删除的瓶中信，重新运行时会被取出后直接删除
+    """
+
+    def __init__(
+        self,
+        checkpoint_path: str,
+        send: Callable[[Dict], Awaitable[str]],
+        blob_store: Optional[BlobStore] = None,
+        concurrency: int = 8,
+        max_attempts: int = 5,
+        retry_backoff: float = 1,
+        claim: Optional[Callable[[Dict], Awaitable[Optional[Dict]]]] = None,
+        settle: Optional[Callable[[Dict, bool], Awaitable[None]]] = None,
+    ):
+        # send 发送一个瓶中信并返回云端编号
+        self.checkpoint_path = checkpoint_path
+        self._send = send
+        self._claim = claim
+        self._settle = settle
+        self.blob_store = blob_store
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff
+        # 已处理的本地编号 -> 云端编号，被云端拒收的为 None
+        self.done: Dict[str, Optional[str]] = {}
+        self.counts = {
+            "uploaded": 0,
+            "skipped": 0,
+            "gone": 0,
+            "rejected": 0,
+            "failed": 0,
+        }
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.done[record["id"]] = record.get("cloud_id")
+
+    async def run(self, bottles: Iterable[Dict]) -> Dict[str, int]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        with open(self.checkpoint_path, "a", encoding="utf-8") as checkpoint:
+            workers = [
+                asyncio.create_task(self._worker(queue, checkpoint))
+                for _ in range(self.concurrency)
+            ]
+            try:
+                for i, bottle in enumerate(bottles, 1):
+                    local_id = bottle.get("bottle_id")
+                    if local_id in self.done:
+                        self.counts["skipped"] += 1
+                        if self.done[local_id] is not None:
+                            claimed = await self._claimed(bottle)
+                            if claimed is not None:
+                                await self._settled(claimed, True)
+                    else:
+                        await queue.put(bottle)
+                        continue
+                    if i % CHUNK_SIZE == 0:
+                        await asyncio.sleep(0)
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        logger.info(f"瓶中信迁移到云端结束: {self.counts}")
+        return dict(self.counts)
+
+    async def _worker(self, queue: asyncio.Queue, checkpoint):
+        while True:
+            bottle = await queue.get()
+            if bottle is None:
+                return
+            bottle = await self._claimed(bottle)
+            if bottle is None:
+                self.counts["gone"] += 1
+                continue
+            try:
+                cloud_id = await self._upload(bottle)
+            except asyncio.CancelledError:
+                # 迁移被中断，正在上传的瓶中信放回海中
+                await self._settled(bottle, False)
+                raise
+            except Exception as e:
+                # 格式错误的瓶中信不影响其他瓶中信的迁移
+                logger.error(f"迁移瓶中信 {bottle.get('bottle_id')} 失败: {str(e)}")
+                cloud_id = False
+            if cloud_id is False:
+                self.counts["failed"] += 1
+                await self._settled(bottle, False)
+                continue
+            local_id = bottle.get("bottle_id")
+            if local_id is not None:
+                self.done[local_id] = cloud_id
+                # 每条都立即写入，中断后最多重复上传正在发送中的瓶中信
+                checkpoint.write(json.dumps({"id": local_id, "cloud_id": cloud_id}) + "\n")
+                checkpoint.flush()
+            if cloud_id is None:
+                self.counts["rejected"] += 1
+                await self._settled(bottle, False)
+                continue
+            await self._settled(bottle, True)
+            self.counts["uploaded"] += 1
+            if self.counts["uploaded"] % PROGRESS_INTERVAL == 0:
+                logger.info(f"已迁移 {self.counts['uploaded']} 个瓶中信到云端")
+
+    async def _claimed(self, bottle: Dict) -> Optional[Dict]:
+        if self._claim is None:
+            return bottle
+        return await self._claim(bottle)
+
+    async def _settled(self, bottle: Dict, uploaded: bool):
+        if self._settle is None:
+            return
+        try:
+            await self._settle(bottle, uploaded)
+        except Exception as e:
+            # 瓶中信留在待审核列表中，重启后放回海中；已上传的下次运行时会再次删除
+            logger.error(f"处理已迁移的瓶中信 {bottle.get('bottle_id')} 失败: {str(e)}")
+
+    async def _upload(self, bottle: Dict):
+        """返回云端编号；被云端拒收返回 None；重试次数用尽返回 False"""
+        payload = cloud_payload(bottle, self.blob_store)
+        for attempt in range(self.max_attempts):
+            try:
+                return await self._send(payload)
+            except aiohttp.ClientResponseError as e:
+                if e.status in DROP_STATUSES:
+                    logger.error(f"云端拒收了瓶中信 {bottle.get('bottle_id')}: {str(e)}")
+                    return None
+                error = e
+            except Exception as e:
+                error = e
+            if attempt + 1 >= self.max_attempts:
+                logger.error(f"迁移瓶中信 {bottle.get('bottle_id')} 失败: {error!r}")
+                return False
+            delay = self.retry_backoff * 2**attempt
+            await asyncio.sleep(delay * random.uniform(0.5, 1))
+        return False
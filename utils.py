@@ -1,33 +1,92 @@
-from typing import List, Dict, Optional
+from typing import Any, Iterator, List, Dict, Mapping, Optional
 import astrbot.api.message_components as Comp
 from astrbot.api import logger
 from astrbot.api.event import AstrMessageEvent
 import os
 import json
-import copy
 import random
+import asyncio
+import base64
+import hashlib
+import io
+import time
+from .bottle import Bottle, json_default, object_hook
+from .caching import TTLCache, SingleFlight
+from .metrics import metrics
 
 
-async def collect_images(event: AstrMessageEvent, use_base64: bool) -> List[Dict]:
-    """收集消息中的所有图片"""
-    images = []
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+
+def _recompress_image(data: bytes, max_dimension: int, quality: int) -> bytes:
+    """缩小并重新压缩图片，结果没有变小时返回原图"""
+    with PILImage.open(io.BytesIO(data)) as img:
+        if getattr(img, "is_animated", False):
+            # 动图重新编码会丢帧，保持原样
+            return data
+        img.thumbnail((max_dimension, max_dimension))
+        out = io.BytesIO()
+        if img.mode in ("RGBA", "LA") or "transparency" in img.info:
+            img.save(out, format="PNG", optimize=True)
+        else:
+            img.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
+    result = out.getvalue()
+    return result if len(result) < len(data) else data
+
 
-    for component in event.message_obj.message:
-        if isinstance(component, Comp.Image):
-            if use_base64:
-                images.append(
-                    {"type": "base64", "data": await component.convert_to_base64()}
+async def _image_to_base64(
+    component: Comp.Image, max_dimension: int, quality: int
+) -> Dict:
+    data = await component.convert_to_base64()
+    if max_dimension > 0 and PILImage is not None:
+        try:
+            raw = await asyncio.to_thread(
+                _recompress_image, base64.b64decode(data), max_dimension, quality
+            )
+            data = base64.b64encode(raw).decode()
+        except Exception as e:
+            logger.warning(f"压缩图片失败，使用原图: {str(e)}")
+    return {"type": "base64", "data": data}
+
+
+async def collect_images(
+    event: AstrMessageEvent,
+    use_base64: bool,
+    max_dimension: int = 0,
+    quality: int = 85,
+) -> List[Dict]:
+    """并发收集消息中的所有图片，max_dimension 大于 0 时缩小并重新压缩 base64 图片"""
+    components = [c for c in event.message_obj.message if isinstance(c, Comp.Image)]
+    if use_base64:
+        with metrics.timer("collect_images_seconds"):
+            return list(
+                await asyncio.gather(
+                    *(_image_to_base64(c, max_dimension, quality) for c in components)
                 )
-            else:
-                if event.get_platform_name() == "aiocqhttp":
-                    url = component.url.split("&rkey=")[0]
-                    images.append({"type": "qq_url", "data": url})
-                else:
-                    images.append({"type": "url", "data": component.url})
+            )
+
+    images = []
+    for component in components:
+        if event.get_platform_name() == "aiocqhttp":
+            url = component.url.split("&rkey=")[0]
+            images.append({"type": "qq_url", "data": url})
+        else:
+            images.append({"type": "url", "data": component.url})
 
     return images
 
 
+def image_size(img: Dict) -> int:
+    """base64 图片解码后的字节数，其他类型返回 0"""
+    if img["type"] != "base64":
+        return 0
+    data = img["data"]
+    return len(data) * 3 // 4 - data[-2:].count("=")
+
+
 def _ensure_data_file(data_dir: str):
     """确保数据文件存在"""
     os.makedirs(os.path.dirname(data_dir), exist_ok=True)
@@ -45,67 +104,192 @@ def _load_bottles(data_dir: str) -> Dict[str, Dict]:
     """加载瓶中信数据"""
     try:
         with open(data_dir, "r", encoding="utf-8") as f:
-            data = json.load(f)
+            data = json.load(f, object_hook=object_hook)
             if "active" not in data or not isinstance(data["active"], list):
                 data["active"] = []
             if "user_list" not in data or not isinstance(data["user_list"], dict):
                 data["user_list"] = {}
+            if "pending" not in data or not isinstance(data["pending"], list):
+                data["pending"] = []
             if "next_local_id" not in data or not isinstance(
                 data["next_local_id"], int
             ):
                 data["next_local_id"] = 1
+            data["active"] = [Bottle.from_dict(b) for b in data["active"]]
+            data["pending"] = [Bottle.from_dict(b) for b in data["pending"]]
+            data["user_list"] = {
+                sender_id: [Bottle.from_dict(b) for b in bottles]
+                for sender_id, bottles in data["user_list"].items()
+            }
             return data
     except Exception as e:
         logger.error(f"加载瓶中信数据时出错: {str(e)}, 将重新规格化")
-        return {"active": [], "user_list": {}, "next_local_id": 1}
+        return {"active": [], "pending": [], "user_list": {}, "next_local_id": 1}
 
 
+@metrics.timed("storage_save_seconds")
 def _save_bottles(data_dir: str, bottles: Dict[str, Dict]):
     """保存瓶中信数据"""
     try:
         with open(data_dir, "w", encoding="utf-8") as f:
-            json.dump(bottles, f, ensure_ascii=False, indent=2)
+            json.dump(bottles, f, ensure_ascii=False, indent=2, default=json_default)
     except Exception as e:
         logger.error(f"保存瓶中信数据时出错: {str(e)}")
 
 
+# rkey 按机器人账号缓存，并发的捡瓶请求共享同一次查询
+RKEY_DEFAULT_TTL = 300
+RKEY_EXPIRE_MARGIN = 60
+_rkey_cache = TTLCache(maxsize=64, ttl=RKEY_DEFAULT_TTL)
+_rkey_flight = SingleFlight()
+
+
+def _rkey_ttl(rkey_data: Dict) -> float:
+    """根据 get_rkey 返回的 created_at/ttl 计算剩余有效期"""
+    try:
+        expires_at = int(rkey_data["created_at"]) + int(rkey_data["ttl"])
+    except (KeyError, TypeError, ValueError):
+        return RKEY_DEFAULT_TTL
+    return max(0, expires_at - time.time() - RKEY_EXPIRE_MARGIN)
+
+
+@metrics.timed("rkey_fetch_seconds")
+async def _fetch_rkey(event: AstrMessageEvent) -> Optional[str]:
+    from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
+        AiocqhttpMessageEvent,
+    )
+
+    assert isinstance(event, AiocqhttpMessageEvent)
+    client = event.bot
+    rkeys = await client.api.call_action("get_rkey")
+
+    rkey_data = next((rkey for rkey in rkeys if rkey["type"] == "group"), None)
+    rkey = rkey_data["rkey"]
+    ttl = _rkey_ttl(rkey_data)
+    if ttl > 0:
+        _rkey_cache.set(event.get_self_id(), rkey, ttl)
+    return rkey
+
+
 async def get_rkey(event: AstrMessageEvent) -> Optional[str]:
     if event.get_platform_name() == "aiocqhttp":
-        from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
-            AiocqhttpMessageEvent,
-        )
+        self_id = event.get_self_id()
+        rkey = _rkey_cache.get(self_id)
+        if rkey is not None:
+            metrics.inc("rkey_cache_total", result="hit")
+            return rkey
+        metrics.inc("rkey_cache_total", result="miss")
+        return await _rkey_flight.do(self_id, lambda: _fetch_rkey(event))
+    return None
 
-        assert isinstance(event, AiocqhttpMessageEvent)
-        client = event.bot
-        rkeys = await client.api.call_action("get_rkey")
 
-        rkey_data = next((rkey for rkey in rkeys if rkey["type"] == "group"), None)
-        rkey = rkey_data["rkey"]
-        return rkey
+class BottleView(Mapping):
+    """瓶中信的只读视图，rkey 和附加文字在读取时才拼接，不复制原瓶中信"""
+
+    __slots__ = ("_bottle", "_rkey", "_suffix")
+
+    def __init__(self, bottle: Mapping, rkey: Optional[str] = None, suffix: str = ""):
+        self._bottle = bottle
+        self._rkey = rkey
+        self._suffix = suffix
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "content":
+            return self._bottle["content"] + self._suffix
+        if key == "images":
+            return self.images
+        return self._bottle[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._bottle)
+
+    def __len__(self) -> int:
+        return len(self._bottle)
+
+    @property
+    def images(self) -> List[Dict]:
+        # 只为 qq 图片生成新的小字典，base64 等图片直接引用原数据
+        return [
+            {"type": "qq_url", "data": img["data"] + (self._rkey or "")}
+            if img["type"] == "qq_url"
+            else img
+            for img in self._bottle["images"]
+        ]
+
+    def with_suffix(self, suffix: str) -> "BottleView":
+        """返回在内容末尾附加文字的新视图"""
+        return BottleView(self._bottle, self._rkey, self._suffix + suffix)
+
+
+async def get_images_rkey(
+    images: List[Dict], event: Optional[AstrMessageEvent] = None
+) -> Optional[str]:
+    """仅在含有qq图片时才查询rkey"""
+    if event is not None and any(img["type"] == "qq_url" for img in images):
+        return await get_rkey(event)
     return None
 
 
 # 获得带有rkey的bottle
-async def get_bottle2handle(bottle: Dict, rkey: Optional[str] = None):
-    bottle = copy.deepcopy(bottle)
-    for img in bottle["images"]:
-        if img["type"] == "qq_url":
-            img["data"] = img["data"] + (rkey or "")
-    return bottle
+async def get_bottle2handle(
+    bottle: Mapping, event: Optional[AstrMessageEvent] = None
+) -> BottleView:
+    return BottleView(bottle, await get_images_rkey(bottle["images"], event))
+
+
+def _censor_image_args(img: Dict) -> tuple:
+    """返回送审的图片内容及其缓存键"""
+    if img["type"] == "base64":
+        data = base64.b64decode(img["data"])
+        return data, hashlib.sha256(data).hexdigest()
+    # qq 图片链接中的 rkey 会变化，缓存键不包含 rkey
+    return img["data"], img["data"].split("&rkey=")[0]
 
 
 async def check_bottle(bottle: Dict, content_safety):
-    if bottle["content"] and not content_safety.check("text", bottle["content"]):
-        msg = "瓶中信内容不合规，已被屏蔽。"
-        return None, msg
-    if bottle["images"] and not all(
-        content_safety.check("image", img["data"]) for img in bottle["images"]
-    ):
+    """并发审核瓶中信的文字和所有图片"""
+    checks = []
+    if bottle["content"]:
+        checks.append(content_safety.check_async("text", bottle["content"]))
+    for img in bottle["images"]:
+        data, cache_key = _censor_image_args(img)
+        checks.append(content_safety.check_async("image", data, cache_key))
+    if checks and not all(await asyncio.gather(*checks)):
         msg = "瓶中信内容不合规，已被屏蔽。"
         return None, msg
     return bottle, ""
 
 
+async def censor_bottle(
+    bottle: Mapping, content_safety, blob_store
+) -> Optional[bool]:
+    """并发审核本地瓶中信的文字和所有图片，接口出错或图片无法下载时返回 None"""
+    if any(
+        img["type"] == "qq_url" and "&rkey=" not in img["data"]
+        for img in bottle["images"]
+    ):
+        # 不带 rkey 的 QQ 图片链接无法下载，送审只会白白消耗接口调用
+        return None
+    checks = []
+    if bottle["content"]:
+        checks.append(content_safety.censor_async("text", bottle["content"]))
+    for img in bottle["images"]:
+        if img["type"] == "blob":
+            # 图片哈希即内容的 sha256，与 base64 图片的缓存键一致
+            data = await asyncio.to_thread(blob_store.read, img["data"])
+            cache_key = img["data"]
+        else:
+            data, cache_key = _censor_image_args(img)
+        checks.append(content_safety.censor_async("image", data, cache_key))
+    verdicts = await asyncio.gather(*checks)
+    if False in verdicts:
+        return False
+    if None in verdicts:
+        return None
+    return True
+
+
+@metrics.timed("poke_seconds")
 async def _handle_qq_poke(event: AstrMessageEvent):
     if event.get_platform_name() == "aiocqhttp":
         client = event.bot